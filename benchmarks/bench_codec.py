@@ -0,0 +1,74 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" throughput of MAB_MGB_protocol: encode, decode, stuffing and crc. """
+
+import importlib.util
+
+import common
+
+from mab_mgb_protocol import MAB_MGB_protocol, MAB_MGB_stream_decoder, MAB_MGB_crc16, MAB_MGB_frame
+
+PAYLOADS = {
+    "small": bytes([0x10, 0x20, 0x30, 0x40]),
+    # ~ the longest payload that fits the len byte, with no reserved byte
+    "max": bytes((0x40 + i % 0x80) for i in range(MAB_MGB_protocol.MAX_PACKET_LEN - 8 - 1)),
+    # ~ every byte is stuffed: the stuffed packet is as long as the len byte allows
+    "escape_heavy": bytes([0x02, 0x03, 0x1B] * 35),
+}
+
+ROUND_SIZE = 32
+BATCH_SIZE = 1024
+
+
+def run(min_time=0.5):
+
+    protocol = MAB_MGB_protocol()
+    addr = MAB_MGB_protocol.MAB_ADDR
+    cmd_code = 0x20
+    results = {}
+    # ~ decode_batch() needs numpy, which is optional
+    has_numpy = importlib.util.find_spec('numpy') is not None
+    MAB_MGB_frame.register_schema(cmd_code, [('head', 'I')])
+
+    for name, payload in PAYLOADS.items():
+        packet = protocol.encode_msg(addr, cmd_code, payload)
+        stuffed = protocol._stuff_buffer(payload)  # pylint: disable=protected-access
+        out = bytearray(256)
+        round_ = [(addr, cmd_code, payload)] * ROUND_SIZE
+        round_out = bytearray()
+        stream = packet * ROUND_SIZE
+        decoder = MAB_MGB_stream_decoder(protocol)
+
+        cases = {
+            "encode_msg": (lambda: protocol.encode_msg(addr, cmd_code, payload), len(packet)),
+            "encode_many_{}".format(ROUND_SIZE): (lambda: protocol.encode_many(round_, round_out), len(packet) * ROUND_SIZE),
+            "encode_cached": (lambda: protocol.encode_cached(addr, cmd_code, payload), len(packet)),
+            "decode_msg": (lambda: protocol.decode_msg(packet), len(packet)),
+            "decode_msg_into": (lambda: protocol.decode_msg_into(packet, out), len(packet)),
+            "stream_decoder_{}".format(ROUND_SIZE): (lambda: decoder.feed(stream), len(stream)),
+            "stuff": (lambda: protocol._stuff_buffer(payload), len(payload)),  # pylint: disable=protected-access
+            "unstuff": (lambda: protocol._unstuff_buffer(stuffed), len(stuffed)),  # pylint: disable=protected-access
+        }
+        if has_numpy:
+            batch = [packet] * BATCH_SIZE
+            cases["decode_batch_{}".format(BATCH_SIZE)] = (lambda: protocol.decode_batch(batch, cmd_code), len(packet) * BATCH_SIZE)
+        for backend in MAB_MGB_crc16.backends:
+            crc16 = MAB_MGB_crc16.backends[backend]
+            cases["crc16_" + backend] = ((lambda crc16=crc16: crc16(packet, 0)), len(packet))
+
+        for case, (fct, size) in cases.items():
+            ops = common.measure(fct, min_time)
+            results["{}/{}".format(case, name)] = {
+                "ops_per_s": ops,
+                "bytes_per_s": ops * size,
+            }
+
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" end-to-end frames per second and latency through FileDriver (over a pair of FIFOs),
+    rs485_Master and SerialDriver (over a pty pair). Every line carries its send time, so that the
+    latency is measured from write to the PACKET_RECV event / callback. """
+
+import os
+import pty
+import tty
+import time
+import asyncio
+import tempfile
+
+import common
+
+from driver import FileDriver, SerialDriver
+from rs485_master import rs485_Master
+
+N_LINES = 5000
+TIMEOUT = 30.0
+
+
+def _line():
+    return "{:020d}".format(time.monotonic_ns())
+
+
+async def _wait_for(received, n, timeout):
+    t_end = time.monotonic() + timeout
+    while len(received) < n and time.monotonic() < t_end:
+        await asyncio.sleep(0.01)
+
+
+async def bench_file_driver(n_lines=N_LINES):
+
+    tmpdir = tempfile.mkdtemp()
+    fifo_a = os.path.join(tmpdir, 'fifo_a')
+    fifo_b = os.path.join(tmpdir, 'fifo_b')
+    os.mkfifo(fifo_a)
+    os.mkfifo(fifo_b)
+
+    latencies = []
+
+    def observe(ev):
+        latencies.append(time.monotonic_ns() - int(ev.text))
+
+    endpoint_A = FileDriver()
+    endpoint_B = FileDriver()
+    endpoint_B.subscribe(observe, event=FileDriver.Event.PACKET_RECV)
+    try:
+        endpoint_A.connect(port_rx=fifo_a, port_tx=fifo_b)
+        endpoint_B.connect(port_rx=fifo_b, port_tx=fifo_a)
+        await asyncio.sleep(0.2)
+
+        t0 = time.monotonic()
+        for i in range(n_lines):
+            # ~ the write queue is bounded: wait for the writer when it is full
+            while not endpoint_A.write(_line()):
+                await asyncio.sleep(0)
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        await _wait_for(latencies, n_lines, TIMEOUT)
+        elapsed = time.monotonic() - t0
+    finally:
+        endpoint_A.disconnect()
+        endpoint_B.disconnect()
+        await asyncio.sleep(0.1)
+        os.remove(fifo_a)
+        os.remove(fifo_b)
+        os.rmdir(tmpdir)
+
+    ret = {"lines": len(latencies), "frames_per_s": len(latencies) / elapsed}
+    ret.update(common.latency_stats(latencies))
+    return ret
+
+
+async def bench_rs485_master(n_lines=N_LINES):
+
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(master_fd)
+    tty.setraw(slave_fd)
+    device_name = os.ttyname(slave_fd)
+
+    latencies = []
+
+    def callback(signal, content, timestamp):
+        if signal == 'recv_from_serial':
+            latencies.append(time.monotonic_ns() - int(content))
+
+    port = rs485_Master()
+    port.set_callback(callback)
+    loop = asyncio.get_running_loop()
+    try:
+        port.connect(device_name=device_name, device_baudrate=115200)
+        await asyncio.sleep(0.2)
+
+        t0 = time.monotonic()
+        for i in range(n_lines):
+            data = (_line() + "\n").encode()
+            await loop.run_in_executor(None, os.write, master_fd, data)
+        await _wait_for(latencies, n_lines, TIMEOUT)
+        elapsed = time.monotonic() - t0
+    finally:
+        port.disconnect()
+        await asyncio.sleep(0.1)
+        os.close(master_fd)
+        os.close(slave_fd)
+
+    ret = {"lines": len(latencies), "frames_per_s": len(latencies) / elapsed}
+    ret.update(common.latency_stats(latencies))
+    return ret
+
+
+async def bench_serial_driver(n_lines=N_LINES):
+
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(master_fd)
+    device_name = os.ttyname(slave_fd)
+
+    latencies = []
+
+    def observe(ev):
+        latencies.append(time.monotonic_ns() - int(ev.text))
+
+    driver = SerialDriver()
+    driver.subscribe(observe, event=SerialDriver.Event.PACKET_RECV)
+    loop = asyncio.get_running_loop()
+    try:
+        driver.connect(device_name=device_name, device_baudrate=115200)
+        await asyncio.sleep(0.2)
+
+        t0 = time.monotonic()
+        for i in range(n_lines):
+            data = (_line() + "\n").encode()
+            await loop.run_in_executor(None, os.write, master_fd, data)
+        await _wait_for(latencies, n_lines, TIMEOUT)
+        elapsed = time.monotonic() - t0
+    finally:
+        driver.disconnect()
+        await asyncio.sleep(0.1)
+        os.close(master_fd)
+        os.close(slave_fd)
+
+    ret = {"lines": len(latencies), "frames_per_s": len(latencies) / elapsed}
+    ret.update(common.latency_stats(latencies))
+    return ret
+
+
+def run(n_lines=N_LINES):
+
+    async def _run():
+        return {
+            "file_driver_fifo": await bench_file_driver(n_lines),
+            "rs485_master_pty": await bench_rs485_master(n_lines),
+            "serial_driver_pty": await bench_serial_driver(n_lines),
+        }
+
+    return asyncio.run(_run())
+
+
+if __name__ == '__main__':
+    import json
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" cold start of the server: seconds from the start of the process to listening and to the
+    first data received from a bus opened at startup, by launch profile. The bus is a pty of
+    rs485_simulator sending unsolicited bursts; the times are read from GET /metrics. """
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import urllib.request
+
+import common
+
+SRC = os.path.join(common.ROOT, 'src')
+N_RUNS = 3
+TIMEOUT = 20.0
+
+
+def _free_port():
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _launch(module, args):
+
+    return subprocess.Popen(
+        [sys.executable, '-c', 'from {} import main; main()'.format(module)] + args,
+        cwd=SRC, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def _cold_start(profile, device_name):
+
+    port = _free_port()
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump({
+            "listen_port": port,
+            "profile": profile,
+            "buses": [{"device_name": device_name, "device_baudrate": 115200, "protocol": "mab_mgb"}],
+        }, f)
+    server = _launch('rs485_master', [f.name])
+    try:
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=1) as r:
+                    startup = json.load(r)["startup"]
+                if startup["first_rx"].get(device_name) is not None:
+                    return startup["listening"], startup["first_rx"][device_name]
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError('no data from {} within {} s'.format(device_name, TIMEOUT))
+    finally:
+        server.terminate()
+        server.wait()
+        os.unlink(f.name)
+
+
+def run(n_runs=N_RUNS):
+
+    simulator = _launch('rs485_simulator', ['--burst-interval', '0.005', '--burst-size', '1'])
+    try:
+        # ~ the name of the pty, after the log lines
+        device_name = ''
+        while not device_name.startswith('/dev/'):
+            device_name = simulator.stdout.readline().strip()
+        results = {}
+        for profile in ('development', 'production'):
+            runs = [_cold_start(profile, device_name) for _ in range(n_runs)]
+            results[profile] = {
+                "listening_s": min(listening for listening, _ in runs),
+                "first_rx_s": min(first_rx for _, first_rx in runs),
+            }
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
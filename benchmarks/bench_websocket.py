@@ -0,0 +1,122 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" cost of the websocket fan-out: N clients, connected to a local Tornado server, share the
+    same port (a pty pair) and all of them receive every line written on the other side of it.
+    The clients run in the same process, so the CPU time includes their decoding too. """
+
+import os
+import pty
+import tty
+import time
+import json
+import asyncio
+
+import common
+
+import tornado.web            # pylint: disable=import-error
+import tornado.httpserver     # pylint: disable=import-error
+import tornado.testing        # pylint: disable=import-error
+import tornado.websocket      # pylint: disable=import-error
+
+from rs485_master import Application, BINARY_SUBPROTOCOL, BINARY_RECORD_HEADER
+
+N_CLIENTS = (1, 4, 16)
+N_LINES = 2000
+TIMEOUT = 30.0
+
+
+async def _client(url, device_name, n_lines, binary):
+
+    ws = await tornado.websocket.websocket_connect(url, subprotocols=[BINARY_SUBPROTOCOL] if binary else None)
+    ws.write_message(json.dumps({
+        "command_name": "connect",
+        "arguments": {"device_name": device_name, "device_baudrate": 115200}}))
+    received = [0]
+    ready = asyncio.Event()
+
+    async def read():
+        while received[0] < n_lines:
+            message = await ws.read_message()
+            if message is None:
+                break
+            if isinstance(message, bytes):
+                offset = 0
+                while offset < len(message):
+                    length = BINARY_RECORD_HEADER.unpack_from(message, offset)[3]
+                    offset += BINARY_RECORD_HEADER.size + length
+                    received[0] += 1
+                continue
+            data = json.loads(message)
+            if data.get("signal") == "status" and data.get("content") == "connected":
+                ready.set()
+            elif data.get("signal") == "recv_from_serial":
+                received[0] += 1
+            elif data.get("signal") == "batch":
+                received[0] += sum(1 for s in data["content"] if s["signal"] == "recv_from_serial")
+
+    task = asyncio.ensure_future(read())
+    await ready.wait()
+    return (ws, task, received)
+
+
+async def bench_fan_out(n_clients, n_lines=N_LINES, binary=False):
+
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(master_fd)
+    tty.setraw(slave_fd)
+    device_name = os.ttyname(slave_fd)
+
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(tornado.web.Application(Application.url_map))
+    server.add_sockets([sock])
+    url = "ws://127.0.0.1:{}/websocket".format(port)
+    loop = asyncio.get_running_loop()
+
+    try:
+        clients = [await _client(url, device_name, n_lines, binary) for _ in range(n_clients)]
+
+        t0 = time.monotonic()
+        cpu0 = time.process_time()
+        data = b''.join("line {:08d}\n".format(i).encode() for i in range(n_lines))
+        await loop.run_in_executor(None, os.write, master_fd, data)
+        await asyncio.wait_for(asyncio.gather(*[task for _, task, _ in clients]), TIMEOUT)
+        elapsed = time.monotonic() - t0
+        cpu = time.process_time() - cpu0
+        delivered = sum(received[0] for _, _, received in clients)
+
+        for ws, _, _ in clients:
+            ws.close()
+        await asyncio.sleep(0.2)
+    finally:
+        server.stop()
+        os.close(master_fd)
+        os.close(slave_fd)
+
+    return {
+        "clients": n_clients,
+        "lines": n_lines,
+        "delivered": delivered,
+        "elapsed_s": elapsed,
+        "deliveries_per_s": delivered / elapsed,
+        "cpu_us_per_delivery": cpu / delivered * 1e6 if delivered else None,
+    }
+
+
+def run(n_lines=N_LINES):
+
+    async def _run():
+        results = {}
+        for binary in (False, True):
+            for n_clients in N_CLIENTS:
+                name = "fan_out_{}_{}".format("binary" if binary else "json", n_clients)
+                results[name] = await bench_fan_out(n_clients, n_lines, binary)
+        return results
+
+    return asyncio.run(_run())
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
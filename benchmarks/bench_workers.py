@@ -0,0 +1,108 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" many busy buses at once, each served in the server's process or by a worker process of its
+    own (see bus_workers). Every bus is the pty of an rs485_simulator, in a process of its own,
+    sending unsolicited bursts of frames; the benchmark counts the frames received by the server
+    in a fixed time and the CPU time spent by the server's process. """
+
+import os
+import sys
+import time
+import json
+import asyncio
+import subprocess
+
+import common
+
+from rs485_master import rs485_PortRegistry
+
+SRC = os.path.join(common.ROOT, 'src')
+N_BUSES = (1, 2, 4)
+DURATION = 2.0
+TIMEOUT = 20.0
+
+
+def _start_simulator():
+
+    simulator = subprocess.Popen(
+        [sys.executable, '-c', 'from rs485_simulator import main; main()',
+         '--burst-interval', '0.001', '--burst-size', '20', '--reply-size', '32'],
+        cwd=SRC,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    # ~ the name of the pty, after the log lines
+    device_name = ''
+    while not device_name.startswith('/dev/'):
+        device_name = simulator.stdout.readline().strip()
+    return simulator, device_name
+
+
+async def _wait_status(ports, status, timeout):
+    t_end = time.monotonic() + timeout
+    while any(port.get_status() != status for port in ports) and time.monotonic() < t_end:
+        await asyncio.sleep(0.01)
+
+
+async def bench_buses(n_buses, worker, duration=DURATION):
+
+    simulators = [_start_simulator() for _ in range(n_buses)]
+    registry = rs485_PortRegistry()
+    frames = [0]
+
+    def count(signal, content, timestamp):  # pylint: disable=unused-argument
+        if signal == 'recv_frame':
+            frames[0] += 1
+
+    try:
+        registry.open_buses([
+            {"device_name": device_name, "device_baudrate": 115200, "protocol": "mab_mgb", "worker": worker}
+            for _, device_name in simulators])
+        ports = list(registry.get_open_ports().values())
+        for port in ports:
+            port.add_callback(count)
+        await _wait_status(ports, 'connected', TIMEOUT)
+
+        # ~ warm up, then measure
+        await asyncio.sleep(0.5)
+        frames[0] = 0
+        t0 = time.monotonic()
+        cpu0 = time.process_time()
+        await asyncio.sleep(duration)
+        received = frames[0]
+        elapsed = time.monotonic() - t0
+        cpu = time.process_time() - cpu0
+
+        for port in ports:
+            port.disconnect()
+        await _wait_status(ports, 'disconnected', 5.0)
+    finally:
+        for simulator, _ in simulators:
+            simulator.terminate()
+            simulator.wait()
+
+    return {
+        "buses": n_buses,
+        "worker": worker,
+        "frames": received,
+        "frames_per_s": received / elapsed,
+        "server_cpu_us_per_frame": cpu / received * 1e6 if received else None,
+    }
+
+
+def run(duration=DURATION):
+
+    async def _run():
+        results = {}
+        for worker in (False, True):
+            for n_buses in N_BUSES:
+                name = "buses_{}_{}".format("worker" if worker else "in_process", n_buses)
+                results[name] = await bench_buses(n_buses, worker, duration)
+        return results
+
+    return asyncio.run(_run())
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
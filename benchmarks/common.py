@@ -0,0 +1,76 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" helpers shared by the benchmarks: path setup, timing and machine-readable results. """
+
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, '..'))
+
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+
+def get_version():
+
+    with open(os.path.join(ROOT, '__version__'), encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def measure(fct, min_time=0.5):
+    """ calls fct() repeatedly for at least min_time seconds.
+    returns: calls per second """
+
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fct()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            return n / elapsed
+        n = n * 2 if elapsed < min_time / 10 else int(n * min_time / elapsed) + 1
+
+
+def percentile(samples, p):
+
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_stats(samples_ns):
+    " returns p50, p99 and max of a list of latencies in nanoseconds, in microseconds."
+
+    return {
+        "latency_p50_us": percentile(samples_ns, 50) / 1000.0 if samples_ns else None,
+        "latency_p99_us": percentile(samples_ns, 99) / 1000.0 if samples_ns else None,
+        "latency_max_us": max(samples_ns) / 1000.0 if samples_ns else None,
+    }
+
+
+def save_results(suite_results, path):
+    """ writes the results as JSON, together with what is needed to compare runs:
+    version of the package, python, machine and date. """
+
+    doc = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        "results": suite_results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+
+    return doc
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" compares two result files of run_all.py, flagging the regressions:
+
+    $ python benchmarks/compare.py old.json new.json [--threshold 10]
+
+    exits with status 1 if any throughput dropped, or latency grew, by more than threshold percent. """
+
+import sys
+import json
+import argparse
+
+# ~ for these metrics, lower is better
+LOWER_IS_BETTER = ('latency_p50_us', 'latency_p99_us', 'latency_max_us', 'cpu_us_per_delivery', 'elapsed_s')
+HIGHER_IS_BETTER = ('ops_per_s', 'bytes_per_s', 'frames_per_s', 'deliveries_per_s')
+
+
+def _flatten(results, prefix=''):
+
+    for key, value in results.items():
+        name = prefix + '/' + key if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, (int, float)):
+            yield (name, value)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent')
+    args = parser.parse_args()
+
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    print("{} ({}) -> {} ({})".format(old['version'], old['date'], new['version'], new['date']))
+
+    old_values = dict(_flatten(old['results']))
+    regressions = 0
+    for name, new_value in _flatten(new['results']):
+        metric = name.rsplit('/', 1)[-1]
+        old_value = old_values.get(name)
+        if not old_value or metric not in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            continue
+        change = (new_value - old_value) / old_value * 100.0
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        flag = ''
+        if worse > args.threshold:
+            flag = '  <-- REGRESSION'
+            regressions += 1
+        print("{:70s} {:14.1f} {:14.1f} {:+7.1f}%{}".format(name, old_value, new_value, change, flag))
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=invalid-name
+
+""" runs the benchmark suite and saves the results as JSON:
+
+    $ python benchmarks/run_all.py [--output bench_results.json] [--only codec,drivers,websocket,startup,workers] [--quick]
+
+    two result files can then be compared with benchmarks/compare.py. """
+
+import sys
+import json
+import logging
+import argparse
+
+import common
+
+import bench_codec
+import bench_drivers
+import bench_websocket
+import bench_startup
+import bench_workers
+
+SUITES = {
+    "codec": lambda quick: bench_codec.run(min_time=0.1 if quick else 0.5),
+    "drivers": lambda quick: bench_drivers.run(n_lines=500 if quick else bench_drivers.N_LINES),
+    "websocket": lambda quick: bench_websocket.run(n_lines=200 if quick else bench_websocket.N_LINES),
+    "startup": lambda quick: bench_startup.run(n_runs=1 if quick else bench_startup.N_RUNS),
+    "workers": lambda quick: bench_workers.run(duration=0.5 if quick else bench_workers.DURATION),
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--only', default=','.join(SUITES), help='comma separated list of: ' + ', '.join(SUITES))
+    parser.add_argument('--quick', action='store_true', help='shorter runs, for a smoke test')
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level="WARNING")
+
+    results = {}
+    for name in args.only.split(','):
+        print("running {}...".format(name), file=sys.stderr)
+        results[name] = SUITES[name](args.quick)
+
+    doc = common.save_results(results, args.output)
+    print(json.dumps(doc, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
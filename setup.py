@@ -46,12 +46,19 @@ def main():
         include_package_data=True,
         scripts=[
             'bin/rs485_master',
+            'bin/rs485_simulator',
         ],
         install_requires=[
             'tornado',
             'aioserial',
             'aiofiles'
         ],
+        extras_require={
+            # ~ MAB_MGB_protocol.decode_batch()
+            'batch': ['numpy'],
+            # ~ the test suite, decode_batch() included
+            'test': ['pytest', 'numpy'],
+        },
     )
 
 
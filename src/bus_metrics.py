@@ -0,0 +1,105 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+""" counters cheap enough to be always on: all the storage is preallocated at construction
+    and updating a counter is a few integer operations, with no lock (everything runs on
+    the event loop) and no formatting. Formatting happens in as_dict(), when asked for. """
+
+from array import array
+
+
+class RateCounter:
+
+    """ frames and bytes over the last window seconds, in per-second buckets.
+
+        add() takes the timestamp (ns) the caller already has, so that counting needs no clock read.
+        The rates are averaged over the last complete seconds of the window.
+    """
+
+    WINDOW = 10
+
+    def __init__(self, window=WINDOW):
+
+        self.window = window
+        self.frames = 0
+        self.bytes = 0
+        self._seconds = array('q', [-1]) * window
+        self._frames = array('Q', [0]) * window
+        self._bytes = array('Q', [0]) * window
+
+    def add(self, frames, size, timestamp):
+
+        second = timestamp // 1000000000
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._frames[slot] = 0
+            self._bytes[slot] = 0
+        self._frames[slot] += frames
+        self._bytes[slot] += size
+        self.frames += frames
+        self.bytes += size
+
+    def rates(self, timestamp):
+        " returns (frames per second, bytes per second)."
+
+        second = timestamp // 1000000000
+        frames = 0
+        size = 0
+        for s in range(second - self.window + 1, second):
+            slot = s % self.window
+            if self._seconds[slot] == s:
+                frames += self._frames[slot]
+                size += self._bytes[slot]
+
+        return frames / (self.window - 1), size / (self.window - 1)
+
+    def as_dict(self, timestamp):
+
+        frames_per_second, bytes_per_second = self.rates(timestamp)
+        return {
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "frames_per_second": frames_per_second,
+            "bytes_per_second": bytes_per_second,
+        }
+
+
+class LatencyHistogram:
+
+    """ counts of latencies in power-of-two buckets of microseconds:
+        bucket 0 holds latencies under 1 us, bucket n (n > 0) those in [2**(n-1), 2**n) us,
+        the last bucket everything above. """
+
+    BUCKETS = 24
+
+    def __init__(self, buckets=BUCKETS):
+
+        self.buckets = buckets
+        self.count = 0
+        self.sum = 0.0
+        self._counts = array('Q', [0]) * buckets
+
+    def add(self, latency):
+        " latency in seconds."
+
+        n = int(latency * 1000000).bit_length()
+        if n >= self.buckets:
+            n = self.buckets - 1
+        self._counts[n] += 1
+        self.count += 1
+        self.sum += latency
+
+    def as_dict(self):
+        " the buckets are listed by their upper bound in us (None for the last one)."
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets_us": [2 ** n for n in range(self.buckets - 1)] + [None],
+            "counts": list(self._counts),
+        }
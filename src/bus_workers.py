@@ -0,0 +1,304 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+""" serial ports served by worker processes, one per bus.
+
+    A WorkerPort has the interface of rs485_Master, but the rs485_Master (reading, decoding,
+    polling, tracing) runs in a child process, with its own event loop and its own core.
+    Parent and worker talk over a multiprocessing.Pipe:
+
+     parent -> worker: ('call', call_id, method_name, kwargs) and ('stop',)
+     worker -> parent: ('signals', [(signal, content, timestamp), ...]) and ('result', call_id, value)
+
+    The signals raised within one iteration of the worker's event loop travel in a single message.
+
+    The payload schemas registered in the parent (MAB_MGB_frame.register_schema()) are copied to
+    the worker when it starts: schemas registered later are not seen by the running workers.
+"""
+
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import traceback
+import multiprocessing
+
+from mab_mgb_protocol import MAB_MGB_frame
+
+
+class WorkerPort:
+
+    """ a serial port served by a worker process (see the module docstring).
+
+        Methods that query or drive the port (send_on_serial, transact, get_metrics, ...) return
+        awaitables resolving to the value returned by the rs485_Master of the worker.
+    """
+
+    START_METHOD = 'spawn'
+    STOP_TIMEOUT = 2.0
+    # ~ messages handled per callback: a busy worker cannot starve the other readers of the loop
+    MAX_MESSAGES_PER_CALLBACK = 64
+
+    def __init__(self):
+
+        self.connect_parameters = {}
+        self._callbacks = []
+        self._current_status = 'wait_init'
+        # ~ called once the port is closed or has failed, as rs485_Master.on_disconnected
+        self.on_disconnected = None
+        self._process = None
+        self._conn = None
+        self._calls = {}
+        self._next_call_id = 0
+
+    def connect(self, *args, **kwargs):
+
+        if self._process is not None:
+            return False
+
+        self.connect_parameters = kwargs
+        context = multiprocessing.get_context(self.START_METHOD)
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_worker_main, args=(child_conn, kwargs, _schema_specs()),
+            name="bus worker {}".format(kwargs.get('device_name')), daemon=True)
+        self._process.start()
+        child_conn.close()
+        asyncio.get_event_loop().add_reader(self._conn.fileno(), self._on_readable)
+        logging.info("started worker {} for {}".format(self._process.pid, kwargs.get('device_name')))
+        return True
+
+    def disconnect(self, *args, **kwargs):
+
+        if self._conn is None or self._current_status == 'disconnected':
+            return False
+
+        try:
+            self._conn.send(('stop',))
+        except (BrokenPipeError, OSError):
+            self._close()
+            return False
+        # ~ the worker exits once its port is closed; stop it anyway if it does not
+        asyncio.get_event_loop().call_later(self.STOP_TIMEOUT, self._close)
+        return True
+
+    def send_on_serial(self, *args, **kwargs):
+        return self._call('send_on_serial', kwargs)
+
+    def transact(self, *args, **kwargs):
+        return self._call('transact', kwargs)
+
+    def add_poll(self, *args, **kwargs):
+        return self._call('add_poll', kwargs)
+
+    def remove_poll(self, *args, **kwargs):
+        return self._call('remove_poll', kwargs)
+
+    def start_polling(self, *args, **kwargs):
+        return self._call('start_polling', kwargs)
+
+    def stop_polling(self, *args, **kwargs):
+        return self._call('stop_polling', kwargs)
+
+    def get_poll_stats(self, *args, **kwargs):
+        return self._call('get_poll_stats', kwargs)
+
+    def dump_trace(self, *args, **kwargs):
+        return self._call('dump_trace', kwargs)
+
+    def get_metrics(self, *args, **kwargs):
+        return self._call('get_metrics', kwargs)
+
+    def get_history(self, *args, **kwargs):
+        return self._call('get_history', kwargs)
+
+    def query_history(self, *args, **kwargs):
+        return self._call('query_history', kwargs)
+
+    def set_callback(self, fct):
+        self._callbacks = [fct]
+
+    def add_callback(self, fct):
+        self._callbacks.append(fct)
+
+    def remove_callback(self, fct):
+        self._callbacks.remove(fct)
+
+    def get_status(self):
+        return self._current_status
+
+    def _call(self, method_name, kwargs):
+
+        future = asyncio.get_event_loop().create_future()
+        if self._conn is None:
+            future.set_result(False)
+            return future
+        call_id = self._next_call_id
+        self._next_call_id += 1
+        self._calls[call_id] = future
+        try:
+            self._conn.send(('call', call_id, method_name, kwargs))
+        except (BrokenPipeError, OSError):
+            del self._calls[call_id]
+            future.set_result(False)
+        return future
+
+    def _on_readable(self):
+
+        conn = self._conn
+        try:
+            # ~ the reader is level triggered: what is left is read at the next iteration of the loop
+            for _ in range(self.MAX_MESSAGES_PER_CALLBACK):
+                if conn is None or not conn.poll():
+                    break
+                message = conn.recv()
+                if message[0] == 'signals':
+                    for signal, content, timestamp in message[1]:
+                        if signal == 'status':
+                            self._current_status = content
+                        self._send_back(signal, content, timestamp)
+                elif message[0] == 'result':
+                    future = self._calls.pop(message[1], None)
+                    if future is not None and not future.done():
+                        future.set_result(message[2])
+        except (EOFError, OSError):
+            # ~ the worker is gone
+            self._close()
+
+    def _send_back(self, signal, content, timestamp):
+        for fct in self._callbacks:
+            try:
+                fct(signal, content, timestamp)
+            except:  # pylint: disable=bare-except
+                logging.info("unable to send back: {}".format(traceback.format_exc()))
+
+    def _close(self):
+
+        if self._conn is not None:
+            asyncio.get_event_loop().remove_reader(self._conn.fileno())
+            self._conn.close()
+            self._conn = None
+        for future in self._calls.values():
+            if not future.done():
+                future.set_result(False)
+        self._calls.clear()
+        if self._process is not None:
+            process, self._process = self._process, None
+            if process.is_alive():
+                process.terminate()
+            # ~ reaped once it has exited, without blocking the loop
+            _reap(process)
+        if self._current_status != 'disconnected':
+            self._current_status = 'disconnected'
+            self._send_back('status', 'disconnected', time.time_ns())
+        if self.on_disconnected is not None:
+            on_disconnected, self.on_disconnected = self.on_disconnected, None
+            on_disconnected()
+
+
+def _reap(process, interval=0.01):
+    " waits for the exit of process from the event loop, polling without blocking."
+
+    # ~ exitcode polls waitpid() with WNOHANG
+    if process.exitcode is None:
+        asyncio.get_event_loop().call_later(interval, _reap, process, interval)
+        return
+    process.close()
+
+
+def _schema_specs():
+    " the registered payload schemas as picklable (cmd_code, fields, name), for register_schema() "
+
+    return [(cmd_code, list(zip(schema.field_names, schema.formats)), schema.name)
+            for cmd_code, schema in MAB_MGB_frame.schemas.items()]
+
+
+def _worker_main(conn, conn_params, schema_specs=()):
+
+    logging.basicConfig(
+        stream=sys.stdout, level="INFO",
+        format="[%(asctime)s]%(levelname)s %(processName)s %(funcName)s() %(filename)s:%(lineno)d %(message)s")
+
+    for cmd_code, fields, name in schema_specs:
+        MAB_MGB_frame.register_schema(cmd_code, fields, name)
+
+    asyncio.run(_worker_run(conn, conn_params))
+
+
+async def _worker_run(conn, conn_params):
+
+    from rs485_master import rs485_Master   # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    signals = []
+
+    def flush():
+        batch = signals[:]
+        del signals[:]
+        try:
+            conn.send(('signals', batch))
+        except (BrokenPipeError, OSError):
+            stopping.set()
+
+    def callback(signal, content, timestamp):
+        if not signals:
+            loop.call_soon(flush)
+        signals.append((signal, content, timestamp))
+        if signal == 'status' and content == 'disconnected':
+            # ~ the port failed or was closed: the worker is done
+            stopping.set()
+
+    async def answer(call_id, ret):
+        try:
+            value = await ret
+        except Exception:  # pylint: disable=broad-except
+            logging.info("call failed: {}".format(traceback.format_exc()))
+            value = False
+        try:
+            conn.send(('result', call_id, value))
+        except (BrokenPipeError, OSError):
+            stopping.set()
+
+    port = rs485_Master()
+
+    def on_readable():
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message[0] == 'stop':
+                    stopping.set()
+                    return
+                _, call_id, method_name, kwargs = message
+                try:
+                    ret = getattr(port, method_name)(**kwargs)
+                except Exception:  # pylint: disable=broad-except
+                    logging.info("call failed: {}".format(traceback.format_exc()))
+                    ret = False
+                if inspect.isawaitable(ret):
+                    asyncio.ensure_future(answer(call_id, ret))
+                else:
+                    conn.send(('result', call_id, ret))
+        except (EOFError, OSError):
+            # ~ the parent is gone
+            stopping.set()
+
+    port.set_callback(callback)
+    loop.add_reader(conn.fileno(), on_readable)
+    port.connect(**conn_params)
+
+    await stopping.wait()
+
+    port.disconnect()
+    for _ in range(100):
+        if port.get_status() == 'disconnected':
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0)
+    loop.remove_reader(conn.fileno())
+    conn.close()
@@ -1,31 +1,146 @@
 import logging
 import traceback
+import time
 
+import os
 import abc
 import sys
+import termios
 
 import asyncio
-import aiofiles
+import inspect
+import collections
+
+from traffic_trace import TraceRing, RX, TX
+from traffic_capture import CaptureWriter, CaptureReader
+from mab_mgb_protocol import MAB_MGB_stream_decoder
 
 from enum import Enum, auto
 
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {'urgent': PRIORITY_URGENT, 'normal': PRIORITY_NORMAL, 'bulk': PRIORITY_BULK}
+
+def parse_priority(priority):
+    """ priority as given by a client: one of PRIORITY_NAMES, an
+    integer or None (PRIORITY_NORMAL). Raises ValueError. """
+    if priority is None:
+        return PRIORITY_NORMAL
+    if isinstance(priority, str) and priority in PRIORITY_NAMES:
+        return PRIORITY_NAMES[priority]
+    priority = int(priority)
+    if not PRIORITY_URGENT <= priority <= PRIORITY_BULK:
+        raise ValueError("invalid priority:{}".format(priority))
+    return priority
+
 class Event(object):
-    pass
+    """ What Observable.fire() passes to the subscribers: source, event
+    (the type of event) and attachment, the keyword arguments of fire(),
+    whose items can be read as attributes too (e.g. ev.text).
+    """
+    __slots__ = ('source', 'event', 'attachment')
+
+    def __init__(self, source, event, attachment):
+        self.source = source
+        self.event = event
+        self.attachment = attachment
+
+    def __getattr__(self, name):
+        try:
+            return self.attachment[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+class AsyncSubscriber(object):
+    """ Calls callback (a function or a coroutine function) with the
+    events, from a task of its own: the one firing only queues them.
+    At most max_queued events wait in the queue, then the oldest are
+    dropped and counted in dropped.
+    """
+    def __init__(self, callback, max_queued):
+        self.callback = callback
+        self.max_queued = max_queued
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def __call__(self, e):
+        if len(self._queue) >= self.max_queued:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(e)
+        self._ready.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._queue.clear()
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            if not queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            try:
+                ret = self.callback(queue.popleft())
+                if inspect.isawaitable(ret):
+                    await ret
+                else:
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.info("event subscriber failed: {}".format(traceback.format_exc()))
 
 class Observable(object):
+    """ subscribe(callback) delivers all the events to callback,
+    subscribe(callback, event = X) only those of type X. An Event is
+    allocated only when somebody subscribed to its type.
+
+    With asynchronous = True the callback is wrapped in an
+    AsyncSubscriber, so that a slow subscriber does not stall the
+    one firing (e.g. the read loop of a driver).
+    """
+    ASYNC_MAX_QUEUED = 1000
+
     def __init__(self):
+        # ~ the subscribers of all the events
         self.callbacks = []
+        # ~ event -> its subscribers
+        self._typed_callbacks = {}
         
-    def subscribe(self, callback):
-        self.callbacks.append(callback)
+    def subscribe(self, callback, event = None, asynchronous = False, max_queued = ASYNC_MAX_QUEUED):
+        if asynchronous:
+            callback = AsyncSubscriber(callback, max_queued)
+        if event is None:
+            self.callbacks.append(callback)
+        else:
+            self._typed_callbacks.setdefault(event, []).append(callback)
+        return callback
+
+    def unsubscribe(self, callback, event = None):
+        callbacks = self.callbacks if event is None else self._typed_callbacks.get(event, [])
+        for fn in list(callbacks):
+            if fn == callback or getattr(fn, 'callback', None) == callback:
+                callbacks.remove(fn)
+                if isinstance(fn, AsyncSubscriber):
+                    fn.close()
         
     def fire(self, event, **attrs):
-        e = Event()
-        e.source = self
-        e.event = event
-        e.attachment = attrs
-        for k, v in attrs.items():
-            setattr(e, k, v)
+        typed = self._typed_callbacks.get(event)
+        if not typed and not self.callbacks:
+            return
+        e = Event(self, event, attrs)
+        if typed:
+            for fn in typed:
+                fn(e)
         for fn in self.callbacks:
             fn(e)
 
@@ -59,7 +174,7 @@ class AbstractDriver(abc.ABC, Observable):
         pass
 
     @abc.abstractmethod
-    def write(self, text):
+    def write(self, text, priority = PRIORITY_NORMAL):
         """ Implement me! """
         pass
 
@@ -70,11 +185,179 @@ class AbstractDriver(abc.ABC, Observable):
         self.state = state
         self.fire(AbstractDriver.Event.STATE_CHANGED, state = state)
         
+async def coalesce(queue, flush_deadline = 0.0, max_size = 4096):
+    """ Waits for the first chunk of bytes in queue, then collects
+    the chunks queued after it and returns all of them joined, to be
+    sent with a single write.
+
+    With flush_deadline == 0 only what is already queued is taken,
+    otherwise further chunks are waited for, up to flush_deadline
+    seconds after the first one: this bounds the added latency.
+    Collection stops as soon as max_size bytes are reached.
+    """
+    chunks = [await queue.get()]
+    size = len(chunks[0])
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + flush_deadline
+    while size < max_size:
+        try:
+            chunk = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks)
+
+class PriorityWriteQueue(object):
+    """ The bounded transmit queue of a driver, with priority classes.
+
+    get() returns the chunks of the most urgent class first (FIFO
+    within a class), so that e.g. an emergency stop does not wait
+    behind a flood of status polls. It has the interface of
+    asyncio.Queue used by coalesce().
+
+    Each class can fill the queue up to its own limit: PRIORITY_URGENT
+    up to max_size chunks, the lower classes to a smaller fraction of
+    it, so that some room is always left to the more urgent ones.
+    put_nowait() returns False (and counts the chunk in rejected) when
+    the limit of its class is reached; put() waits for room instead.
+    """
+    MAX_SIZE = 256
+
+    def __init__(self, max_size = MAX_SIZE):
+        self.max_size = max_size
+        self.rejected = 0
+        self._queues = [collections.deque() for _ in PRIORITY_NAMES]
+        self._size = 0
+        self._not_empty = asyncio.Event()
+        self._room = asyncio.Event()
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def depths(self):
+        " the number of chunks queued in each class."
+        return [len(q) for q in self._queues]
+
+    def limit(self, priority):
+        levels = len(self._queues)
+        return max(1, self.max_size * (levels - priority) // levels)
+
+    def accepts(self, priority = PRIORITY_NORMAL):
+        return self._size < self.limit(priority)
+
+    def put_nowait(self, data, priority = PRIORITY_NORMAL):
+        if self._size >= self.limit(priority):
+            self.rejected += 1
+            return False
+        self._queues[priority].append(data)
+        self._size += 1
+        self._not_empty.set()
+        return True
+
+    async def put(self, data, priority = PRIORITY_NORMAL):
+        while self._size >= self.limit(priority):
+            self._room.clear()
+            await self._room.wait()
+        return self.put_nowait(data, priority)
+
+    def get_nowait(self):
+        for q in self._queues:
+            if q:
+                self._size -= 1
+                self._room.set()
+                return q.popleft()
+        raise asyncio.QueueEmpty
+
+    async def get(self):
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+class LineBuffer(object):
+    """ Splits a stream of bytes, fed in chunks of any size, into lines.
+
+    feed() returns the complete lines found so far (without delimiter),
+    the partial line is kept for the next call. A line longer than
+    max_line_length is dropped (up to its delimiter) and counted in
+    overflows, so a peer that never sends a delimiter cannot grow memory
+    without limit.
+    """
+    MAX_LINE_LENGTH = 4096
+
+    def __init__(self, delimiter = b'\n', max_line_length = MAX_LINE_LENGTH):
+        self.delimiter = delimiter
+        self.max_line_length = max_line_length
+        self.overflows = 0
+        self._buffer = bytearray()
+        self._discarding = False
+
+    def feed(self, chunk):
+        # ~ only the new bytes (and a delimiter split across chunks) need a look
+        search_from = max(0, len(self._buffer) - len(self.delimiter) + 1)
+        self._buffer += chunk
+        if self._buffer.find(self.delimiter, search_from) < 0:
+            if len(self._buffer) > self.max_line_length:
+                self._overflow()
+            return []
+
+        lines = bytes(self._buffer).split(self.delimiter)
+        self._buffer[:] = lines.pop()
+        if self._discarding:
+            # ~ the tail of an overlong line
+            lines.pop(0)
+            self._discarding = False
+        if len(self._buffer) > self.max_line_length:
+            self._overflow()
+
+        max_line_length = self.max_line_length
+        ret = [l for l in lines if len(l) <= max_line_length]
+        self.overflows += len(lines) - len(ret)
+        return ret
+
+    def _overflow(self):
+        logging.warning("line longer than {} bytes: dropped".format(self.max_line_length))
+        del self._buffer[:]
+        if not self._discarding:
+            self.overflows += 1
+        self._discarding = True
+
 class FileDriver(AbstractDriver):      
+    """ A driver reading and writing lines of text on a pair of files (e.g. FIFOs).
+
+    PACKET_RECV events carry the line (text) and its capture time
+    (timestamp), as integer nanoseconds since epoch: it is taken from
+    time.monotonic_ns() when the chunk holding the line is read, and
+    mapped to the wall clock once per connection.
+
+    The traffic is not logged: it is kept in the trace ring buffer
+    (see traffic_trace.TraceRing) and formatted only on dump. With the
+    connection parameter capture_file, all of it is also recorded to a
+    binary capture file (see traffic_capture), that ReplayDriver replays.
+
+    write(text, priority) queues the line in a PriorityWriteQueue of
+    write_queue_size (a connection parameter) lines and returns False
+    if the queue has no room for it.
+    """
+    READ_CHUNK_SIZE = 4096
+    FLUSH_DEADLINE = 0.0
+    EOF_POLL_INTERVAL = 0.05
+
     def __init__(self):
         logging.info("RS485_Master init ...")
         self._disconnect_event = asyncio.Event()
-        self._write_queue = asyncio.Queue()
+        self._write_queue = PriorityWriteQueue()
+        self.trace = TraceRing(name = "FileDriver")
 
         super().__init__()
         
@@ -84,6 +367,9 @@ class FileDriver(AbstractDriver):
     def connect(self, **connection_parameters):
         try:
             self.params = connection_parameters
+            self._write_queue.max_size = int(self.params.get("write_queue_size", PriorityWriteQueue.MAX_SIZE))
+            # ~ capture timestamps are monotonic, mapped to the wall clock once per connection
+            self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
             asyncio.ensure_future(self._run())
             self._set_current_status(self.State.CONNECTED)
         except:
@@ -99,37 +385,342 @@ class FileDriver(AbstractDriver):
             logging.info("Error while disconnecting:", sys.exc_info()[0])
             raise
                        
-    def write(self, text):
-        self._write_queue.put_nowait(text.encode('utf-8') + b'\n')
+    def write(self, text, priority = PRIORITY_NORMAL):
+        return self._write_queue.put_nowait(text.encode('utf-8') + b'\n', priority)
 
     async def _run(self):
+        # ~ only FileDriver needs it: not loaded by the users of the other drivers
+        import aiofiles  # pylint: disable=import-outside-toplevel
+
         logging.info("starting read")
         
+        capture = None
+        if self.params.get("capture_file"):
+            capture = CaptureWriter(self.params["capture_file"])
+
+        read_chunk_size = self.params.get("read_chunk_size", self.READ_CHUNK_SIZE)
+        line_buffer = LineBuffer(max_line_length=self.params.get("max_line_length", LineBuffer.MAX_LINE_LENGTH))
+
         async def read_task():
             async with aiofiles.open(self.params["port_rx"], mode="rb", buffering=0) as f:
                 try:
                     while True:
-                        buffer = b''
-                        b = b''
-                        while b != b'\n':
-                            buffer = buffer + b 
-                            b = await f.read(1)
-                        logging.info("Recv text:" + buffer.decode("utf-8"))
-                        self.fire(self.Event.PACKET_RECV, text = buffer.decode("utf-8"))
+                        chunk = await f.read(read_chunk_size)
+                        timestamp = time.monotonic_ns() + self._epoch_offset_ns
+                        if not chunk:
+                            # ~ no writer on the other side (yet)
+                            await asyncio.sleep(self.EOF_POLL_INTERVAL)
+                            continue
+                        for line in line_buffer.feed(chunk):
+                            self.trace.record(RX, line, timestamp)
+                            if capture is not None:
+                                capture.record(RX, line, timestamp)
+                            text = line.decode("utf-8")
+                            self.fire(self.Event.PACKET_RECV, text = text, timestamp = timestamp)
                 except asyncio.CancelledError:
                        logging.info('reading task cancelled')
                     
+        flush_deadline = self.params.get("flush_deadline", self.FLUSH_DEADLINE)
+
         async def write_task():
             async with aiofiles.open(self.params["port_tx"], mode="wb", buffering=0) as f:
-                text = await self._write_queue.get()
-                logging.info("Send text:" + str(text))
-                await f.write(text + b'\n')
+                while True:
+                    data = await coalesce(self._write_queue, flush_deadline)
+                    timestamp = time.monotonic_ns() + self._epoch_offset_ns
+                    self.trace.record(TX, data, timestamp)
+                    if capture is not None:
+                        capture.record(TX, data, timestamp)
+                    await f.write(data)
             
         read_task = asyncio.ensure_future(read_task())
         write_task = asyncio.ensure_future(write_task())
         await self._disconnect_event.wait()
         read_task.cancel()
         write_task.cancel()
-       
+        if capture is not None:
+            capture.close()
+
+
+class ReplayDriver(AbstractDriver):
+    """ A driver replaying a capture file (see traffic_capture).
+
+    connect(capture_file = path, speed = 1.0, directions = (RX, ))
+    replays the recorded traffic of the given directions, as
+    PACKET_RECV events carrying data (the recorded bytes), text
+    (the same, decoded), timestamp (as recorded) and direction.
+
+    With speed > 0 the records are fired respecting their recorded
+    timing, speed times faster; with speed == 0 as fast as possible.
+    The file is read through a memory map, so hours of traffic can
+    be replayed without loading them. At the end of the file the
+    driver goes to DISCONNECTED. write() is not supported.
+    """
+    # ~ with speed == 0, control goes back to the event loop every YIELD_EVERY records
+    YIELD_EVERY = 256
+
+    def __init__(self):
+        logging.info("ReplayDriver init ...")
+        self._task = None
+        self.replayed = 0
+        super().__init__()
 
-    
\ No newline at end of file
+    def __del__(self):
+        self.disconnect()
+
+    def connect(self, **connection_parameters):
+        try:
+            self.params = connection_parameters
+            reader = CaptureReader(self.params["capture_file"])
+            self._task = asyncio.ensure_future(self._run(reader))
+            self._set_current_status(self.State.CONNECTED)
+        except:
+            logging.info("Error while connecting:", sys.exc_info()[0])
+            raise
+
+    def disconnect(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.state != self.State.DISCONNECTED:
+            self._set_current_status(self.State.DISCONNECTED)
+
+    def write(self, text, priority = PRIORITY_NORMAL):
+        logging.warning("ReplayDriver: write not supported")
+        return False
+
+    async def _run(self, reader):
+        speed = float(self.params.get("speed", 1.0))
+        directions = tuple(self.params.get("directions", (RX, )))
+        loop = asyncio.get_running_loop()
+        start = None
+        try:
+            for timestamp, direction, data in reader.records():
+                if direction not in directions:
+                    continue
+                if speed > 0:
+                    if start is None:
+                        start = (loop.time(), timestamp)
+                    delay = start[0] + (timestamp - start[1]) / 1e9 / speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.replayed % self.YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+                data = bytes(data)
+                self.replayed += 1
+                self.fire(self.Event.PACKET_RECV, data = data, text = data.decode("utf-8", errors = "replace"),
+                          timestamp = timestamp, direction = direction)
+        except asyncio.CancelledError:
+            logging.info('replay cancelled')
+            raise
+        finally:
+            data = None
+            reader.close()
+        self._task = None
+        self._set_current_status(self.State.DISCONNECTED)
+
+
+class SerialDriver(AbstractDriver):
+    """ A driver for a serial port, read and written through a
+    non-blocking file descriptor registered on the event loop: no
+    thread executor between the byte arriving and the event firing.
+
+    connect(device_name = path, device_baudrate = 115200,
+            protocol = None, frame_gap = None, ...)
+
+    The port is set raw, with VMIN = VTIME = 0: the kernel hands over
+    whatever is received as soon as the descriptor is readable. What
+    makes a frame depends on protocol:
+     - None: lines of text, fired as PACKET_RECV with text;
+     - 'mab_mgb': packets delimited by MAB_MGB_protocol, fired with
+       frame, as (addr, cmd_code, payload_bytes);
+     - 'gap': raw bytes, a frame ending when the line stays idle for
+       frame_gap seconds, fired with data.
+    Events also carry the capture timestamp, as FileDriver's.
+
+    frame_gap defaults to 3.5 character times at the baudrate (not
+    less than MIN_FRAME_GAP). With 'mab_mgb', a packet still
+    incomplete after such a gap is dropped at once instead of waiting
+    for the next STX; dropped packets are counted in decode_errors.
+
+    write(text, priority) queues a line (or, given bytes, the bytes
+    as they are) as FileDriver.write() does. capture_file,
+    flush_deadline and write_queue_size are as FileDriver's.
+    """
+    READ_CHUNK_SIZE = 4096
+    FLUSH_DEADLINE = 0.0
+    MIN_FRAME_GAP = 0.001
+    PROTOCOLS = (None, 'mab_mgb', 'gap')
+
+    def __init__(self):
+        logging.info("SerialDriver init ...")
+        self._fd = None
+        self._write_queue = PriorityWriteQueue()
+        self._write_task = None
+        self._gap_timer = None
+        self._capture = None
+        self.trace = TraceRing(name = "SerialDriver")
+        self.decode_errors = 0
+        super().__init__()
+
+    def __del__(self):
+        self.disconnect()
+
+    def connect(self, **connection_parameters):
+        try:
+            self.params = connection_parameters
+            protocol = self._protocol = self.params.get("protocol")
+            if protocol not in self.PROTOCOLS:
+                raise ValueError("unknown protocol:{}".format(protocol))
+            baudrate = int(self.params.get("device_baudrate", 115200))
+            frame_gap = self.params.get("frame_gap")
+            self.frame_gap = float(frame_gap) if frame_gap is not None else max(35.0 / baudrate, self.MIN_FRAME_GAP)
+            self._write_queue.max_size = int(self.params.get("write_queue_size", PriorityWriteQueue.MAX_SIZE))
+
+            self._line_buffer = LineBuffer(max_line_length = self.params.get("max_line_length", LineBuffer.MAX_LINE_LENGTH))
+            self._decoder = MAB_MGB_stream_decoder() if protocol == 'mab_mgb' else None
+            self._gap_buffer = bytearray()
+            self._last_rx = 0.0
+
+            self._fd = os.open(self.params["device_name"], os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+            self._configure(baudrate)
+            if self.params.get("capture_file"):
+                self._capture = CaptureWriter(self.params["capture_file"])
+
+            # ~ capture timestamps are monotonic, mapped to the wall clock once per connection
+            self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+            loop = asyncio.get_event_loop()
+            loop.add_reader(self._fd, self._on_readable)
+            self._write_task = asyncio.ensure_future(self._write_loop())
+            self._set_current_status(self.State.CONNECTED)
+        except:
+            logging.info("Error while connecting: {}".format(sys.exc_info()[0]))
+            self._close()
+            raise
+
+    def disconnect(self):
+        if self._fd is None:
+            return
+        self._close()
+        self._set_current_status(self.State.DISCONNECTED)
+
+    def write(self, text, priority = PRIORITY_NORMAL):
+        data = text if isinstance(text, (bytes, bytearray)) else text.encode('utf-8') + b'\n'
+        return self._write_queue.put_nowait(bytes(data), priority)
+
+    def _configure(self, baudrate):
+        attrs = termios.tcgetattr(self._fd)
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = attrs
+        # ~ raw mode, as cfmakeraw(), whatever the tty had before (e.g. cooked): no byte is
+        # ~ translated (CR, NL), dropped (IGNCR, IGNBRK), doubled (0xFF with PARMRK) or taken for flow control
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR |
+                   termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY | termios.INPCK)
+        oflag &= ~termios.OPOST
+        cflag &= ~(termios.CSIZE | termios.PARENB)
+        cflag |= termios.CS8 | termios.CLOCAL | termios.CREAD
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.IEXTEN | termios.ISIG)
+        speed = getattr(termios, "B{}".format(baudrate), None)
+        if speed is None:
+            raise ValueError("unsupported baudrate:{}".format(baudrate))
+        # ~ return at once with what is there: readiness comes from the event loop
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self._fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+    def _close(self):
+        if self._gap_timer is not None:
+            self._gap_timer.cancel()
+            self._gap_timer = None
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+        if self._fd is not None:
+            asyncio.get_event_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
+    def _on_readable(self):
+        try:
+            chunk = os.read(self._fd, self.READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            # ~ e.g. the other side of a pty closed
+            logging.info("read error: {}".format(sys.exc_info()[1]))
+            self.disconnect()
+            return
+        if not chunk:
+            return
+        now = time.monotonic_ns()
+        timestamp = now + self._epoch_offset_ns
+        self._last_rx = now
+
+        self.trace.record(RX, chunk, timestamp)
+        if self._capture is not None:
+            self._capture.record(RX, chunk, timestamp)
+
+        if self._decoder is not None:
+            errors = self._decoder.errors
+            for frame in self._decoder.feed(chunk):
+                self.fire(self.Event.PACKET_RECV, frame = frame, timestamp = timestamp)
+            self.decode_errors += self._decoder.errors - errors
+            if self._decoder.pending():
+                self._arm_gap_timer()
+            elif self._gap_timer is not None:
+                # ~ the partial packet has been completed
+                self._gap_timer.cancel()
+                self._gap_timer = None
+        elif self._protocol == 'gap':
+            self._gap_buffer += chunk
+            self._arm_gap_timer()
+        else:
+            for line in self._line_buffer.feed(chunk):
+                self.fire(self.Event.PACKET_RECV, text = line.decode("utf-8", errors = "replace"), timestamp = timestamp)
+
+    def _arm_gap_timer(self):
+        # ~ one timer per gap, not one per chunk: _on_gap re-arms itself if bytes came meanwhile
+        if self._gap_timer is None:
+            self._gap_timer = asyncio.get_event_loop().call_later(self.frame_gap, self._on_gap)
+
+    def _on_gap(self):
+        self._gap_timer = None
+        idle = (time.monotonic_ns() - self._last_rx) / 1e9
+        if idle < self.frame_gap:
+            self._gap_timer = asyncio.get_event_loop().call_later(self.frame_gap - idle, self._on_gap)
+            return
+        timestamp = self._last_rx + self._epoch_offset_ns
+        if self._decoder is not None:
+            if self._decoder.pending():
+                # ~ the line went idle in the middle of a packet: it will never be completed
+                self._decoder.reset()
+                self.decode_errors += 1
+        elif self._gap_buffer:
+            data = bytes(self._gap_buffer)
+            del self._gap_buffer[:]
+            self.fire(self.Event.PACKET_RECV, data = data, timestamp = timestamp)
+
+    async def _write_loop(self):
+        flush_deadline = self.params.get("flush_deadline", self.FLUSH_DEADLINE)
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await coalesce(self._write_queue, flush_deadline)
+            timestamp = time.monotonic_ns() + self._epoch_offset_ns
+            self.trace.record(TX, data, timestamp)
+            if self._capture is not None:
+                self._capture.record(TX, data, timestamp)
+            view = memoryview(data)
+            while view:
+                try:
+                    view = view[os.write(self._fd, view):]
+                except BlockingIOError:
+                    pass
+                if view:
+                    # ~ the output buffer is full: wait for room
+                    writable = loop.create_future()
+                    loop.add_writer(self._fd, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        loop.remove_writer(self._fd)
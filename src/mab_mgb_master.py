@@ -0,0 +1,291 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+# pylint: disable=too-many-lines
+
+import time
+import asyncio
+import logging
+
+from mab_mgb_protocol import MAB_MGB_protocol, MAB_MGB_stream_decoder, DECODE_ERROR_NAMES
+from bus_metrics import LatencyHistogram
+from driver import PRIORITY_NORMAL, PRIORITY_BULK
+
+
+class MAB_MGB_addr_stats:
+
+    " counters of the transactions with one slave address."
+
+    def __init__(self):
+
+        self.requests = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latency_last = None
+        self.latency_max = None
+        self._latency_sum = 0.0
+
+    def add_reply(self, latency):
+
+        self.replies += 1
+        self.latency_last = latency
+        self._latency_sum += latency
+        if self.latency_max is None or latency > self.latency_max:
+            self.latency_max = latency
+
+    def as_dict(self):
+
+        return {
+            "requests": self.requests,
+            "replies": self.replies,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "latency_last": self.latency_last,
+            "latency_max": self.latency_max,
+            "latency_avg": self._latency_sum / self.replies if self.replies else None,
+        }
+
+
+class MAB_MGB_poll_entry:
+
+    def __init__(self, addr, cmd_code, payload_bytes, timeout, retries, callback, reply_addr=None):
+
+        self.addr = addr
+        self.reply_addr = reply_addr
+        self.cmd_code = cmd_code
+        self.payload_bytes = bytes(payload_bytes)
+        self.timeout = timeout
+        self.retries = retries
+        self.callback = callback
+        self.failures = 0
+        self.skip_cycles = 0
+
+
+class MAB_MGB_master:
+
+    """ the request/response layer of MAB_MGB_protocol, on the master side of the half-duplex bus.
+
+        The class does no I/O by itself: the packets to be sent are passed to the write function
+        given to the constructor, as write(packet_bytes, priority) (see driver.PriorityWriteQueue), which
+        returns False if the packet cannot be queued; whoever reads the serial port passes the received bytes,
+        in chunks of any size, to feed().
+
+        Only one transaction is on the bus at a time:
+
+            reply = await master.transact(addr, cmd_code, payload_bytes, timeout=0.1, retries=2)
+
+        sends the packet and returns the first frame received afterwards from the slave, as (addr, cmd_code,
+        payload_bytes), retrying on timeout. The slave answers from addr, or from the reply_addr given (e.g. a
+        request to 200 answered from 201). The echo of the request itself (as seen on some rs485 transceivers),
+        that is the first frame equal to the request after it is written, is ignored.
+        Every other received frame, replies included, is passed to on_frame(frame, timestamp), if set,
+        where timestamp is the capture time given to feed().
+
+        The poll scheduler cycles, back to back, over the entries added with add_poll(), so the bus is never
+        idle while polling. A slave that does not answer is skipped for an exponentially growing number of
+        cycles (up to MAX_SKIP_CYCLES), so that it does not eat the cycle time of the others.
+        Cycle time and per-address counters are in get_stats(), the histogram of the reply latency
+        of all the addresses in latency_histogram.
+    """
+
+    DEFAULT_TIMEOUT = 0.1
+    DEFAULT_RETRIES = 2
+    MAX_SKIP_CYCLES = 16
+
+    def __init__(self, write, protocol=None):
+
+        self.protocol = protocol if protocol is not None else MAB_MGB_protocol()
+        self.on_frame = None
+
+        self._write = write
+        self._decoder = MAB_MGB_stream_decoder(self.protocol)
+        self._bus_lock = asyncio.Lock()
+        self._pending = None
+        # ~ one-shot: set when a request is written, cleared by its echo (or at the end of the attempt)
+        self._echo_expected = False
+        self._timeouts = {}
+        self._polls = []
+        self._poll_task = None
+
+        self.addr_stats = {}
+        self.latency_histogram = LatencyHistogram()
+        self.cycles = 0
+        self.cycle_time_last = None
+        self.cycle_time_min = None
+        self.cycle_time_max = None
+        self._cycle_time_sum = 0.0
+
+    def set_timeout(self, addr, timeout=None, retries=None):
+        " sets the default timeout (seconds) and number of retries of the transactions with addr."
+
+        self._timeouts[addr] = (timeout, retries)
+
+    def feed(self, chunk, timestamp=None):
+        " to be called with the bytes received from the serial port and the time they were captured at."
+
+        for frame in self._decoder.feed(chunk):
+            pending = self._pending
+            if self._echo_expected and pending is not None and frame == pending[0]:
+                # ~ echo of our own request: a second equal frame is a reply
+                self._echo_expected = False
+                continue
+            if pending is not None and not pending[1].done() and frame[0] == pending[2] and \
+                    pending[3] in (None, frame[1]):
+                # ~ frames from other addresses (e.g. the late reply of a slave that timed out) are not the reply
+                pending[1].set_result(frame)
+            if self.on_frame is not None:
+                self.on_frame(frame, timestamp)
+
+    async def transact(self, addr, cmd_code, payload_bytes=b'', timeout=None, retries=None, cached=False, priority=PRIORITY_NORMAL,
+                       reply_cmd_code=None, reply_addr=None):
+        """ sends (addr, cmd_code, payload_bytes) and returns the reply, as (addr, cmd_code, payload_bytes):
+        the first frame received afterwards from reply_addr (addr if None), with cmd_code reply_cmd_code
+        unless that is None.
+        If cached is True, the packet is taken from the cache of MAB_MGB_protocol.encode_cached().
+        An attempt whose packet is rejected by the write queue fails at once (counted in rejected).
+        raises asyncio.TimeoutError if no reply arrives after all the retries. """
+
+        default_timeout, default_retries = self._timeouts.get(addr, (None, None))
+        if timeout is None:
+            timeout = default_timeout if default_timeout is not None else self.DEFAULT_TIMEOUT
+        if retries is None:
+            retries = default_retries if default_retries is not None else self.DEFAULT_RETRIES
+
+        if cached:
+            packet_bytes = self.protocol.encode_cached(addr, cmd_code, payload_bytes)
+        else:
+            packet_bytes = self.protocol.encode_msg(addr, cmd_code, payload_bytes)
+        request = (addr, cmd_code, bytes(payload_bytes))
+        if reply_addr is None:
+            reply_addr = addr
+
+        stats = self.addr_stats.get(addr)
+        if stats is None:
+            stats = self.addr_stats[addr] = MAB_MGB_addr_stats()
+
+        loop = asyncio.get_running_loop()
+        async with self._bus_lock:
+            for attempt in range(retries + 1):
+                if attempt:
+                    stats.retries += 1
+                stats.requests += 1
+                reply = loop.create_future()
+                self._pending = (request, reply, reply_addr, reply_cmd_code)
+                try:
+                    t0 = time.monotonic()
+                    self._echo_expected = True
+                    if self._write(packet_bytes, priority) is False:
+                        self._echo_expected = False
+                        stats.rejected += 1
+                        continue
+                    frame = await asyncio.wait_for(reply, timeout)
+                    latency = time.monotonic() - t0
+                    stats.add_reply(latency)
+                    self.latency_histogram.add(latency)
+                    return frame
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                finally:
+                    self._pending = None
+                    self._echo_expected = False
+
+        raise asyncio.TimeoutError('no reply from addr:{} cmd_code:0x{:02X}'.format(addr, cmd_code))
+
+    def add_poll(self, addr, cmd_code, payload_bytes=b'', timeout=None, retries=0, callback=None, reply_addr=None):
+        """ adds (addr, cmd_code, payload_bytes) to the poll cycle; callback(reply) is called with
+        every reply, from reply_addr (see transact()). Polls are not retried within a cycle by default:
+        the next cycle is the retry. """
+
+        self._polls.append(MAB_MGB_poll_entry(addr, cmd_code, payload_bytes, timeout, retries, callback, reply_addr))
+
+    def remove_poll(self, addr, cmd_code=None):
+
+        self._polls = [p for p in self._polls if not (p.addr == addr and cmd_code in (None, p.cmd_code))]
+
+    def start_polling(self):
+
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.ensure_future(self._poll_forever())
+
+    def stop_polling(self):
+
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    def is_polling(self):
+
+        return self._poll_task is not None and not self._poll_task.done()
+
+    async def poll_cycle(self):
+        " runs one cycle over the poll entries. returns the list of (entry, reply or None)."
+
+        results = []
+        for entry in list(self._polls):
+            if entry.skip_cycles > 0:
+                entry.skip_cycles -= 1
+                continue
+            try:
+                reply = await self.transact(
+                    entry.addr, entry.cmd_code, entry.payload_bytes,
+                    timeout=entry.timeout, retries=entry.retries, cached=True, priority=PRIORITY_BULK,
+                    reply_addr=entry.reply_addr)
+            except asyncio.TimeoutError:
+                # ~ capped: enough for the longest skip
+                entry.failures = min(entry.failures + 1, self.MAX_SKIP_CYCLES.bit_length() + 1)
+                entry.skip_cycles = min(2 ** (entry.failures - 1) - 1, self.MAX_SKIP_CYCLES)
+                results.append((entry, None))
+                continue
+            entry.failures = 0
+            results.append((entry, reply))
+            if entry.callback is not None:
+                try:
+                    entry.callback(reply)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("poll callback failed")
+
+        return results
+
+    async def _poll_forever(self):
+
+        while True:
+            t0 = time.monotonic()
+            await self.poll_cycle()
+            if not self._polls:
+                await asyncio.sleep(self.DEFAULT_TIMEOUT)
+                continue
+            self._add_cycle_time(time.monotonic() - t0)
+
+    def _add_cycle_time(self, cycle_time):
+
+        self.cycles += 1
+        self.cycle_time_last = cycle_time
+        self._cycle_time_sum += cycle_time
+        if self.cycle_time_min is None or cycle_time < self.cycle_time_min:
+            self.cycle_time_min = cycle_time
+        if self.cycle_time_max is None or cycle_time > self.cycle_time_max:
+            self.cycle_time_max = cycle_time
+
+    def get_decode_errors(self):
+        " returns the number of discarded packets by kind of error."
+
+        return dict(zip(DECODE_ERROR_NAMES, self._decoder.error_counts))
+
+    def get_stats(self):
+
+        return {
+            "polling": self.is_polling(),
+            "cycles": self.cycles,
+            "cycle_time_last": self.cycle_time_last,
+            "cycle_time_min": self.cycle_time_min,
+            "cycle_time_max": self.cycle_time_max,
+            "cycle_time_avg": self._cycle_time_sum / self.cycles if self.cycles else None,
+            "decode_errors": self._decoder.errors,
+            "addresses": {addr: stats.as_dict() for addr, stats in self.addr_stats.items()},
+        }
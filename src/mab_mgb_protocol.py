@@ -6,6 +6,178 @@
 # pylint: disable=invalid-name
 # pylint: disable=too-many-lines
 
+import re
+import sys
+import struct
+from array import array
+
+# ~ kinds of decode errors, indexes of MAB_MGB_stream_decoder.error_counts
+DECODE_ERROR_FRAMING = 0
+DECODE_ERROR_LENGTH = 1
+DECODE_ERROR_CRC = 2
+DECODE_ERROR_STUFFING = 3
+DECODE_ERROR_NAMES = ('framing', 'length', 'crc', 'stuffing')
+
+
+class MAB_MGB_decode_error(ValueError):
+    " a packet that does not decode; kind is one of the DECODE_ERROR_* constants."
+    kind = DECODE_ERROR_FRAMING
+
+
+class MAB_MGB_length_error(MAB_MGB_decode_error):
+    kind = DECODE_ERROR_LENGTH
+
+
+class MAB_MGB_crc_error(MAB_MGB_decode_error):
+    kind = DECODE_ERROR_CRC
+
+
+class MAB_MGB_stuffing_error(MAB_MGB_decode_error):
+    kind = DECODE_ERROR_STUFFING
+
+
+class MAB_MGB_payload_schema:
+
+    """ the layout of the payload of a cmd_code, compiled once into a struct.Struct (little endian).
+
+        fields is a sequence of (name, format) where format is a struct format yielding one value,
+        e.g. [('status', 'B'), ('temperature', 'h'), ('serial_number', '8s')]. A payload longer
+        than the layout is accepted, the bytes after it are ignored.
+    """
+
+    __slots__ = ('name', 'field_names', 'formats', 'struct')
+
+    def __init__(self, fields, name=''):
+
+        self.name = name
+        self.field_names = tuple(field_name for field_name, _ in fields)
+        self.formats = tuple(fmt for _, fmt in fields)
+        self.struct = struct.Struct('<' + ''.join(fmt for _, fmt in fields))
+        if len(self.struct.unpack(bytes(self.struct.size))) != len(self.field_names):
+            raise ValueError('every format must yield exactly one value:{}'.format(list(fields)))
+
+    def unpack(self, payload_bytes):
+        " returns the fields of payload_bytes as a dict."
+
+        if len(payload_bytes) < self.struct.size:
+            raise MAB_MGB_length_error('payload too short for {}:{}/{}'.format(
+                self.name, len(payload_bytes), self.struct.size))
+
+        return dict(zip(self.field_names, self.struct.unpack_from(payload_bytes)))
+
+    def numpy_dtype(self, np):
+        " returns the layout as a NumPy (module np) structured dtype, with the same offsets and itemsize."
+
+        formats = []
+        offsets = []
+        prefix = '<'
+        for fmt in self.formats:
+            for count, code in _STRUCT_TOKEN.findall(fmt):
+                if code != 'x':
+                    offsets.append(struct.calcsize(prefix))
+                    formats.append('S' + (count or '1') if code in 'sc' else _NUMPY_CODES[code])
+                prefix += count + code
+
+        return np.dtype({'names': list(self.field_names), 'formats': formats,
+                         'offsets': offsets, 'itemsize': self.struct.size})
+
+
+_STRUCT_TOKEN = re.compile(r'(\d*)([a-zA-Z?])')
+
+# ~ struct codes (standard sizes) -> NumPy types, little endian
+_NUMPY_CODES = {
+    'b': 'i1', 'B': 'u1', '?': '?', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'l': '<i4', 'L': '<u4',
+    'q': '<i8', 'Q': '<u8', 'e': '<f2', 'f': '<f4', 'd': '<f8',
+}
+
+
+class MAB_MGB_frame:
+
+    """ a decoded frame: addr, cmd_code and payload (bytes, cmd_code excluded).
+
+        It unpacks, indexes and compares as the tuple (addr, cmd_code, payload).
+        fields is the payload decoded by the schema registered for cmd_code (see register_schema(),
+        an empty dict if none), computed on first access and then kept; the fields can also be read
+        as attributes of the frame: frame.temperature.
+    """
+
+    __slots__ = ('addr', 'cmd_code', 'payload', '_fields')
+
+    # ~ cmd_code -> MAB_MGB_payload_schema
+    schemas = {}
+
+    def __init__(self, addr, cmd_code, payload):
+
+        self.addr = addr
+        self.cmd_code = cmd_code
+        self.payload = payload
+        self._fields = None
+
+    @classmethod
+    def register_schema(cls, cmd_code, fields, name=''):
+
+        schema = MAB_MGB_payload_schema(fields, name or '0x{:02X}'.format(cmd_code))
+        cls.schemas[cmd_code] = schema
+        return schema
+
+    @classmethod
+    def unregister_schema(cls, cmd_code):
+
+        cls.schemas.pop(cmd_code, None)
+
+    @property
+    def schema(self):
+
+        return self.schemas.get(self.cmd_code)
+
+    @property
+    def fields(self):
+
+        if self._fields is None:
+            schema = self.schemas.get(self.cmd_code)
+            self._fields = {} if schema is None else schema.unpack(self.payload)
+        return self._fields
+
+    def __getattr__(self, name):
+
+        # ~ called only for what is not a slot: the fields of the payload
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+
+        return iter((self.addr, self.cmd_code, self.payload))
+
+    def __len__(self):
+
+        return 3
+
+    def __getitem__(self, index):
+
+        return (self.addr, self.cmd_code, self.payload)[index]
+
+    def __eq__(self, other):
+
+        if isinstance(other, (MAB_MGB_frame, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+
+        return hash((self.addr, self.cmd_code, self.payload))
+
+    def __reduce__(self):
+
+        return (MAB_MGB_frame, (self.addr, self.cmd_code, self.payload))
+
+    def __repr__(self):
+
+        return 'MAB_MGB_frame({}, {}, {!r})'.format(self.addr, self.cmd_code, self.payload)
+
 
 class MAB_MGB_protocol:
 
@@ -34,9 +206,19 @@ class MAB_MGB_protocol:
     ASCII_TWO = 0x32  # '2' /* STX -> ESC TWO   */
     ASCII_THREE = 0x33  # '3' /* ETX -> ESC THREE */
 
+    _ESC_BYTES = bytes([ASCII_ESC])
+    _STX_BYTES = bytes([ASCII_STX])
+    _ETX_BYTES = bytes([ASCII_ETX])
+    _STUFFED_ESC = bytes([ASCII_ESC, ASCII_ZERO])
+    _STUFFED_STX = bytes([ASCII_ESC, ASCII_TWO])
+    _STUFFED_ETX = bytes([ASCII_ESC, ASCII_THREE])
+
     MAB_ADDR = 200
     MGB_ADDR = 201
 
+    # ~ /* the len byte is (stuffed_payload_len + 8 + 0x20) and must fit in one byte */
+    MAX_PACKET_LEN = 0xFF - 0x20
+
     CRC_TABLE = [
         0x0, 0x0C0C1, 0x0C181, 0x140, 0x0C301, 0x3C0, 0x280, 0x0C241,
         0x0C601, 0x6C0, 0x780, 0x0C741, 0x500, 0x0C5C1, 0x0C481, 0x440,
@@ -72,131 +254,565 @@ class MAB_MGB_protocol:
         0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040
     ]
 
+    FRAME_CACHE_SIZE = 256
+
+    # ~ packets processed together by decode_batch(): bounds its temporary arrays
+    BATCH_CHUNK = 16384
+
     def __init__(self):
 
-        pass
+        self._frame_cache = {}
 
     def _crc16(self, data_bytes, CRCinit):
 
-        index = 0x00
-        for b in data_bytes:
-            index = (CRCinit ^ (b & 0x00FF)) & 0x00FF
-            CRCinit = ((CRCinit >> 8) & 0x00FF) ^ self.CRC_TABLE[index]
-
-        return CRCinit
+        return MAB_MGB_crc16.backends[MAB_MGB_crc16.default_backend](data_bytes, CRCinit)
 
-    def _unstuff_buffer(self, bytes_):
-        " remove stuffing bytes where present."
-
-        unstuffed_buff_list = []
-        buff_list = list(bytes_)
-
-        k = 0
-        for i in range(len(buff_list)):
-            if buff_list[k] == self.ASCII_ESC:
-                if buff_list[k + 1] in (self.ASCII_TWO, self.ASCII_THREE):
-                    unstuffed_buff_list.append(buff_list[k + 1] - self.ASCII_ZERO)
-                elif buff_list[k + 1] in (self.ASCII_ZERO, ):
-                    unstuffed_buff_list.append(self.ASCII_ESC)
-                else:
-                    raise ValueError('illegal sequence of bytes:{}'.format(bytes_))
-                k = k + 1
-            else:
-                unstuffed_buff_list.append(buff_list[k])
+    def check_crc_many(self, packets):
+        """ takes in input a list of full packets and checks only their crc (framing and
+        stuffing are not checked), in a single call.
+        returns: a list of booleans, True where the crc is right. """
 
-            k = k + 1
-            if k >= len(buff_list):
-                break
+        crc16 = MAB_MGB_crc16.backends[MAB_MGB_crc16.default_backend]
+        results = []
+        for packet_bytes in packets:
+            packet_view = memoryview(packet_bytes)
+            if len(packet_view) < 8:
+                results.append(False)
+                continue
+            pack_crc = ((packet_view[-5] - 0x20) << 12) + ((packet_view[-4] - 0x20) << 8) + \
+                ((packet_view[-3] - 0x20) << 4) + (packet_view[-2] - 0x20)
+            results.append(pack_crc == crc16(packet_view[0:-5], 0))
 
-        unstuffed_bytes = bytes(unstuffed_buff_list)
+        return results
 
-        return unstuffed_bytes
+    def _unstuff_buffer(self, bytes_):
+        """ remove stuffing bytes where present.
+        Works by bulk replace on the escape sequences: no per-byte loop in python. """
+
+        bytes_ = bytes(bytes_)
+        if self._ESC_BYTES not in bytes_:
+            return bytes_
+
+        # ~ every ESC must be the start of one of the three legal sequences
+        if bytes_.count(self._ESC_BYTES) != (
+                bytes_.count(self._STUFFED_ESC) + bytes_.count(self._STUFFED_STX) + bytes_.count(self._STUFFED_ETX)):
+            raise MAB_MGB_stuffing_error('illegal sequence of bytes:{}'.format(bytes_))
+
+        # ~ ESC ZERO goes last, otherwise the restored ESC could pair with the following byte
+        return bytes_.replace(
+            self._STUFFED_STX, self._STX_BYTES).replace(
+                self._STUFFED_ETX, self._ETX_BYTES).replace(
+                    self._STUFFED_ESC, self._ESC_BYTES)
+
+    def _unstuff_into(self, packet_bytes, start, end, out):
+        """ remove stuffing bytes from packet_bytes[start:end], writing the result at the beginning of out.
+        Unstuffs by bulk replace, as _unstuff_buffer(), then copies with a single slice assignment.
+        returns the number of bytes written. """
+
+        decoded = self._unstuff_buffer(memoryview(packet_bytes)[start:end])
+        size = len(decoded)
+        memoryview(out)[:size] = decoded
+        return size
 
     def _stuff_buffer(self, bytes_):
-        " add stuffing bytes where needed."
-
-        stuffed_buff_list = []
-
-        for byte_ in list(bytes_):
-            # ~ /* STX --> ESC TWO, ETX --> ESC THREE */
-            if byte_ in (self.ASCII_STX, self.ASCII_ETX):
-                stuffed_buff_list.append(self.ASCII_ESC)
-                stuffed_buff_list.append(byte_ + self.ASCII_ZERO)
-            # ~ /* ESC --> ESC ZERO */
-            elif byte_ == self.ASCII_ESC:
-                stuffed_buff_list.append(self.ASCII_ESC)
-                stuffed_buff_list.append(self.ASCII_ZERO)
-            else:
-                stuffed_buff_list.append(byte_)
+        """ add stuffing bytes where needed.
+        Works by bulk replace on the reserved bytes: no per-byte loop in python. """
 
-        return bytes(stuffed_buff_list)
+        # ~ /* ESC --> ESC ZERO */ first, so that the ESCs added below are not stuffed again
+        # ~ /* STX --> ESC TWO, ETX --> ESC THREE */
+        return bytes(bytes_).replace(
+            self._ESC_BYTES, self._STUFFED_ESC).replace(
+                self._STX_BYTES, self._STUFFED_STX).replace(
+                    self._ETX_BYTES, self._STUFFED_ETX)
 
-    def decode_msg(self, packet_bytes):
-        """ takes in input a full sequence of bytes (as coming from serial port) coding for a full packet and
-        returns: (addr, cmd_code, decoded_payload_bytes) """
+    def _check_packet(self, packet_bytes, payload_crc=None):
+        """ checks framing, length and crc of a full packet, without copying it.
+        payload_crc, if already known (see MAB_MGB_stream_decoder), is not computed again.
+        returns: (addr, stuffed_payload_len) """
 
-        if packet_bytes[0] != self.ASCII_STX or packet_bytes[-1] != self.ASCII_ETX or len(packet_bytes) < 8:
-            raise ValueError('illegal packet:{}'.format(" ".join(["0x%0X" % int(b) for b in packet_bytes])))
+        packet_view = memoryview(packet_bytes)
 
-        addr = packet_bytes[1] - 0x20
-        packet_len = packet_bytes[2] - 8 - 0x20
-        stuffed_payload_bytes = packet_bytes[3:-5]
-        crc_bytes = bytes(packet_bytes[0:-5])
+        if len(packet_view) < 8 or packet_view[0] != self.ASCII_STX or packet_view[-1] != self.ASCII_ETX:
+            raise MAB_MGB_decode_error('illegal packet:{}'.format(" ".join(["0x%0X" % int(b) for b in packet_view])))
 
-        if len(stuffed_payload_bytes) != packet_len:
-            raise ValueError('wrong packet length:{}/{} {}'.format(
-                len(stuffed_payload_bytes), packet_len, " ".join(["0x%0X" % int(b) for b in packet_bytes])))
+        addr = packet_view[1] - 0x20
+        packet_len = packet_view[2] - 8 - 0x20
+        stuffed_payload_len = len(packet_view) - 8
 
-        payload_crc = self._crc16(crc_bytes, 0)
-        decoded_payload_bytes = self._unstuff_buffer(stuffed_payload_bytes)
+        if stuffed_payload_len != packet_len:
+            raise MAB_MGB_length_error('wrong packet length:{}/{} {}'.format(
+                stuffed_payload_len, packet_len, " ".join(["0x%0X" % int(b) for b in packet_view])))
+
+        if payload_crc is None:
+            payload_crc = self._crc16(packet_view[0:-5], 0)
 
         pack_crc = 0
-        pack_crc += ((packet_bytes[-5] - 0x20) << 12)
-        pack_crc += ((packet_bytes[-4] - 0x20) << 8)
-        pack_crc += ((packet_bytes[-3] - 0x20) << 4)
-        pack_crc += ((packet_bytes[-2] - 0x20) << 0)
+        pack_crc += ((packet_view[-5] - 0x20) << 12)
+        pack_crc += ((packet_view[-4] - 0x20) << 8)
+        pack_crc += ((packet_view[-3] - 0x20) << 4)
+        pack_crc += ((packet_view[-2] - 0x20) << 0)
 
         if pack_crc != payload_crc:
-            raise ValueError('wrong crc:0x{:04X}!=0x{:04X} {}'.format(
-                pack_crc, payload_crc, ["0x%0X" % int(b) for b in packet_bytes[-5:-1]]))
+            raise MAB_MGB_crc_error('wrong crc:0x{:04X}!=0x{:04X} {}'.format(
+                pack_crc, payload_crc, ["0x%0X" % int(b) for b in packet_view[-5:-1]]))
 
-        cmd_code = decoded_payload_bytes[0]
-        _payload_bytes = decoded_payload_bytes[1:]
+        if stuffed_payload_len == 0:
+            raise MAB_MGB_length_error('empty payload: missing cmd_code')
 
-        return (addr, cmd_code, _payload_bytes)
+        return (addr, stuffed_payload_len)
 
-    def encode_msg(self, addr, cmd_code, payload_bytes):
-        """ takes in input (addr, cmd_code, payload_bytes_to_be_encoded)
-        returns a full packet of bytes ready to be sent to serial port.  """
+    def decode_msg(self, packet_bytes, payload_crc=None):
+        """ takes in input a full sequence of bytes (as coming from serial port) coding for a full packet and
+        returns: (addr, cmd_code, decoded_payload_bytes), as a MAB_MGB_frame """
+
+        addr, stuffed_payload_len = self._check_packet(packet_bytes, payload_crc)
+
+        decoded_payload_bytes = self._unstuff_buffer(memoryview(packet_bytes)[3:3 + stuffed_payload_len])
 
-        payload_list = [cmd_code, ]
-        payload_list += list(payload_bytes)
+        cmd_code = decoded_payload_bytes[0]
+        _payload_bytes = decoded_payload_bytes[1:]
 
-        ext_payload_bytes = bytes(payload_list)
+        return MAB_MGB_frame(addr, cmd_code, _payload_bytes)
+
+    def split_packets(self, stream_bytes):
+        """ cuts a stream of bytes, e.g. the received data of a capture, into packets: each one from an STX
+        to the following ETX; the bytes between packets are skipped. A packet cut short by the next STX
+        is returned as it is (decode_batch() reports it as a framing error).
+        returns: a list of bytes """
+
+        STX = self.ASCII_STX
+        ETX = self.ASCII_ETX
+        stream_bytes = bytes(stream_bytes)
+        packets = []
+        pos = 0
+        while True:
+            start = stream_bytes.find(STX, pos)
+            if start < 0:
+                break
+            end = stream_bytes.find(ETX, start + 1)
+            if end < 0:
+                break
+            next_start = stream_bytes.find(STX, start + 1, end)
+            if next_start >= 0:
+                packets.append(stream_bytes[start:next_start])
+                pos = next_start
+                continue
+            packets.append(stream_bytes[start:end + 1])
+            pos = end + 1
+
+        return packets
+
+    def decode_batch(self, packets, cmd_code):
+        """ decodes the packets with the given cmd_code among packets (full packets, e.g. from split_packets())
+        into a NumPy structured array, with the columns index (the position of the packet in packets), addr
+        and the fields of the schema registered for cmd_code (see MAB_MGB_frame.register_schema()).
+
+        Framing, length and crc of all the packets are checked at once, with array operations on all of
+        them; the crc is computed a byte column at a time over the packets of the same length, in chunks of
+        at most BATCH_CHUNK packets, so that memory stays proportional to the input whatever the mix of
+        lengths. The payloads without escape sequences are copied into the array in bulk, only the others
+        are unstuffed one by one.
+        Packets with another cmd_code are skipped (their stuffing is not checked).
+        Needs numpy.
+        returns: (frames, bad) where bad is the list of (index, kind) of the packets that do not decode,
+        kind being one of the DECODE_ERROR_* constants """
+
+        try:
+            import numpy as np  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError('decode_batch() needs numpy') from e
+
+        schema = MAB_MGB_frame.schemas.get(cmd_code)
+        if schema is None:
+            raise ValueError('no schema registered for cmd_code 0x{:02X}'.format(cmd_code))
+        fields_dtype = schema.numpy_dtype(np)
+        size = schema.struct.size
+        dtype = np.dtype([('index', '<i8'), ('addr', 'u1')] + [(name, fields_dtype.fields[name][0]) for name in schema.field_names])
+
+        n = len(packets)
+        lengths = np.fromiter((len(p) for p in packets), dtype=np.int64, count=n)
+        flat = np.frombuffer(b''.join(packets), dtype=np.uint8)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        kinds = np.full(n, -1, dtype=np.int64)
+
+        # ~ framing and length
+        ok = lengths >= 8
+        ok[ok] = (flat[starts[ok]] == self.ASCII_STX) & (flat[ends[ok] - 1] == self.ASCII_ETX)
+        kinds[~ok] = DECODE_ERROR_FRAMING
+        length_ok = flat[starts[ok] + 2].astype(np.int64) - 8 - 0x20 == lengths[ok] - 8
+        kinds[np.nonzero(ok)[0][~length_ok]] = DECODE_ERROR_LENGTH
+        ok[ok] = length_ok
+
+        # ~ crc, by groups of packets of the same length
+        idx = np.nonzero(ok)[0]
+        body_lengths = lengths[idx] - 5
+        by_length = np.argsort(body_lengths, kind='stable')
+        group_lengths, group_starts = np.unique(body_lengths[by_length], return_index=True)
+        group_ends = list(group_starts[1:]) + [len(idx)]
+        table = np.array(self.CRC_TABLE, dtype=np.uint16)
+        crc = np.zeros(len(idx), dtype=np.uint16)
+        for body_length, group_start, group_end in zip(group_lengths, group_starts, group_ends):
+            for chunk_start in range(group_start, group_end, self.BATCH_CHUNK):
+                members = by_length[chunk_start:min(chunk_start + self.BATCH_CHUNK, group_end)]
+                # ~ a byte column of the packets per row
+                matrix = flat[starts[idx[members]][None, :] + np.arange(body_length)[:, None]]
+                value = np.zeros(len(members), dtype=np.uint16)
+                for row in matrix:
+                    value = (value >> 8) ^ table[(value ^ row) & 0xFF]
+                crc[members] = value
+        nibbles = [flat[ends[idx] - k].astype(np.int64) - 0x20 for k in (5, 4, 3, 2)]
+        crc_ok = ((nibbles[0] << 12) + (nibbles[1] << 8) + (nibbles[2] << 4) + nibbles[3]) == crc
+        kinds[idx[~crc_ok]] = DECODE_ERROR_CRC
+        ok[idx[~crc_ok]] = False
+        empty = ok & (lengths == 8)
+        kinds[empty] = DECODE_ERROR_LENGTH
+        ok &= ~empty
+
+        # ~ cmd_code: the first byte of the payload, or an escape sequence
+        idx = np.nonzero(ok)[0]
+        first = flat[starts[idx] + 3]
+        second = flat[starts[idx] + 4]
+        escaped = np.select(
+            [second == self.ASCII_ZERO, second == self.ASCII_TWO, second == self.ASCII_THREE],
+            [self.ASCII_ESC, self.ASCII_STX, self.ASCII_ETX], -1)
+        cmd_codes = np.where(first == self.ASCII_ESC, escaped, first)
+        kinds[idx[cmd_codes < 0]] = DECODE_ERROR_STUFFING
+        idx = idx[cmd_codes == cmd_code]
+
+        # ~ payloads: in bulk where there is no escape sequence in the packet, else unstuffed one by one
+        escapes = np.nonzero(flat == self.ASCII_ESC)[0]
+        has_escape = np.searchsorted(escapes, ends[idx] - 5) > np.searchsorted(escapes, starts[idx] + 3)
+        plain = idx[~has_escape]
+        short = lengths[plain] - 9 < size
+        kinds[plain[short]] = DECODE_ERROR_LENGTH
+        plain = plain[~short]
+        payloads = [
+            flat[starts[plain[k:k + self.BATCH_CHUNK]][:, None] + 4 + np.arange(size)[None, :]].tobytes()
+            for k in range(0, len(plain), self.BATCH_CHUNK)]
+        decoded = [plain]
+        escaped_idx = []
+        for i in idx[has_escape]:
+            try:
+                payload = self.decode_msg(packets[i]).payload
+            except MAB_MGB_decode_error as e:
+                kinds[i] = e.kind
+                continue
+            if len(payload) < size:
+                kinds[i] = DECODE_ERROR_LENGTH
+                continue
+            payloads.append(payload[:size])
+            escaped_idx.append(i)
+        decoded.append(np.array(escaped_idx, dtype=np.int64))
+
+        decoded = np.concatenate(decoded)
+        fields = np.frombuffer(b''.join(payloads), dtype=fields_dtype)
+        order = np.argsort(decoded, kind='stable')
+        frames = np.zeros(len(decoded), dtype=dtype)
+        frames['index'] = decoded[order]
+        frames['addr'] = flat[starts[decoded[order]] + 1] - 0x20
+        for name in schema.field_names:
+            frames[name] = fields[name][order]
+
+        bad = [(int(i), int(kinds[i])) for i in np.nonzero(kinds >= 0)[0]]
+        return frames, bad
+
+    def decode_msg_into(self, packet_bytes, out):
+        """ same as decode_msg(), but the decoded payload (cmd_code excluded) is written
+        at the beginning of the caller-supplied writable buffer out (e.g. a bytearray),
+        so that no intermediate bytes object is allocated.
+        packet_bytes must be a bytes or bytearray.
+        returns: (addr, cmd_code, decoded_payload_len) """
+
+        addr, stuffed_payload_len = self._check_packet(packet_bytes)
+
+        start = 3
+        end = 3 + stuffed_payload_len
+        if packet_bytes[start] == self.ASCII_ESC:
+            if end - start < 2:
+                raise MAB_MGB_stuffing_error('illegal sequence of bytes:{}'.format(bytes(packet_bytes[start:end])))
+            cmd_code = self._unstuff_buffer(packet_bytes[start:start + 2])[0]
+            start += 2
+        else:
+            cmd_code = packet_bytes[start]
+            start += 1
+
+        if len(out) < end - start:
+            raise ValueError('output buffer too small:{}/{}'.format(len(out), end - start))
+
+        decoded_payload_len = self._unstuff_into(packet_bytes, start, end, out)
+
+        return (addr, cmd_code, decoded_payload_len)
+
+    def _encode_into(self, out, addr, cmd_code, payload_bytes):
+        """ appends to the bytearray out the full packet coding for (addr, cmd_code, payload_bytes).
+        No intermediate list is built: the header, the stuffed payload and the crc are written in place. """
+
+        ext_payload_bytes = bytes((cmd_code, )) + bytes(payload_bytes)
 
         if len(ext_payload_bytes) > (256 - 20 - 8):
             raise ValueError("payload's length {} is out of range. payload:{}".format(
                 len(ext_payload_bytes), ["0x%02X" % int(b) for b in ext_payload_bytes]))
 
-        packet_list = []
-
         stuffed_payload_bytes = self._stuff_buffer(ext_payload_bytes)
         pack_len = len(stuffed_payload_bytes)
 
-        packet_list += [self.ASCII_STX, ]
-        packet_list += [addr + 0x20, ]
-        packet_list += [pack_len + 8 + 0x20, ]
-        packet_list += [stuffed_payload_bytes]
+        start = len(out)
+        out += bytes((self.ASCII_STX, addr + 0x20, pack_len + 8 + 0x20))
+        out += stuffed_payload_bytes
 
-        pack_crc = self._crc16(bytes(packet_list), 0)
-        # ~ in python2 function 'bytes()' is an alias for 'str()' so, has its idiosyncrasies
-        pack_crc_0 = ((pack_crc >> 12) & 0x0F) + 0x20
-        pack_crc_1 = ((pack_crc >> 8) & 0x0F) + 0x20
-        pack_crc_2 = ((pack_crc >> 4) & 0x0F) + 0x20
-        pack_crc_3 = ((pack_crc >> 0) & 0x0F) + 0x20
+        with memoryview(out) as packet_view:
+            pack_crc = self._crc16(packet_view[start:], 0)
 
-        packet_list += bytes([pack_crc_0, pack_crc_1, pack_crc_2, pack_crc_3, self.ASCII_ETX])
+        out += bytes((
+            ((pack_crc >> 12) & 0x0F) + 0x20,
+            ((pack_crc >> 8) & 0x0F) + 0x20,
+            ((pack_crc >> 4) & 0x0F) + 0x20,
+            ((pack_crc >> 0) & 0x0F) + 0x20,
+            self.ASCII_ETX))
 
-        packet_bytes = bytes(packet_list)
+        return out
+
+    def encode_msg(self, addr, cmd_code, payload_bytes):
+        """ takes in input (addr, cmd_code, payload_bytes_to_be_encoded)
+        returns a full packet of bytes ready to be sent to serial port.  """
+
+        return bytes(self._encode_into(bytearray(), addr, cmd_code, payload_bytes))
+
+    def encode_cached(self, addr, cmd_code, payload_bytes=b''):
+        """ same as encode_msg(), for packets that never change (e.g. the static poll commands):
+        the packet is encoded once and then served from a cache of at most FRAME_CACHE_SIZE entries. """
+
+        key = (addr, cmd_code, bytes(payload_bytes))
+        packet_bytes = self._frame_cache.get(key)
+        if packet_bytes is None:
+            packet_bytes = self.encode_msg(addr, cmd_code, payload_bytes)
+            if len(self._frame_cache) < self.FRAME_CACHE_SIZE:
+                self._frame_cache[key] = packet_bytes
 
         return packet_bytes
+
+    def clear_cache(self):
+
+        self._frame_cache.clear()
+
+    def encode_many(self, messages, out=None, cached=False):
+        """ takes in input a list of (addr, cmd_code, payload_bytes) and writes all the packets, back to back,
+        into the bytearray out, so that they can be sent to serial port with a single write.
+        out is cleared and reused (its allocation is kept), if None a new bytearray is created.
+        If cached is True the packets are taken from (and added to) the cache of encode_cached().
+        returns: out """
+
+        if out is None:
+            out = bytearray()
+        else:
+            del out[:]
+
+        for addr, cmd_code, payload_bytes in messages:
+            if cached:
+                out += self.encode_cached(addr, cmd_code, payload_bytes)
+            else:
+                self._encode_into(out, addr, cmd_code, payload_bytes)
+
+        return out
+
+
+def _crc16_table(data_bytes, CRCinit):
+    " reference implementation: one lookup in MAB_MGB_protocol.CRC_TABLE per byte."
+
+    table = MAB_MGB_protocol.CRC_TABLE
+    for b in data_bytes:
+        CRCinit = (CRCinit >> 8) ^ table[(CRCinit ^ b) & 0xFF]
+
+    return CRCinit
+
+
+_CRC_WIDE_TABLE = None
+
+
+def _crc16_wide_table():
+    """ the crc is 16 bits wide, so two steps of the byte table push out all of its bits:
+    crc' = WIDE[crc ^ (b0 | b1 << 8)] where WIDE[x] is x pushed through two steps with zero data.
+    The table (128kB) is built on first use. """
+
+    global _CRC_WIDE_TABLE  # pylint: disable=global-statement
+
+    if _CRC_WIDE_TABLE is None:
+        table = MAB_MGB_protocol.CRC_TABLE
+        step = [(x >> 8) ^ table[x & 0xFF] for x in range(0x10000)]
+        _CRC_WIDE_TABLE = array('H', [(y >> 8) ^ table[y & 0xFF] for y in step])
+
+    return _CRC_WIDE_TABLE
+
+
+def _crc16_wide(data_bytes, CRCinit):
+    " two bytes per lookup in the 16 bit wide table, bit-exact with _crc16_table()."
+
+    data_view = memoryview(data_bytes)
+    size = len(data_view)
+    even = size & ~1
+    wide = _CRC_WIDE_TABLE or _crc16_wide_table()
+
+    words = array('H')
+    words.frombytes(data_view[:even])
+    if sys.byteorder == 'big':
+        words.byteswap()
+    for w in words:
+        CRCinit = wide[CRCinit ^ w]
+
+    if size != even:
+        CRCinit = _crc16_table(data_view[even:], CRCinit)
+
+    return CRCinit
+
+
+class MAB_MGB_crc16:
+
+    """ the crc16 of MAB_MGB_protocol, as an object that can be fed incrementally:
+
+        crc = MAB_MGB_crc16()
+        crc.update(first_chunk)
+        crc.update(second_chunk)
+        crc.value
+
+        The actual computation is delegated to a backend, a function (data_bytes, CRCinit) -> crc
+        registered in backends. Every backend must be bit-exact with 'table', the original
+        implementation. binascii.crc_hqx and zlib.crc32 use different polynomials, so they cannot be
+        plugged here; a C extension can be, with register_backend().
+    """
+
+    backends = {
+        'table': _crc16_table,
+        'wide': _crc16_wide,
+    }
+    default_backend = 'wide'
+
+    def __init__(self, data_bytes=b'', value=0, backend=None):
+
+        self.value = value
+        self._backend = backend or self.default_backend
+        self._crc16 = self.backends[self._backend]
+        if data_bytes:
+            self.update(data_bytes)
+
+    @classmethod
+    def register_backend(cls, name, fct, make_default=False):
+
+        cls.backends[name] = fct
+        if make_default:
+            cls.default_backend = name
+
+    def update(self, data_bytes):
+
+        self.value = self._crc16(data_bytes, self.value)
+        return self
+
+    def reset(self, value=0):
+
+        self.value = value
+
+    def copy(self):
+
+        return MAB_MGB_crc16(value=self.value, backend=self._backend)
+
+
+class MAB_MGB_stream_decoder:
+
+    """ a stateful decoder for a stream of bytes as coming from the serial port.
+
+        bytes are fed in chunks of any size (a chunk can hold no frame, part of a frame or many frames)
+        and the decoded frames are returned as MAB_MGB_frame (addr, cmd_code, decoded_payload_bytes).
+        The partial frame at the end of a chunk is kept until the next call to feed().
+
+        Since STX and ETX never appear inside a (stuffed) packet, after garbage, a frame too long or
+        a packet that does not decode (wrong crc, wrong length, etc.) the decoder resyncs on the next STX.
+        The number of discarded packets is counted in self.errors and, by kind of error
+        (see DECODE_ERROR_NAMES), in self.error_counts.
+
+        The crc of a partial frame is updated as its bytes arrive, so that a frame split across
+        many chunks is never scanned twice.
+    """
+
+    def __init__(self, protocol=None):
+
+        self.protocol = protocol if protocol is not None else MAB_MGB_protocol()
+        self.errors = 0
+        self.error_counts = array('Q', [0]) * len(DECODE_ERROR_NAMES)
+        self._buffer = bytearray()
+        # ~ crc of the partial frame at the start of _buffer, computed on _buffer[0:_crc_upto]
+        self._crc = MAB_MGB_crc16()
+        self._crc_upto = 0
+
+    def reset(self):
+        " drop the partial frame, if any."
+
+        del self._buffer[:]
+        self._crc.reset()
+        self._crc_upto = 0
+
+    def pending(self):
+        " the number of bytes of the partial frame waiting for the next chunks."
+
+        return len(self._buffer)
+
+    def feed(self, chunk):
+        """ appends chunk to the internal buffer and returns the list of all the complete frames
+        found so far, as (addr, cmd_code, decoded_payload_bytes). """
+
+        STX = self.protocol.ASCII_STX
+        ETX = self.protocol.ASCII_ETX
+        max_len = self.protocol.MAX_PACKET_LEN
+        decode_msg = self.protocol.decode_msg
+
+        frames = []
+        buffer = self._buffer
+        crc = self._crc
+        crc_upto = self._crc_upto
+        self._crc_upto = 0
+        buffer += chunk
+        pos = 0
+        with memoryview(buffer) as view:
+            while True:
+                start = buffer.find(STX, pos)
+                if start < 0:
+                    # ~ no frame start: all of it is garbage
+                    pos = len(buffer)
+                    break
+                end = buffer.find(ETX, start + 1, start + max_len)
+                if end < 0:
+                    if len(buffer) - start >= max_len:
+                        # ~ no ETX where it was due: skip this STX
+                        self.errors += 1
+                        self.error_counts[DECODE_ERROR_LENGTH] += 1
+                        pos = start + 1
+                        continue
+                    # ~ partial frame, wait for more bytes. The last 4 bytes can be the packet crc.
+                    pos = start
+                    if start != 0 or crc_upto == 0:
+                        crc.reset()
+                        crc_upto = start
+                    if len(buffer) - 4 > crc_upto:
+                        crc.update(view[crc_upto:len(buffer) - 4])
+                        crc_upto = len(buffer) - 4
+                    self._crc_upto = crc_upto - start
+                    break
+                next_start = buffer.find(STX, start + 1, end)
+                if next_start >= 0:
+                    # ~ truncated frame followed by a new one: resync
+                    self.errors += 1
+                    self.error_counts[DECODE_ERROR_FRAMING] += 1
+                    pos = next_start
+                    continue
+                pos = end + 1
+                payload_crc = None
+                if start == 0 and 0 < crc_upto <= end - 4:
+                    payload_crc = crc.update(view[crc_upto:end - 4]).value
+                try:
+                    frames.append(decode_msg(view[start:pos], payload_crc))
+                except MAB_MGB_decode_error as e:
+                    self.errors += 1
+                    self.error_counts[e.kind] += 1
+
+        del buffer[:pos]
+
+        return frames
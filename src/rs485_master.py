@@ -17,22 +17,73 @@ import tornado.web            # pylint: disable=import-error
 import tornado.httpserver     # pylint: disable=import-error
 import tornado.ioloop         # pylint: disable=import-error
 import tornado.websocket      # pylint: disable=import-error
-import tornado.options        # pylint: disable=import-error
 
 import json
+import struct
+import argparse
+import inspect
+import collections
 import aioserial
-from datetime import datetime
+
+from driver import coalesce, parse_priority, PriorityWriteQueue, PRIORITY_NORMAL
+from mab_mgb_protocol import MAB_MGB_frame, MAB_MGB_decode_error
+from mab_mgb_master import MAB_MGB_master
+from bus_metrics import RateCounter
+from traffic_trace import TraceRing, RX, TX, install_dump_signal
+from traffic_history import TrafficHistory, NO_ADDR
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
+
+def _process_start_time():
+    " wall clock time the process was started at, imports included (from /proc, 10 ms resolution), or now."
+    try:
+        with open('/proc/self/stat', encoding='ascii') as f:
+            # ~ starttime, field 22, in clock ticks since boot; the 2nd field (comm) can hold spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', encoding='ascii') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+# ~ the origin of the startup times in /metrics
+STARTUP_TIME = _process_start_time()
+
 LISTEN_PORT = 8000
 LISTEN_ADDRESS = '127.0.0.1'
 
 APPLICATION_OPTIONS = dict(
-    debug=True,
-    autoreload=True,
-    template_path=os.path.join(HERE, "..", "templates"),
-    compiled_template_cache=False)
+    template_path=os.path.join(HERE, "..", "templates"))
+
+# ~ tornado settings added to APPLICATION_OPTIONS by launch profile, see get_application_settings()
+APPLICATION_PROFILES = {
+    # ~ reload on source changes and recompile the templates at every request
+    'development': dict(debug=True, autoreload=True, compiled_template_cache=False),
+    # ~ no file polling, templates compiled once
+    'production': dict(debug=False, autoreload=False, compiled_template_cache=True, static_hash_cache=True),
+}
+DEFAULT_PROFILE = 'development'
+
+# ~ delivery of signals to each websocket channel, see SignalQueue
+WS_BATCH_WINDOW = 0.0
+WS_MAX_QUEUED_SIGNALS = 1000
+WS_OVERFLOW_POLICY = 'drop_oldest'
+# ~ the state of the port and of its write queue: never dropped by the overflow policies
+WS_CONTROL_SIGNALS = ('status', 'write_queue')
+
+# ~ websocket sub-protocol carrying the received traffic in binary messages, see WebsockHandler
+BINARY_SUBPROTOCOL = 'rs485-binary'
+# ~ capture timestamp (uint64, microseconds since epoch), addr, cmd_code, length of the data that follows
+BINARY_RECORD_HEADER = struct.Struct('<QBBH')
+BINARY_NO_ADDR = 0xFF
+# ~ cmd_code of the record (addr BINARY_NO_ADDR) that counts the records dropped before a message
+BINARY_DROPPED = 0xFE
+BINARY_DROPPED_COUNT = struct.Struct('<I')
+
+# ~ the largest page of history answered to get_history
+HISTORY_MAX_PAGE = 1000
 
 GLOBAL_APPLICATION_INSTANCE = None
 
@@ -59,6 +110,175 @@ class HttpHandler(tornado.web.RequestHandler):  # pylint: disable=too-few-public
         return ret
 
 
+class MetricsHandler(tornado.web.RequestHandler):  # pylint: disable=too-few-public-methods
+    """ GET /metrics returns, as JSON, the counters of every open port (see rs485_Master.get_metrics)
+    and the outbound queues of every websocket channel (see WebsockHandler.get_metrics). """
+
+    async def get(self):
+
+        a = get_application_instance()
+        ports = {}
+        for device_name, port in a.ports.get_open_ports().items():
+            metrics = port.get_metrics()
+            if inspect.isawaitable(metrics):
+                # ~ a port served by a worker process (see bus_workers)
+                metrics = await metrics
+            ports[device_name] = metrics
+        self.write({
+            "ports": ports,
+            "websockets": [channel.get_metrics() for channel in a.web_socket_channels],
+            "startup": a.get_startup_metrics(ports),
+        })
+
+
+class SignalQueue:
+    """ The bounded outbound queue of signals of a websocket channel.
+
+    Signals put in the queue are coalesced and sent as a single
+    message once per event loop iteration (window == 0) or once
+    every window seconds. A single signal is sent as is, more
+    signals are sent as:
+
+     {"signal": "batch", "content": [<signal>, ...], "dropped": <n>}
+
+    where n counts the signals dropped since the last message.
+
+    A new message is not sent until the previous one is written out,
+    so a slow client makes signals pile up here, not in Tornado's
+    buffers. When max_queued signals are waiting, the overflow
+    policy applies:
+     - 'drop_oldest': the oldest signal is dropped;
+     - 'sample': only one new signal every sample_every is queued
+       (in place of the oldest), the others are dropped;
+     - 'disconnect': the channel is closed.
+
+    Control signals (see WS_CONTROL_SIGNALS) are never dropped:
+    they are queued even past max_queued, and 'drop_oldest' and
+    'sample' drop the oldest signal that is not one of them.
+    """
+
+    POLICIES = ('drop_oldest', 'sample', 'disconnect')
+
+    def __init__(self, send, close, max_queued=WS_MAX_QUEUED_SIGNALS,
+                 policy=WS_OVERFLOW_POLICY, window=WS_BATCH_WINDOW, sample_every=10, join=None,
+                 is_control=None):
+        self._send = send
+        self._close = close
+        self._join = join if join is not None else self._join_json
+        self._is_control = is_control if is_control is not None else self._is_control_json
+        self._queue = collections.deque()
+        self._scheduled = False
+        self._writing = False
+        self.dropped = 0
+        self.dropped_total = 0
+        self.messages_sent = 0
+        self.configure(max_queued=max_queued, policy=policy, window=window, sample_every=sample_every)
+
+    @classmethod
+    def parse_settings(cls, max_queued=None, policy=None, window=None, sample_every=None):
+        """ the settings given (not None), validated and normalized for configure().
+        Raises ValueError if any of them is invalid. """
+        settings = {}
+        if policy is not None:
+            if policy not in cls.POLICIES:
+                raise ValueError("unknown overflow policy:{}".format(policy))
+            settings['policy'] = policy
+        if max_queued is not None:
+            settings['max_queued'] = max(1, int(max_queued))
+        if window is not None:
+            settings['window'] = max(0.0, float(window))
+        if sample_every is not None:
+            settings['sample_every'] = max(1, int(sample_every))
+        return settings
+
+    def configure(self, max_queued=None, policy=None, window=None, sample_every=None):
+        # ~ all validated before any is applied: an invalid setting leaves the queue as it was
+        settings = self.parse_settings(max_queued=max_queued, policy=policy, window=window, sample_every=sample_every)
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def is_writing(self):
+        " True while a message is being written out to the client."
+        return self._writing
+
+    def put(self, signal):
+        queue = self._queue
+        if len(queue) >= self.max_queued:
+            if self.policy == 'disconnect':
+                self.dropped += 1
+                self.dropped_total += 1
+                logging.warning("websocket channel too slow: closing it")
+                queue.clear()
+                self._close()
+                return
+            if not self._is_control(signal):
+                self.dropped += 1
+                self.dropped_total += 1
+                if self.policy == 'sample' and self.dropped % self.sample_every:
+                    return
+                if not self._drop_oldest():
+                    # ~ only control signals are waiting: the new signal is the one dropped
+                    return
+        queue.append(signal)
+        self._schedule()
+
+    def _drop_oldest(self):
+        " drops the oldest signal that is not a control signal; returns False if there is none."
+        queue = self._queue
+        if not self._is_control(queue[0]):
+            queue.popleft()
+            return True
+        for i, queued in enumerate(queue):
+            if not self._is_control(queued):
+                del queue[i]
+                return True
+        return False
+
+    def _schedule(self):
+        if self._scheduled or self._writing:
+            return
+        self._scheduled = True
+        loop = asyncio.get_event_loop()
+        if self.window > 0:
+            loop.call_later(self.window, self._flush)
+        else:
+            loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._scheduled = False
+        queue = self._queue
+        if not queue:
+            return
+        message = self._join(queue, self.dropped)
+        queue.clear()
+        self.dropped = 0
+        try:
+            future = self._send(message)
+        except tornado.websocket.WebSocketClosedError:
+            return
+        self._writing = True
+        self.messages_sent += 1
+        future.add_done_callback(self._on_written)
+
+    @staticmethod
+    def _is_control_json(signal):
+        return isinstance(signal, dict) and signal.get("signal") in WS_CONTROL_SIGNALS
+
+    @staticmethod
+    def _join_json(queue, dropped):
+        if len(queue) == 1 and not dropped:
+            return queue[0]
+        return {"signal": "batch", "content": list(queue), "dropped": dropped}
+
+    def _on_written(self, future):
+        self._writing = False
+        if future.exception() is None and self._queue:
+            self._schedule()
+
+
 class WebsockHandler(tornado.websocket.WebSocketHandler):
     def initialize(self):
 
@@ -68,19 +288,65 @@ class WebsockHandler(tornado.websocket.WebSocketHandler):
         logging.info(f"n. of active web_socket_channels:{len(a.web_socket_channels)}")
 
         self.msg_counter = 0
-        self.RS485_instance = rs485_Master()
+        self.RS485_instance = rs485_Client(a.ports)
+        self.binary_mode = False
+        self.signal_queue = SignalQueue(self.write_message, self.close)
+        self.binary_queue = SignalQueue(
+            lambda message: self.write_message(message, binary=True), self.close,
+            join=self.join_records)
         
-        def callback(signal, content):
-            now = datetime.now()
+        def callback(signal, content, timestamp):
+            if self.binary_mode and signal in ('recv_from_serial', 'recv_frame'):
+                self.binary_queue.put(self.pack_record(signal, content, timestamp))
+                return
+
+            if signal == 'recv_from_serial':
+                content = content.decode("utf-8", errors="replace")
             answ = {
                 "signal": signal,
                 "content": content,
-                "timestamp": now.strftime("%d/%m/%Y %H:%M:%S")
+                # ~ microseconds since epoch, formatted by the client
+                "timestamp": timestamp // 1000
             }
-            self.write_message(answ)
+            self.signal_queue.put(answ)
         
         self.RS485_instance.set_callback(callback)
 
+    def select_subprotocol(self, subprotocols):
+        """ a client asking for BINARY_SUBPROTOCOL receives the traffic ('recv_from_serial'
+        and 'recv_frame' signals) in binary messages, each made of records:
+
+         header: BINARY_RECORD_HEADER (timestamp, addr, cmd_code, length), little endian
+         data: <length> bytes, the payload of the frame or the received line
+
+        where addr and cmd_code are BINARY_NO_ADDR for lines of text. When records were
+        dropped (see SignalQueue) the message starts with a record of addr BINARY_NO_ADDR
+        and cmd_code BINARY_DROPPED, whose data is their number, as BINARY_DROPPED_COUNT.
+        Answers and other signals are still sent as JSON. """
+        if BINARY_SUBPROTOCOL in subprotocols:
+            self.binary_mode = True
+            return BINARY_SUBPROTOCOL
+        return None
+
+    @staticmethod
+    def pack_record(signal, content, timestamp):
+        if signal == 'recv_frame':
+            # ~ packed by the first binary client, from the payload bytes, and shared with the others
+            if content.record is None:
+                content.record = _pack_record(timestamp, content["addr"], content["cmd_code"], content.payload_bytes)
+            return content.record
+        return _pack_record(timestamp, BINARY_NO_ADDR, BINARY_NO_ADDR, content)
+
+    @staticmethod
+    def join_records(queue, dropped):
+        " the join of the binary queue: the records, after the count of the dropped ones, if any."
+        records = b''.join(queue)
+        if not dropped:
+            return records
+        marker = BINARY_RECORD_HEADER.pack(
+            time.time_ns() // 1000, BINARY_NO_ADDR, BINARY_DROPPED, BINARY_DROPPED_COUNT.size)
+        return marker + BINARY_DROPPED_COUNT.pack(min(dropped, 0xFFFFFFFF)) + records
+
 
     def open(self, *args, **kwargs):
 
@@ -104,11 +370,25 @@ class WebsockHandler(tornado.websocket.WebSocketHandler):
             self.msg_counter += 1
             cmd_name = in_message["command_name"]
             cmd_args = in_message["arguments"]
-            self.answer(cmd_name, self.process_command(cmd_name, cmd_args))
+            ret = self.process_command(cmd_name, cmd_args)
+            if inspect.isawaitable(ret):
+                # ~ e.g. a transaction on the bus: answer when done, meanwhile keep serving messages
+                asyncio.ensure_future(self.answer_later(cmd_name, ret))
+            else:
+                self.answer(cmd_name, ret)
             
         except Exception as e:
             logging.info(f"failed to decode message ", e)
             
+    async def answer_later(self, answer_name, awaitable):
+        try:
+            answer_content = await awaitable
+        except Exception:
+            logging.info("command {} failed: {}".format(answer_name, traceback.format_exc()))
+            answer_content = False
+        if self.ws_connection is not None:
+            self.answer(answer_name, answer_content)
+
 
     def on_close(self):
         logging.info(f"")
@@ -117,11 +397,52 @@ class WebsockHandler(tornado.websocket.WebSocketHandler):
         a = get_application_instance()
         a.web_socket_channels.remove(self)
 
+    def set_delivery(self, *args, **kwargs):
+        """ selects how signals are delivered to this channel: batch window (seconds),
+        max_queued signals and overflow policy (see SignalQueue). They apply to the
+        JSON signals and to the binary records alike. """
+        try:
+            settings = SignalQueue.parse_settings(
+                max_queued=kwargs.get('max_queued'), policy=kwargs.get('policy'),
+                window=kwargs.get('window'), sample_every=kwargs.get('sample_every'))
+        except (TypeError, ValueError):
+            logging.info("invalid delivery parameters: {}".format(kwargs))
+            return False
+        for queue in (self.signal_queue, self.binary_queue):
+            queue.configure(**settings)
+        return True
+
+    def get_metrics(self):
+        " the state of the outbound queues of this channel."
+        return {
+            "device_name": self.RS485_instance.get_device_name(),
+            "binary_mode": self.binary_mode,
+            "queued": len(self.signal_queue) + len(self.binary_queue),
+            "writing": self.signal_queue.is_writing() or self.binary_queue.is_writing(),
+            "messages_sent": self.signal_queue.messages_sent + self.binary_queue.messages_sent,
+            "dropped": self.signal_queue.dropped_total + self.binary_queue.dropped_total,
+        }
+
     def process_command(self, command_name, cmd_args):
+        channel_commands_ = {
+           "set_delivery": WebsockHandler.set_delivery,
+        }
+        if command_name in channel_commands_:
+            return channel_commands_[command_name](self, **cmd_args)
+
         commands_ = {
-           "connect": rs485_Master.connect,
-           "disconnect": rs485_Master.disconnect,
-           "send_on_serial": rs485_Master.send_on_serial,
+           "connect": rs485_Client.connect,
+           "disconnect": rs485_Client.disconnect,
+           "send_on_serial": rs485_Client.send_on_serial,
+           "transact": rs485_Client.transact,
+           "add_poll": rs485_Client.add_poll,
+           "remove_poll": rs485_Client.remove_poll,
+           "start_polling": rs485_Client.start_polling,
+           "stop_polling": rs485_Client.stop_polling,
+           "get_poll_stats": rs485_Client.get_poll_stats,
+           "dump_trace": rs485_Client.dump_trace,
+           "get_history": rs485_Client.get_history,
+           "query_history": rs485_Client.query_history,
         }
         inst = self.RS485_instance
         return commands_[command_name](inst, **cmd_args)
@@ -160,17 +481,99 @@ class rs485_Master:
         Disconnect and let the task die.
         Return boolean.
 
-    send_on_serial(text=string)
-        Send a line of text to serial.
-        Return boolean.
+    send_on_serial(text=string, priority=string, wait=boolean)
+        Send a line of text to serial, with priority 'urgent', 'normal'
+        (the default) or 'bulk' (see driver.PriorityWriteQueue).
+        Return False if the write queue has no room for it or,
+        with wait=True, a coroutine returning True once queued.
+
+    The write queue holds at most write_queue_size packets (a connect()
+    parameter). When it holds 3/4 of the limit of the priority class
+    of the packet just queued, a 'write_queue' signal with content
+    {depth, max_size, rejected, paused: true} asks the producers to
+    pause; the same signal with paused: false is sent when it has
+    drained.
+
+    dump_trace()
+        Return the last traffic on the port (see traffic_trace.TraceRing),
+        as a list of lines of text. The traffic is not logged.
+
+    get_metrics()
+        Return the counters of the port: frames and bytes received (rx)
+        and sent (tx), in total and per second, the depth of the write
+        queue and, with protocol='mab_mgb', the decode errors by kind
+        and the histogram of the reply latency (see bus_metrics), and
+        first_rx_time, the wall clock time of the first data received.
+
+    get_history(before_seq=int, before_timestamp=int, limit=int)
+        Return a page of the history of the received traffic (see
+        traffic_history.TrafficHistory): {"rows": [...], "oldest": seq}
+        where each row is [seq, timestamp, direction, addr, cmd_code,
+        content], oldest first. content is the payload as hex string or,
+        for lines of text (addr and cmd_code null), the text. The page
+        holds the limit rows preceding the row before_seq or, given
+        before_timestamp (microseconds), up to that time included;
+        without both, the newest rows. oldest is the seq of the oldest
+        row still in the history.
+
+    query_history(addr=int, cmd_code=int, start_timestamp=int,
+                  end_timestamp=int, before_seq=int, limit=int)
+        Return a page of the rows of the history with the given addr
+        and cmd_code, received between start_timestamp and end_timestamp
+        (microseconds, included), all optional, as get_history() does,
+        plus "next": the before_seq of the next (older) page, null after
+        the last one. Rows are looked up through the indexes by addr and
+        cmd_code, not by scanning the history.
+
+    When connect() is given capture_file=path, all the traffic is
+    also recorded to that binary capture file (see traffic_capture),
+    which driver.ReplayDriver can replay.
     
     set_callback(function)
         Set the callback function. It shall have
-        two arguments: 
+        three arguments: 
         - signal: the name of signal, e.g. 'recv_from_serial'
-        - content: the attached data, e.g. the received text
+        - content: the attached data, e.g. the received line
+          as bytes ('recv_from_serial'), or the received frame
+          as a FrameContent, a dict {addr, cmd_code, payload
+          (hex string) and fields, if a schema is registered}
+          ('recv_frame'), built once whatever the number of
+          callbacks
+        - timestamp: when the data was captured, as integer
+          nanoseconds since epoch. The reader takes it from
+          time.monotonic_ns(), mapped to the wall clock once
+          per connection: differences between timestamps are
+          exact even if the system clock is adjusted.
+
+    add_callback(function), remove_callback(function)
+        Same as set_callback, for more than one client class
+        sharing the port (see rs485_PortRegistry).
+
+    When connect() is given protocol='mab_mgb', the port speaks
+    MAB_MGB_protocol instead of lines of text: received frames are
+    sent back as 'recv_frame' signals and the following methods
+    (see MAB_MGB_master) are available. Payloads are hex strings.
+
+    transact(addr=int, cmd_code=int, payload=string, timeout=float, retries=int, priority=string,
+             reply_cmd_code=int, reply_addr=int)
+        Coroutine: send a packet and return the reply (the next frame
+        from reply_addr, addr if not given, with cmd_code
+        reply_cmd_code if given)
+        as a dict (addr, cmd_code, payload) or False on timeout.
+
+    add_poll(addr=int, cmd_code=int, payload=string, reply_addr=int), remove_poll(addr=int, cmd_code=int)
+    start_polling(), stop_polling(), get_poll_stats()
+        Manage the cyclic poll of the slaves. Polls are sent with priority 'bulk'.
         
+    Besides device_name and device_baudrate, connect() accepts
+    flush_deadline (seconds, default 0): the writer sends everything
+    queued since its last write with a single write, waiting up to
+    flush_deadline after the first queued line for more to come.
     """
+
+    FLUSH_DEADLINE = 0.0
+    # ~ the producers are asked to pause when the queue holds this fraction of the limit of their class
+    WRITE_PAUSE_FRACTION = 0.75
           
     def __init__(self):
         logging.info("RS485_Master init ...")
@@ -178,7 +581,19 @@ class rs485_Master:
         self._connect_parameters = asyncio.Queue(maxsize=1)
         
         self._disconnect_event = asyncio.Event()
-        self._write_queue = asyncio.Queue()
+        self._write_queue = PriorityWriteQueue()
+        self._write_paused = False
+        self._callbacks = []
+        self.mab_mgb = None
+        self.trace = TraceRing()
+        self.history = TrafficHistory()
+        self.rx_rate = RateCounter()
+        self.tx_rate = RateCounter()
+        # ~ wall clock time the first data was received at
+        self.first_rx_time = None
+        # ~ called once the port is closed or has failed (see rs485_PortRegistry)
+        self.on_disconnected = None
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
         self._set_status('wait_init')
         
         self._start_backend_task()
@@ -197,81 +612,600 @@ class rs485_Master:
         if self._current_status != 'wait_init':
             return False
         
+        self.connect_parameters = kwargs
+        self.trace.name = kwargs.get('device_name', '')
+        self.history.name = self.trace.name
         self._connect_parameters.put_nowait(kwargs)
         return True
 
     def disconnect(self, *args, **kwargs):
-        if self._current_status != 'connected':
+        if self._current_status == 'disconnected' or self._disconnect_event.is_set():
+            return False
+        if self._current_status == 'wait_init' and self._connect_parameters.empty():
             return False
             
         self._disconnect_event.set()
         return True
 
     def send_on_serial(self, *args, **kwargs):
-        self._write_queue.put_nowait(kwargs['text'])
+        data = kwargs['text'].encode('utf-8') + b'\n'
+        try:
+            priority = parse_priority(kwargs.get('priority'))
+        except ValueError:
+            logging.info("invalid priority: {}".format(kwargs.get('priority')))
+            return False
+        if kwargs.get('wait'):
+            return self._queue_write_wait(data, priority)
+        return self._queue_write(data, priority)
+
+    def _queue_write(self, data, priority=PRIORITY_NORMAL):
+        if not self._write_queue.put_nowait(data, priority):
+            return False
+        self._on_queued(priority)
+        return True
+
+    async def _queue_write_wait(self, data, priority):
+        await self._write_queue.put(data, priority)
+        self._on_queued(priority)
         return True
+
+    def _on_queued(self, priority):
+        self.tx_rate.add(1, 0, time.monotonic_ns() + self._epoch_offset_ns)
+        # ~ relative to the limit of the class of the producer: a bulk flood never gets past max_size // 3
+        if not self._write_paused and \
+                self._write_queue.qsize() >= self._write_queue.limit(priority) * self.WRITE_PAUSE_FRACTION:
+            self._write_paused = True
+            self._send_back_write_queue()
+
+    def _on_dequeued(self):
+        if self._write_paused and self._write_queue.qsize() <= self._write_queue.max_size // 8:
+            self._write_paused = False
+            self._send_back_write_queue()
+
+    def _send_back_write_queue(self):
+        self._send_back('write_queue', {
+            "depth": self._write_queue.qsize(),
+            "max_size": self._write_queue.max_size,
+            "rejected": self._write_queue.rejected,
+            "paused": self._write_paused,
+        })
         
+    async def transact(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        try:
+            reply = await self.mab_mgb.transact(
+                int(kwargs['addr']), int(kwargs['cmd_code']), bytes.fromhex(kwargs.get('payload', '')),
+                timeout=kwargs.get('timeout'), retries=kwargs.get('retries'),
+                priority=parse_priority(kwargs.get('priority')),
+                reply_cmd_code=None if kwargs.get('reply_cmd_code') is None else int(kwargs['reply_cmd_code']),
+                reply_addr=None if kwargs.get('reply_addr') is None else int(kwargs['reply_addr']))
+        except asyncio.TimeoutError:
+            return False
+        return _frame_to_dict(reply)
+
+    def add_poll(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        self.mab_mgb.add_poll(
+            int(kwargs['addr']), int(kwargs['cmd_code']), bytes.fromhex(kwargs.get('payload', '')),
+            timeout=kwargs.get('timeout'),
+            reply_addr=None if kwargs.get('reply_addr') is None else int(kwargs['reply_addr']))
+        return True
+
+    def remove_poll(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        cmd_code = kwargs.get('cmd_code')
+        self.mab_mgb.remove_poll(int(kwargs['addr']), None if cmd_code is None else int(cmd_code))
+        return True
+
+    def start_polling(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        self.mab_mgb.start_polling()
+        return True
+
+    def stop_polling(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        self.mab_mgb.stop_polling()
+        return True
+
+    def get_poll_stats(self, *args, **kwargs):
+        if self.mab_mgb is None:
+            return False
+
+        return self.mab_mgb.get_stats()
+
+    def dump_trace(self, *args, **kwargs):
+        return self.trace.dump()
+
+    def get_history(self, *args, **kwargs):
+        limit = max(0, min(int(kwargs.get('limit', 100)), HISTORY_MAX_PAGE))
+        before = kwargs.get('before_seq')
+        if before is None and kwargs.get('before_timestamp') is not None:
+            before = self.history.find(int(kwargs['before_timestamp']) * 1000 + 999)
+        rows = [_history_row(record) for record in self.history.page(None if before is None else int(before), limit)]
+        return {"rows": rows, "oldest": self.history.oldest()}
+
+    def query_history(self, *args, **kwargs):
+        limit = max(0, min(int(kwargs.get('limit', 100)), HISTORY_MAX_PAGE))
+        query = {}
+        for key in ('addr', 'cmd_code', 'before_seq'):
+            if kwargs.get(key) is not None:
+                query[key] = int(kwargs[key])
+        if kwargs.get('start_timestamp') is not None:
+            query['start'] = int(kwargs['start_timestamp']) * 1000
+        if kwargs.get('end_timestamp') is not None:
+            query['end'] = int(kwargs['end_timestamp']) * 1000 + 999
+        records = self.history.query(
+            query.get('addr'), query.get('cmd_code'), query.get('start'), query.get('end'),
+            query.get('before_seq'), limit)
+        return {
+            "rows": [_history_row(record) for record in records],
+            "next": records[0][0] if records and len(records) == limit else None,
+            "oldest": self.history.oldest(),
+        }
+
+    def get_metrics(self, *args, **kwargs):
+        timestamp = time.monotonic_ns() + self._epoch_offset_ns
+        return {
+            "status": self._current_status,
+            "first_rx_time": self.first_rx_time,
+            "rx": self.rx_rate.as_dict(timestamp),
+            "tx": self.tx_rate.as_dict(timestamp),
+            "write_queue": self._write_queue.qsize(),
+            "write_queue_depths": self._write_queue.depths(),
+            "write_rejected": self._write_queue.rejected,
+            "decode_errors": self.mab_mgb.get_decode_errors() if self.mab_mgb is not None else {},
+            "reply_latency": self.mab_mgb.latency_histogram.as_dict() if self.mab_mgb is not None else None,
+        }
+
     def set_callback(self, fct):
-        self._send_back = fct
+        self._callbacks = [fct]
+
+    def add_callback(self, fct):
+        self._callbacks.append(fct)
+
+    def remove_callback(self, fct):
+        self._callbacks.remove(fct)
+
+    def get_status(self):
+        return self._current_status
+
+    def _send_back(self, signal, content, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns() + self._epoch_offset_ns
+        for fct in self._callbacks:
+            try:
+                fct(signal, content, timestamp)
+            except:
+                logging.info("unable to send back: {}".format(traceback.format_exc()))
+
+    def _send_back_frame(self, frame, timestamp):
+        self.rx_rate.add(1, 0, timestamp)
+        self.history.record_frame(RX, frame[0], frame[1], frame[2], timestamp)
+        self._send_back('recv_frame', FrameContent(frame), timestamp)
+
+    def _on_first_rx(self):
+        self.first_rx_time = time.time()
+        logging.info("first data received from {}, {:.3f} s after startup".format(
+            self.connect_parameters.get('device_name'), self.first_rx_time - STARTUP_TIME))
 
     def _set_status(self, current):
         self._current_status = current
         logging.info("set status to " + current)
-        try:
-            self._send_back('status', current)
-        except:
-            logging.info("unable to send back")
+        self._send_back('status', current)
+        if current == 'disconnected' and self.on_disconnected is not None:
+            self.on_disconnected()
             
     async def _run(self):
         conn_params = await self._connect_parameters.get()
+        self._write_queue.max_size = int(conn_params.get('write_queue_size', PriorityWriteQueue.MAX_SIZE))
         
-        serial = aioserial.AioSerial(
-          port = conn_params['device_name'],
-          baudrate = conn_params['device_baudrate'])
+        try:
+            serial = aioserial.AioSerial(
+              port = conn_params['device_name'],
+              baudrate = conn_params['device_baudrate'])
+        except (OSError, ValueError):
+            # ~ serial.SerialException is an OSError
+            logging.error("unable to open {}: {}".format(conn_params['device_name'], sys.exc_info()[1]))
+            self._set_status('disconnected')
+            return
         
+        if conn_params.get('protocol') == 'mab_mgb':
+            self.mab_mgb = MAB_MGB_master(self._queue_write)
+            self.mab_mgb.on_frame = self._send_back_frame
+
+        capture = None
+        if conn_params.get('capture_file'):
+            from traffic_capture import CaptureWriter   # pylint: disable=import-outside-toplevel
+            capture = CaptureWriter(conn_params['capture_file'])
+
+        # ~ capture timestamps are monotonic, mapped to the wall clock once per connection
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
         self._set_status('connected')
         
         async def read():
             logging.info("starting read")
             while True:
                 text = await serial.read_until_async(aioserial.LF)
-                logging.info("Recv text:" + text.decode("utf-8"))
-                self._send_back('recv_from_serial', text.decode("utf-8"))
+                timestamp = time.monotonic_ns() + self._epoch_offset_ns
+                if self.first_rx_time is None:
+                    self._on_first_rx()
+                self.rx_rate.add(1, len(text), timestamp)
+                self.history.record_frame(RX, NO_ADDR, NO_ADDR, text, timestamp)
+                self.trace.record(RX, text, timestamp)
+                if capture is not None:
+                    capture.record(RX, text, timestamp)
+                self._send_back('recv_from_serial', text, timestamp)
+
+        async def read_frames():
+            logging.info("starting read of frames")
+            while True:
+                data = await serial.read_async(max(1, serial.in_waiting))
+                timestamp = time.monotonic_ns() + self._epoch_offset_ns
+                if self.first_rx_time is None:
+                    self._on_first_rx()
+                self.rx_rate.add(0, len(data), timestamp)
+                self.trace.record(RX, data, timestamp)
+                if capture is not None:
+                    capture.record(RX, data, timestamp)
+                self.mab_mgb.feed(data, timestamp)
+
+        flush_deadline = float(conn_params.get('flush_deadline', self.FLUSH_DEADLINE))
 
         async def write():
             while True:
-                text = await self._write_queue.get()
-                logging.info("Send text:" + text)
-                await serial.write_async(text.encode('utf-8') + b'\n')
+                data = await coalesce(self._write_queue, flush_deadline)
+                self._on_dequeued()
+                timestamp = time.monotonic_ns() + self._epoch_offset_ns
+                self.tx_rate.add(0, len(data), timestamp)
+                self.trace.record(TX, data, timestamp)
+                if capture is not None:
+                    capture.record(TX, data, timestamp)
+                await serial.write_async(data)
                 
-        read_task = asyncio.ensure_future(read())
+        read_task = asyncio.ensure_future(read() if self.mab_mgb is None else read_frames())
         write_task = asyncio.ensure_future(write())
 
-        await self._disconnect_event.wait()
+        # ~ until disconnect() or the end of the reading (e.g. the device was unplugged)
+        disconnect_task = asyncio.ensure_future(self._disconnect_event.wait())
+        await asyncio.wait([disconnect_task, read_task], return_when=asyncio.FIRST_COMPLETED)
+        disconnect_task.cancel()
+        if read_task.done() and not read_task.cancelled() and read_task.exception() is not None:
+            logging.error("reading {} failed: {}".format(conn_params['device_name'], read_task.exception()))
+        if self.mab_mgb is not None:
+            self.mab_mgb.stop_polling()
+        read_task.cancel()
+        write_task.cancel()
         serial.close()
+        if capture is not None:
+            capture.close()
         self._set_status('disconnected')
+
+
+def _history_row(record):
+    seq, timestamp, direction, addr, cmd_code, data = record
+    if addr == NO_ADDR:
+        return [seq, timestamp // 1000, direction, None, None, data.decode("utf-8", errors="replace")]
+    return [seq, timestamp // 1000, direction, addr, cmd_code, data.hex()]
+
+
+def _frame_to_dict(frame):
+    addr, cmd_code, payload_bytes = frame
+    ret = {"addr": addr, "cmd_code": cmd_code, "payload": payload_bytes.hex()}
+    if isinstance(frame, MAB_MGB_frame) and frame.schema is not None:
+        # ~ the fields are unpacked once per frame, whatever the number of clients
+        try:
+            ret["fields"] = {k: v.hex() if isinstance(v, bytes) else v for k, v in frame.fields.items()}
+        except MAB_MGB_decode_error as e:
+            ret["fields_error"] = str(e)
+    return ret
+
+
+class FrameContent(dict):
+    """ the content of a 'recv_frame' signal, built once per frame whatever the number of
+    callbacks: the dict of the frame, ready for JSON (see _frame_to_dict), that also keeps
+    the payload as bytes and the binary record of the frame, packed by the first client
+    that needs it (see WebsockHandler.pack_record). """
+
+    def __init__(self, frame):
+        super().__init__(_frame_to_dict(frame))
+        self.payload_bytes = bytes(frame[2])
+        self.record = None
+
+
+def _pack_record(timestamp, addr, cmd_code, data):
+    data = data[:0xFFFF]
+    return BINARY_RECORD_HEADER.pack(timestamp // 1000, addr, cmd_code, len(data)) + data
+
+
+class rs485_PortRegistry:
+    """ The process-wide set of open serial ports.
+
+    Each device is opened once, by a single rs485_Master, whatever
+    the number of client classes using it: received data is read and
+    decoded once and then fanned out to the callbacks of all of them.
+    The port is closed when the last client releases it, and forgotten
+    when it fails to open or gets disconnected, so that the next client
+    opens it again.
+
+    With the connection parameter worker=True the port is served by
+    a worker process of its own (see bus_workers.WorkerPort), so that
+    many busy buses use many cores.
+
+    open_buses() opens ports at startup, from a configuration (see
+    load_bus_config): they stay open when no client uses them.
+    """
+
+    def __init__(self):
+        # ~ device_name -> [rs485_Master or WorkerPort instance, reference count]
+        self._ports = {}
+
+    def open_buses(self, buses):
+        for conn_params in buses:
+            try:
+                self.acquire(_keep_open, **conn_params)
+            except (KeyError, ValueError):
+                logging.error("unable to open bus {}: {}".format(conn_params, traceback.format_exc()))
+
+    def acquire(self, callback, **conn_params):
+        device_name = conn_params['device_name']
+        entry = self._ports.get(device_name)
+        if entry is None:
+            if conn_params.get('worker'):
+                from bus_workers import WorkerPort   # pylint: disable=import-outside-toplevel
+                port = WorkerPort()
+            else:
+                port = rs485_Master()
+            port.add_callback(callback)
+            self._ports[device_name] = [port, 1]
+            port.on_disconnected = lambda: self._forget(device_name, port)
+            port.connect(**conn_params)
+            logging.info("opened port {}".format(device_name))
+            return port
+
+        port, _ = entry
+        for name in ('device_baudrate', 'protocol'):
+            # ~ a parameter left out (e.g. protocol, by the page) takes the value of the open port
+            if not _same_parameter(conn_params.get(name), port.connect_parameters.get(name)):
+                raise ValueError("port {} is already open with {}={}".format(
+                    device_name, name, port.connect_parameters.get(name)))
+        entry[1] += 1
+        port.add_callback(callback)
+        callback('status', port.get_status(), time.time_ns())
+        logging.info("port {} shared by {} clients".format(device_name, entry[1]))
+        return port
+
+    def release(self, device_name, callback, port=None):
+        " port, if given, is the one acquired: nothing is done if it has been forgotten meanwhile."
+        entry = self._ports.get(device_name)
+        if entry is None or port not in (None, entry[0]):
+            if port is not None:
+                port.remove_callback(callback)
+            return
+        port, _ = entry
+        port.remove_callback(callback)
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._ports[device_name]
+            port.disconnect()
+            logging.info("closed port {}".format(device_name))
+
+    def get_open_ports(self):
+        return {device_name: entry[0] for device_name, entry in self._ports.items()}
+
+    def get_reference_count(self, device_name):
+        entry = self._ports.get(device_name)
+        return 0 if entry is None else entry[1]
+
+    def _forget(self, device_name, port):
+        entry = self._ports.get(device_name)
+        if entry is not None and entry[0] is port:
+            del self._ports[device_name]
+            logging.info("port {} closed, forgotten".format(device_name))
+
+
+def _keep_open(signal, content, timestamp):
+    " the client of the ports opened by rs485_PortRegistry.open_buses()."
+
+
+def _same_parameter(given, current):
+    " False if the connection parameter given differs from the current one; None or '' is not given."
+    if given is None or given == '':
+        return True
+    try:
+        # ~ e.g. a baudrate as a string, from the page, and as an int, from the configuration
+        return int(given) == int(current)
+    except (TypeError, ValueError):
+        return str(given) == str(current)
+
+
+def load_config(path):
+    """ reads the configuration of the server from the JSON file at path:
+
+     {
+        "listen_address": ..., "listen_port": ..., "profile": "production" | "development",
+        "buses": [{"device_name": ..., "device_baudrate": ..., "protocol": ..., "worker": ...}, ...]
+     }
+
+    where each bus holds the parameters of connect(). All the keys are optional. """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_application_settings(profile=DEFAULT_PROFILE):
+    " the settings of tornado.web.Application for the launch profile."
+    return dict(APPLICATION_OPTIONS, **APPLICATION_PROFILES[profile])
+
+
+def resolve_options(argv=None):
+    """ the effective options of the server, from the command line argv (default sys.argv[1:])
+    and the configuration file it names (see load_config): the command line wins over the file.
+    returns: a dict with listen_address, listen_port, profile and buses.
+    Exits with a usage message, as argparse does, on invalid arguments or profile. """
+
+    parser = argparse.ArgumentParser(description="rs485 master: a web UI to check the communication on a rs485 field bus.")
+    parser.add_argument('config', nargs='?', help="JSON configuration file, see load_config()")
+    parser.add_argument('--listen-address', help="address to listen at, '' for all (default {})".format(LISTEN_ADDRESS))
+    parser.add_argument('--listen-port', type=int, help="port to listen at (default {})".format(LISTEN_PORT))
+    parser.add_argument('--profile', choices=sorted(APPLICATION_PROFILES), help="launch profile (default {})".format(DEFAULT_PROFILE))
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config) if args.config else {}
+    for key in ('listen_address', 'listen_port', 'profile'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    options = {
+        "listen_address": config.get('listen_address', LISTEN_ADDRESS),
+        "listen_port": config.get('listen_port', LISTEN_PORT),
+        "profile": config.get('profile', DEFAULT_PROFILE),
+        "buses": config.get('buses', []),
+    }
+    if options["profile"] not in APPLICATION_PROFILES:
+        parser.error("unknown profile {}".format(options["profile"]))
+    try:
+        options["listen_port"] = int(options["listen_port"])
+    except (TypeError, ValueError):
+        parser.error("invalid listen_port {}".format(options["listen_port"]))
+    return options
+
+
+def load_bus_config(path):
+    " reads the configuration of the buses from the JSON file at path (see load_config)."
+    return load_config(path).get("buses", [])
+
+
+class rs485_Client:
+    """ The per-websocket view of a serial port shared through
+    a rs485_PortRegistry: it has the same methods of rs485_Master
+    (connect, disconnect, send_on_serial, set_callback) but
+    connect and disconnect acquire and release the shared port.
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._port = None
+        self._device_name = None
+        self._send_back = None
+
+    def connect(self, *args, **kwargs):
+        if self._port is not None:
+            return False
+
+        try:
+            self._port = self._registry.acquire(self._on_signal, **kwargs)
+        except (KeyError, ValueError):
+            logging.info("unable to connect: {}".format(traceback.format_exc()))
+            return False
+        self._device_name = kwargs['device_name']
+        return True
+
+    def disconnect(self, *args, **kwargs):
+        if self._port is None:
+            return False
+
+        self._registry.release(self._device_name, self._on_signal, self._port)
+        self._port = None
+        self._device_name = None
+        self._on_signal('status', 'disconnected', time.time_ns())
+        return True
+
+    def send_on_serial(self, *args, **kwargs):
+        if self._port is None:
+            return False
+
+        return self._port.send_on_serial(*args, **kwargs)
+
+    async def transact(self, *args, **kwargs):
+        if self._port is None:
+            return False
+
+        return await self._port.transact(*args, **kwargs)
+
+    def add_poll(self, *args, **kwargs):
+        return self._port is not None and self._port.add_poll(*args, **kwargs)
+
+    def remove_poll(self, *args, **kwargs):
+        return self._port is not None and self._port.remove_poll(*args, **kwargs)
+
+    def start_polling(self, *args, **kwargs):
+        return self._port is not None and self._port.start_polling(*args, **kwargs)
+
+    def stop_polling(self, *args, **kwargs):
+        return self._port is not None and self._port.stop_polling(*args, **kwargs)
+
+    def get_poll_stats(self, *args, **kwargs):
+        return self._port is not None and self._port.get_poll_stats(*args, **kwargs)
+
+    def dump_trace(self, *args, **kwargs):
+        return self._port is not None and self._port.dump_trace(*args, **kwargs)
+
+    def get_history(self, *args, **kwargs):
+        return self._port is not None and self._port.get_history(*args, **kwargs)
+
+    def query_history(self, *args, **kwargs):
+        return self._port is not None and self._port.query_history(*args, **kwargs)
+
+    def get_device_name(self):
+        return self._device_name
+
+    def set_callback(self, fct):
+        self._send_back = fct
+
+    def _on_signal(self, signal, content, timestamp):
+        if signal == 'status' and content == 'disconnected' and self._port is not None:
+            # ~ the port failed or was closed: a new connect() opens it again
+            self._port = None
+            self._device_name = None
+        if self._send_back is not None:
+            self._send_back(signal, content, timestamp)
         
 class Application:
 
     url_map = [
         (r"/", HttpHandler, {}),
         (r'/websocket', WebsockHandler, {}),
+        (r'/metrics', MetricsHandler, {}),
     ]
 
     web_socket_channels = []
 
-    def start_tornado(self):
+    ports = rs485_PortRegistry()
+
+    # ~ wall clock time the server started listening at
+    listening_time = None
+
+    def start_tornado(self, listen_address=LISTEN_ADDRESS, listen_port=LISTEN_PORT, profile=DEFAULT_PROFILE):
 
-        logging.info("starting tornado webserver on {}:{}...".format(LISTEN_ADDRESS, LISTEN_PORT))
+        logging.info("starting tornado webserver on {}:{} ({})...".format(listen_address, listen_port, profile))
 
-        app = tornado.web.Application(self.url_map, **APPLICATION_OPTIONS)
-        app.listen(LISTEN_PORT, LISTEN_ADDRESS)
-        tornado.platform.asyncio.AsyncIOMainLoop().install()
+        app = tornado.web.Application(self.url_map, **get_application_settings(profile))
+        # ~ tornado runs on the asyncio event loop already: installing AsyncIOMainLoop again raises
+        app.listen(listen_port, listen_address)
+        self.listening_time = time.time()
+        logging.info("listening {:.3f} s after startup".format(self.listening_time - STARTUP_TIME))
 
+    def get_startup_metrics(self, port_metrics):
+        " seconds from the start of the server to listening and to the first data of each port."
 
+        return {
+            "listening": None if self.listening_time is None else self.listening_time - STARTUP_TIME,
+            "first_rx": {
+                device_name: None if not metrics or metrics.get("first_rx_time") is None else metrics["first_rx_time"] - STARTUP_TIME
+                for device_name, metrics in port_metrics.items()},
+        }
 
-    def run(self):
-        self.start_tornado()
+    def run(self, **kwargs):
+        self.start_tornado(**kwargs)
 
         asyncio.get_event_loop().run_forever()
 
@@ -282,8 +1216,14 @@ def main():
         stream=sys.stdout, level="INFO",
         format="[%(asctime)s]%(levelname)s %(funcName)s() %(filename)s:%(lineno)d %(message)s")
 
+    options = resolve_options()
+
+    install_dump_signal()
+
     a = get_application_instance()
-    a.run()
+    # ~ the buses are opened before listening, so that they are ready when the first client connects
+    a.ports.open_buses(options['buses'])
+    a.run(listen_address=options['listen_address'], listen_port=options['listen_port'], profile=options['profile'])
 
 
 if __name__ == '__main__':
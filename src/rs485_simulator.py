@@ -0,0 +1,231 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+import os
+import sys
+import tty
+import random
+import asyncio
+import logging
+import argparse
+
+from mab_mgb_protocol import MAB_MGB_protocol, MAB_MGB_stream_decoder
+
+
+class MAB_MGB_slave_config:
+
+    " how a simulated slave answers."
+
+    def __init__(self, reply_size=16, latency=0.002, error_rate=0.0, crc_error_rate=0.0):
+
+        self.reply_size = reply_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.crc_error_rate = crc_error_rate
+
+
+class MAB_MGB_slave_simulator:
+
+    """ one or many virtual slaves speaking MAB_MGB_protocol on a pseudo-terminal.
+
+        After start(), device_name is the name of the pty to be given to rs485_Master
+        (connect(device_name=..., protocol='mab_mgb')) or to any other serial client.
+
+        Each packet addressed to a simulated slave is answered, after the slave's latency,
+        with a packet from the same addr, with cmd_code + 1 and a payload of reply_size random bytes.
+        A fraction error_rate of the requests is not answered at all and a fraction crc_error_rate
+        of the replies has a corrupted crc. With baudrate, the time needed to send the reply on a
+        real line is added to the latency. With burst_interval, every burst_interval seconds
+        burst_size unsolicited packets are sent, from random simulated slaves.
+        Counters are in stats. What the pty cannot take at once is written when it gets writable,
+        up to MAX_PENDING_OUT bytes: packets beyond are dropped whole, never truncated.
+    """
+
+    MAX_PENDING_OUT = 1 << 20
+
+    def __init__(self, addresses=(MAB_MGB_protocol.MAB_ADDR, MAB_MGB_protocol.MGB_ADDR), baudrate=None,
+                 burst_interval=None, burst_size=10, echo=False, seed=None, **slave_config):
+
+        self.protocol = MAB_MGB_protocol()
+        self.slaves = {addr: MAB_MGB_slave_config(**slave_config) for addr in addresses}
+        self.baudrate = baudrate
+        self.burst_interval = burst_interval
+        self.burst_size = burst_size
+        self.echo = echo
+        self.device_name = None
+        self.stats = {"requests": 0, "replies": 0, "dropped": 0, "corrupted": 0, "unsolicited": 0, "decode_errors": 0}
+
+        self._random = random.Random(seed)
+        self._decoder = MAB_MGB_stream_decoder(self.protocol)
+        self._master_fd = None
+        self._slave_fd = None
+        self._burst_task = None
+        # ~ what the pty could not take yet, written when it gets writable
+        self._out = bytearray()
+
+    def add_slave(self, addr, **slave_config):
+
+        self.slaves[addr] = MAB_MGB_slave_config(**slave_config)
+
+    def start(self):
+
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._master_fd)
+        tty.setraw(self._slave_fd)
+        os.set_blocking(self._master_fd, False)
+        self.device_name = os.ttyname(self._slave_fd)
+
+        asyncio.get_event_loop().add_reader(self._master_fd, self._on_readable)
+        if self.burst_interval:
+            self._burst_task = asyncio.ensure_future(self._send_bursts())
+
+        logging.info("simulating slaves {} on {}".format(sorted(self.slaves), self.device_name))
+        return self.device_name
+
+    def stop(self):
+
+        if self._master_fd is None:
+            return
+        if self._burst_task is not None:
+            self._burst_task.cancel()
+            self._burst_task = None
+        asyncio.get_event_loop().remove_reader(self._master_fd)
+        if self._out:
+            asyncio.get_event_loop().remove_writer(self._master_fd)
+            del self._out[:]
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+        self._master_fd = None
+        self._slave_fd = None
+
+    def _on_readable(self):
+
+        try:
+            data = os.read(self._master_fd, 4096)
+        except (BlockingIOError, OSError):
+            return
+
+        if self.echo:
+            self._write(data)
+
+        errors = self._decoder.errors
+        for addr, cmd_code, _ in self._decoder.feed(data):
+            config = self.slaves.get(addr)
+            if config is None:
+                continue
+            self.stats["requests"] += 1
+            if self._random.random() < config.error_rate:
+                self.stats["dropped"] += 1
+                continue
+            packet = self._make_packet(addr, (cmd_code + 1) & 0xFF, config)
+            delay = config.latency + self._line_time(len(packet))
+            asyncio.get_event_loop().call_later(delay, self._write, packet)
+            self.stats["replies"] += 1
+        self.stats["decode_errors"] += self._decoder.errors - errors
+
+    def _make_packet(self, addr, cmd_code, config):
+
+        payload = bytes(self._random.getrandbits(8) for _ in range(config.reply_size))
+        packet = bytearray(self.protocol.encode_msg(addr, cmd_code, payload))
+        if self._random.random() < config.crc_error_rate:
+            # ~ the crc digits are 0x20 + nibble: flipping bit 0 keeps them in range
+            packet[-2] ^= 0x01
+            self.stats["corrupted"] += 1
+        return bytes(packet)
+
+    def _line_time(self, size):
+
+        # ~ 10 bits per byte: start, 8 data, stop
+        return size * 10.0 / self.baudrate if self.baudrate else 0.0
+
+    def _write(self, data):
+
+        if self._master_fd is None:
+            return
+        if self._out:
+            # ~ behind what is already waiting, so that packets are not interleaved
+            if len(self._out) + len(data) > self.MAX_PENDING_OUT:
+                logging.warning("simulator: pty buffer full, {} bytes dropped".format(len(data)))
+                return
+            self._out += data
+            return
+        try:
+            n = os.write(self._master_fd, data)
+        except BlockingIOError:
+            n = 0
+        if n < len(data):
+            self._out += data[n:]
+            asyncio.get_event_loop().add_writer(self._master_fd, self._on_writable)
+
+    def _on_writable(self):
+
+        try:
+            n = os.write(self._master_fd, self._out)
+        except BlockingIOError:
+            return
+        del self._out[:n]
+        if not self._out:
+            asyncio.get_event_loop().remove_writer(self._master_fd)
+
+    async def _send_bursts(self):
+
+        addresses = sorted(self.slaves)
+        while True:
+            await asyncio.sleep(self.burst_interval)
+            packets = []
+            for _ in range(self.burst_size):
+                addr = self._random.choice(addresses)
+                packets.append(self._make_packet(addr, 0xFF, self.slaves[addr]))
+            self.stats["unsolicited"] += len(packets)
+            self._write(b''.join(packets))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="virtual MAB/MGB slaves on a pseudo-terminal")
+    parser.add_argument('--addr', type=int, action='append', help='simulated slave address (repeatable)')
+    parser.add_argument('--reply-size', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests not answered')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0, help='fraction of replies with a wrong crc')
+    parser.add_argument('--baudrate', type=int, default=None, help='simulate the line time at this baudrate')
+    parser.add_argument('--burst-interval', type=float, default=None, help='seconds between unsolicited bursts')
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--echo', action='store_true', help='echo the received bytes, as some transceivers do')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stdout, level="INFO",
+        format="[%(asctime)s]%(levelname)s %(funcName)s() %(filename)s:%(lineno)d %(message)s")
+
+    simulator = MAB_MGB_slave_simulator(
+        addresses=args.addr or (MAB_MGB_protocol.MAB_ADDR, MAB_MGB_protocol.MGB_ADDR),
+        baudrate=args.baudrate, burst_interval=args.burst_interval, burst_size=args.burst_size,
+        echo=args.echo, seed=args.seed, reply_size=args.reply_size, latency=args.latency,
+        error_rate=args.error_rate, crc_error_rate=args.crc_error_rate)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print(simulator.start(), flush=True)
+
+    async def report():
+        while True:
+            await asyncio.sleep(10)
+            logging.info("stats: {}".format(simulator.stats))
+
+    loop.create_task(report())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
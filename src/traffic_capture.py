@@ -0,0 +1,105 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+""" compact, append-only binary capture files of the bus traffic.
+
+    file header: MAGIC (8 bytes) | version (uint16, little endian)
+    then, for each record: RECORD_HEADER (timestamp, direction, length) | data (length bytes)
+
+    timestamp is in nanoseconds since epoch, direction is traffic_trace.RX or traffic_trace.TX.
+"""
+
+import mmap
+import struct
+
+MAGIC = b'RS485CAP'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sH')
+# ~ timestamp (int64, ns since epoch), direction (uint8), length of data (uint32)
+RECORD_HEADER = struct.Struct('<qBI')
+
+
+class CaptureWriter:
+
+    " appends records to a capture file, through a large write buffer."
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+
+        self.path = path
+        self._file = open(path, 'ab', buffering=buffer_size)  # pylint: disable=consider-using-with
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def record(self, direction, data, timestamp):
+
+        self._file.write(RECORD_HEADER.pack(timestamp, direction, len(data)))
+        self._file.write(data)
+
+    def flush(self):
+
+        self._file.flush()
+
+    def close(self):
+
+        if not self._file.closed:
+            self._file.close()
+
+
+class CaptureReader:
+
+    """ reads a capture file through a memory map: records() yields (timestamp, direction, data)
+        where data is a memoryview on the map (no copy), valid until close(). """
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        if len(self._view) < FILE_HEADER.size:
+            self.close()
+            raise ValueError('not a capture file:{}'.format(path))
+        magic, version = FILE_HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('not a capture file (or unsupported version):{}'.format(path))
+
+    def records(self):
+
+        view = self._view
+        size = len(view)
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        offset = FILE_HEADER.size
+        while offset + header_size <= size:
+            timestamp, direction, length = unpack_from(view, offset)
+            offset += header_size
+            if offset + length > size:
+                # ~ truncated last record (e.g. the capture is still being written)
+                break
+            yield (timestamp, direction, view[offset:offset + length])
+            offset += length
+
+    def close(self):
+
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # ~ the caller still holds views of some records: the map is released with them
+            pass
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
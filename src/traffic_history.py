@@ -0,0 +1,131 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+from array import array
+
+from traffic_trace import TraceRing
+
+# ~ addr and cmd_code of the records that are not frames (e.g. lines of text)
+NO_ADDR = 0xFF
+
+
+class TrafficHistory(TraceRing):
+
+    """ the bounded history of the traffic of a port, for the clients that connect late or scroll back.
+
+        A TraceRing with two more columns, addr and cmd_code (NO_ADDR for lines of text), much larger
+        and not dumped on signal. Records are numbered (seq) in the order they are recorded, from 0;
+        their timestamps never decrease, so that a time can be looked up by bisection.
+
+        Records are also indexed by addr and by cmd_code: each one holds the seq of the previous
+        record with the same addr (and cmd_code), so that query() walks only the matching records.
+    """
+
+    MAX_RECORDS = 100000
+    DATA_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, name='', max_records=MAX_RECORDS, data_size=DATA_SIZE):
+
+        super().__init__(name, max_records, data_size, dump_on_signal=False)
+        self._addrs = array('B', [0]) * max_records
+        self._cmd_codes = array('B', [0]) * max_records
+        self._previous_by_addr = array('q', [-1]) * max_records
+        self._previous_by_cmd_code = array('q', [-1]) * max_records
+        self._last_by_addr = array('q', [-1]) * 256
+        self._last_by_cmd_code = array('q', [-1]) * 256
+
+    def record_frame(self, direction, addr, cmd_code, data, timestamp):
+        " addr and cmd_code out of 0..255 (or not int) are recorded as NO_ADDR: recording never raises on them."
+
+        if not (isinstance(addr, int) and 0 <= addr <= 0xFF):
+            addr = NO_ADDR
+        if not (isinstance(cmd_code, int) and 0 <= cmd_code <= 0xFF):
+            cmd_code = NO_ADDR
+        seq = self._count
+        slot = seq % self.max_records
+        self._addrs[slot] = addr
+        self._cmd_codes[slot] = cmd_code
+        self._previous_by_addr[slot] = self._last_by_addr[addr]
+        self._last_by_addr[addr] = seq
+        self._previous_by_cmd_code[slot] = self._last_by_cmd_code[cmd_code]
+        self._last_by_cmd_code[cmd_code] = seq
+        self.record(direction, data, timestamp)
+
+    def newest(self):
+        " returns the seq the next record will have."
+
+        return self._count
+
+    def find(self, timestamp):
+        " returns the seq of the first record still in the history with timestamp > timestamp."
+
+        lo = self.oldest()
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[mid % self.max_records] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, seq):
+        " returns the record seq as (seq, timestamp, direction, addr, cmd_code, bytes)."
+
+        slot = seq % self.max_records
+        return (seq, self._timestamps[slot], self._directions[slot],
+                self._addrs[slot], self._cmd_codes[slot], self._read(slot))
+
+    def page(self, before=None, limit=100):
+        """ returns up to limit records, oldest first, among those preceding the record before
+        (by default, the newest ones), as (seq, timestamp, direction, addr, cmd_code, bytes). """
+
+        end = self._count if before is None else min(before, self._count)
+        start = max(self.oldest(), end - limit)
+        return [self.get(seq) for seq in range(start, end)]
+
+    def query(self, addr=None, cmd_code=None, start=None, end=None, before=None, limit=100):
+        """ returns up to limit records, oldest first, as page() does, among those with the given addr
+        and cmd_code (None matches any) and timestamp in [start, end] (ns, None for no bound),
+        preceding the record before (by default, the newest ones). """
+
+        hi = self._count if before is None else min(before, self._count)
+        if end is not None:
+            hi = min(hi, self.find(end))
+        lo = self.oldest()
+        if start is not None:
+            lo = max(lo, self.find(start - 1))
+        if addr is None and cmd_code is None:
+            return self.page(hi, min(limit, max(0, hi - lo)))
+
+        seqs = []
+        if hi - lo <= self._count - hi:
+            # ~ the range is shorter than the chain from the newest records down to it: scan it
+            seq = hi - 1
+            while seq >= lo and len(seqs) < limit:
+                if self._matches(seq, addr, cmd_code):
+                    seqs.append(seq)
+                seq -= 1
+        else:
+            if addr is not None:
+                seq, previous = self._last_by_addr[addr], self._previous_by_addr
+            else:
+                seq, previous = self._last_by_cmd_code[cmd_code], self._previous_by_cmd_code
+            while seq >= hi:
+                seq = previous[seq % self.max_records]
+            while seq >= lo and len(seqs) < limit:
+                if self._matches(seq, addr, cmd_code):
+                    seqs.append(seq)
+                seq = previous[seq % self.max_records]
+
+        return [self.get(seq) for seq in reversed(seqs)]
+
+    def _matches(self, seq, addr, cmd_code):
+
+        slot = seq % self.max_records
+        return ((addr is None or self._addrs[slot] == addr) and
+                (cmd_code is None or self._cmd_codes[slot] == cmd_code))
@@ -0,0 +1,151 @@
+# coding: utf-8
+
+# pylint: disable=missing-docstring
+# pylint: disable=logging-format-interpolation
+# pylint: disable=line-too-long
+# pylint: disable=invalid-name
+
+import signal
+import asyncio
+import logging
+import weakref
+from array import array
+from datetime import datetime
+
+RX = 0
+TX = 1
+
+_DIRECTION_NAMES = {RX: 'RX', TX: 'TX'}
+
+_LIVE_RINGS = weakref.WeakSet()
+
+
+class TraceRing:
+
+    """ a fixed-size ring buffer of the traffic (raw bytes, direction and timestamp) of a port.
+
+        Everything is preallocated: record() copies the bytes in a circular data area and fills
+        one of max_records slots, without formatting nor allocating. When the data area or the
+        slots are full, the oldest records are overwritten. Formatting only happens in dump().
+    """
+
+    MAX_RECORDS = 4096
+    DATA_SIZE = 256 * 1024
+
+    def __init__(self, name='', max_records=MAX_RECORDS, data_size=DATA_SIZE, dump_on_signal=True):
+
+        self.name = name
+        self.max_records = max_records
+        self.data_size = data_size
+
+        self._data = bytearray(data_size)
+        self._data_view = memoryview(self._data)
+        self._timestamps = array('q', [0]) * max_records
+        self._directions = array('B', [0]) * max_records
+        self._lengths = array('L', [0]) * max_records
+        # ~ position of the data of each record in the (ever growing) stream of recorded bytes
+        self._positions = array('q', [0]) * max_records
+
+        self._count = 0
+        self._written = 0
+
+        if dump_on_signal:
+            _LIVE_RINGS.add(self)
+
+    def record(self, direction, data, timestamp):
+        " stores a copy of data; timestamp is in nanoseconds since epoch."
+
+        size = len(data)
+        if size > self.data_size:
+            data = data[:self.data_size]
+            size = self.data_size
+
+        slot = self._count % self.max_records
+        self._timestamps[slot] = timestamp
+        self._directions[slot] = direction
+        self._lengths[slot] = size
+        self._positions[slot] = self._written
+
+        start = self._written % self.data_size
+        end = start + size
+        if end <= self.data_size:
+            self._data_view[start:end] = data
+        else:
+            split = self.data_size - start
+            self._data_view[start:] = data[:split]
+            self._data_view[:end - self.data_size] = data[split:]
+
+        self._written += size
+        self._count += 1
+
+    def clear(self):
+
+        self._count = 0
+        self._written = 0
+
+    def records(self):
+        " returns the records still in the ring, oldest first, as (timestamp, direction, bytes)."
+
+        ret = []
+        for n in range(self.oldest(), self._count):
+            slot = n % self.max_records
+            ret.append((self._timestamps[slot], self._directions[slot], self._read(slot)))
+
+        return ret
+
+    def oldest(self):
+        """ returns the number of the oldest record still in the ring (records are numbered
+        from 0 in the order they are recorded, the newest is number _count - 1). """
+
+        oldest_position = self._written - self.data_size
+        lo = max(0, self._count - self.max_records)
+        hi = self._count
+        # ~ positions grow with the record number: the first one whose data is not overwritten
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._positions[mid % self.max_records] < oldest_position:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _read(self, slot):
+
+        size = self._lengths[slot]
+        start = self._positions[slot] % self.data_size
+        end = start + size
+        if end <= self.data_size:
+            return bytes(self._data_view[start:end])
+        return bytes(self._data_view[start:]) + bytes(self._data_view[:end - self.data_size])
+
+    def dump(self):
+        " returns the records still in the ring, oldest first, formatted as lines of text."
+
+        lines = []
+        for timestamp, direction, data in self.records():
+            lines.append("{}.{:06d} {} {} {}".format(
+                datetime.fromtimestamp(timestamp // 1000000000).strftime("%d/%m/%Y %H:%M:%S"),
+                (timestamp // 1000) % 1000000,
+                _DIRECTION_NAMES.get(direction, direction),
+                data.hex(' '),
+                repr(data)))
+
+        return lines
+
+
+def dump_all(*args):
+    " logs the content of all the live trace rings."
+
+    for ring in list(_LIVE_RINGS):
+        logging.warning("trace of {}: {} records".format(ring.name, ring._count))  # pylint: disable=protected-access
+        for line in ring.dump():
+            logging.warning(line)
+
+
+def install_dump_signal(signum=signal.SIGUSR1, loop=None):
+    """ makes the process dump all the trace rings to the log when it receives signum.
+    The dump runs as a callback of the event loop, not inside the signal handler. """
+
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signum, dump_all)
@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from driver import *                # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from mab_mgb_protocol import *      # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from mab_mgb_master import *       # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from traffic_trace import *        # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from traffic_capture import *      # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from rs485_simulator import *     # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from bus_metrics import *         # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
+from traffic_history import *     # pylint: disable=wrong-import-position,wildcard-import,unused-wildcard-import
@@ -0,0 +1,24 @@
+from context import RateCounter, LatencyHistogram
+import unittest
+
+class TestRateCounter(unittest.TestCase):
+    def test_rates(self):
+        counter = RateCounter(window=5)
+        t0 = 1000 * 1000000000
+        for second in range(8):
+            for _ in range(second + 1):
+                counter.add(1, 10, t0 + second * 1000000000)
+        # ~ the complete seconds 4, 5, 6, 7 of the window: 5 + 6 + 7 + 8 frames
+        assert(counter.rates(t0 + 8 * 1000000000) == (26 / 4, 260 / 4))
+        assert(counter.frames == 36)
+        # ~ nothing in the last seconds
+        assert(counter.rates(t0 + 100 * 1000000000) == (0, 0))
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_buckets(self):
+        histogram = LatencyHistogram(buckets=8)
+        for latency in (0.0000005, 0.000001, 0.000003, 0.000003, 10.0):
+            histogram.add(latency)
+        counts = histogram.as_dict()["counts"]
+        assert(counts == [1, 1, 2, 0, 0, 0, 0, 1])
+        assert(histogram.count == 5)
@@ -0,0 +1,78 @@
+from context import MAB_MGB_protocol, MAB_MGB_frame, MAB_MGB_slave_simulator
+import os
+import time
+import asyncio
+import unittest
+
+import rs485_master
+from bus_workers import WorkerPort
+
+class TestWorkerPort(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        MAB_MGB_frame.unregister_schema(0x11)
+
+    async def test_bus_in_worker_process(self):
+        # ~ registered in the parent, before the worker starts
+        MAB_MGB_frame.register_schema(0x11, [('value', 'I')], 'reply')
+        simulator = MAB_MGB_slave_simulator(reply_size = 4, latency = 0.001)
+        registry = rs485_master.rs485_PortRegistry()
+        device_name = simulator.start()
+        registry.open_buses([{"device_name": device_name, "device_baudrate": 115200, "protocol": "mab_mgb", "worker": True}])
+        port = registry.get_open_ports()[device_name]
+        assert(isinstance(port, WorkerPort))
+
+        signals = []
+        client = rs485_master.rs485_Client(registry)
+        client.set_callback(lambda signal, content, timestamp: signals.append((signal, content)))
+        try:
+            assert(client.connect(device_name = device_name, device_baudrate = 115200, protocol = 'mab_mgb'))
+            for _ in range(500):
+                if port.get_status() == 'connected':
+                    break
+                await asyncio.sleep(0.01)
+            reply = await client.transact(addr = MAB_MGB_protocol.MAB_ADDR, cmd_code = 0x10)
+            assert((reply['addr'], reply['cmd_code']) == (MAB_MGB_protocol.MAB_ADDR, 0x11))
+            assert(reply['fields'] == {'value': int.from_bytes(bytes.fromhex(reply['payload'])[:4], 'little')})
+            assert(('recv_frame', reply) in signals)
+            assert((await port.get_metrics())['rx']['frames'] == 1)
+
+            # ~ the bus stays open without clients
+            client.disconnect()
+            assert(port.get_status() == 'connected')
+        finally:
+            port.disconnect()
+            for _ in range(200):
+                if port.get_status() == 'disconnected':
+                    break
+                await asyncio.sleep(0.01)
+            simulator.stop()
+        assert(port.get_status() == 'disconnected')
+
+    async def test_close_does_not_block(self):
+        simulator = MAB_MGB_slave_simulator()
+        device_name = simulator.start()
+        port = WorkerPort()
+        try:
+            port.connect(device_name = device_name, device_baudrate = 115200, protocol = 'mab_mgb')
+            for _ in range(500):
+                if port.get_status() == 'connected':
+                    break
+                await asyncio.sleep(0.01)
+            pid = port._process.pid
+            t0 = time.monotonic()
+            port._close()
+            # ~ terminated, not waited for
+            assert(time.monotonic() - t0 < 0.05)
+            assert(port.get_status() == 'disconnected')
+            # ~ reaped from the loop, once it has exited: not even a zombie is left
+            for _ in range(200):
+                if not os.path.exists('/proc/{}'.format(pid)):
+                    break
+                await asyncio.sleep(0.01)
+            assert(not os.path.exists('/proc/{}'.format(pid)))
+        finally:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-from context import FileDriver
+from context import FileDriver, LineBuffer, PriorityWriteQueue, coalesce, PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_BULK
 import asyncio
 import os
 import unittest
@@ -45,8 +45,70 @@ class TestFileDriver(unittest.IsolatedAsyncioTestCase):
         
         assert(len(reads) == 1)
         assert(reads[0] == 'test')
+
+    async def test_many_writes(self):
+        reads = []
+        timestamps = []
+        def observe_read(ev):
+            if ev.event == FileDriver.Event.PACKET_RECV:
+                reads.append(ev.attachment['text'])
+                timestamps.append(ev.attachment['timestamp'])
+
+        endpoint_A = FileDriver()
+        endpoint_B = FileDriver()
+        endpoint_B.subscribe(observe_read)
+
+        endpoint_A.connect(port_rx = self.fifo_in, port_tx = self.fifo_out, flush_deadline = 0.01)
+        endpoint_B.connect(port_rx = self.fifo_out, port_tx = self.fifo_in)
+
+        for i in range(100):
+            endpoint_A.write("line {}".format(i))
+        await asyncio.sleep(0.5)
+        endpoint_A.write("last")
+        await asyncio.sleep(0.5)
+
+        assert(reads == ["line {}".format(i) for i in range(100)] + ["last"])
+        assert(timestamps == sorted(timestamps))
+        assert(timestamps[-1] - timestamps[0] >= 0.4e9)
  
-           
+
+class TestLineBuffer(unittest.TestCase):
+    def test_split_chunks(self):
+        line_buffer = LineBuffer()
+        assert(line_buffer.feed(b'one\ntw') == [b'one'])
+        assert(line_buffer.feed(b'o') == [])
+        assert(line_buffer.feed(b'\nthree\nfour\n') == [b'two', b'three', b'four'])
+
+    def test_max_line_length(self):
+        line_buffer = LineBuffer(max_line_length = 8)
+        assert(line_buffer.feed(b'0123456789') == [])
+        assert(line_buffer.feed(b'0123456789') == [])
+        assert(line_buffer.feed(b'abc\nok\n0123456789\nok\n') == [b'ok', b'ok'])
+        assert(line_buffer.overflows == 2)
+
+
+class TestPriorityWriteQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_priorities_and_limits(self):
+        queue = PriorityWriteQueue(max_size = 6)
+        # ~ bulk fills a third of the queue, normal two thirds, urgent all of it
+        assert([queue.put_nowait(b'b', PRIORITY_BULK) for _ in range(3)] == [True, True, False])
+        assert([queue.put_nowait(b'n', PRIORITY_NORMAL) for _ in range(3)] == [True, True, False])
+        assert([queue.put_nowait(b'u', PRIORITY_URGENT) for _ in range(3)] == [True, True, False])
+        assert(queue.rejected == 3)
+        assert(queue.depths() == [2, 2, 2])
+        assert(await coalesce(queue) == b'uunnbb')
+
+    async def test_put_waits_for_room(self):
+        queue = PriorityWriteQueue(max_size = 3)
+        assert(queue.put_nowait(b'1', PRIORITY_BULK))
+        put = asyncio.ensure_future(queue.put(b'2', PRIORITY_BULK))
+        await asyncio.sleep(0.01)
+        assert(not put.done())
+        assert(await queue.get() == b'1')
+        assert(await put)
+        assert(await queue.get() == b'2')
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     unittest.main()
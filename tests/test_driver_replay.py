@@ -0,0 +1,59 @@
+from context import ReplayDriver, CaptureWriter, CaptureReader, RX, TX
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+class TestReplayDriver(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.capture_file = tempfile.mkstemp(suffix = '.cap')
+        os.close(fd)
+        os.remove(self.capture_file)
+        capture = CaptureWriter(self.capture_file)
+        self.t0 = t0 = time.time_ns()
+        for i in range(10):
+            capture.record(RX, "line {}".format(i).encode(), t0 + i * 10000000)
+            capture.record(TX, b'\x02\x03', t0 + i * 10000000 + 1000)
+        capture.close()
+
+    def tearDown(self):
+        os.remove(self.capture_file)
+
+    def test_capture_reader(self):
+        with CaptureReader(self.capture_file) as reader:
+            records = [(direction, bytes(data)) for _, direction, data in reader.records()]
+        assert(len(records) == 20)
+        assert(records[0] == (RX, b'line 0'))
+        assert(records[1] == (TX, b'\x02\x03'))
+
+    async def replay(self, **params):
+        events = []
+        def observe(ev):
+            if ev.event == ReplayDriver.Event.PACKET_RECV:
+                events.append(ev)
+
+        driver = ReplayDriver()
+        driver.subscribe(observe)
+        t0 = time.monotonic()
+        driver.connect(capture_file = self.capture_file, **params)
+        while driver.state == ReplayDriver.State.CONNECTED:
+            await asyncio.sleep(0.01)
+        return (events, time.monotonic() - t0)
+
+    async def test_replay_as_fast_as_possible(self):
+        events, _ = await self.replay(speed = 0)
+        assert([ev.text for ev in events] == ["line {}".format(i) for i in range(10)])
+        assert([ev.timestamp - self.t0 for ev in events] == [i * 10000000 for i in range(10)])
+
+    async def test_replay_real_time(self):
+        events, elapsed = await self.replay(speed = 1, directions = (RX, TX))
+        assert([ev.direction for ev in events] == [RX, TX] * 10)
+        assert([ev.data for ev in events[1::2]] == [b'\x02\x03'] * 10)
+        assert([ev.timestamp - self.t0 for ev in events] == [i * 10000000 + j * 1000 for i in range(10) for j in (0, 1)])
+        # ~ only a lower bound: a loaded machine may replay later, never earlier
+        assert(elapsed >= 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
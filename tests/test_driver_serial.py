@@ -0,0 +1,93 @@
+from context import SerialDriver, MAB_MGB_protocol, MAB_MGB_slave_simulator
+import asyncio
+import os
+import pty
+import tty
+import termios
+import unittest
+
+class TestSerialDriver(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.master_fd)
+        self.device_name = os.ttyname(self.slave_fd)
+        self.events = []
+        self.driver = SerialDriver()
+        self.driver.subscribe(self.events.append, event = SerialDriver.Event.PACKET_RECV)
+
+    def tearDown(self):
+        self.driver.disconnect()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    async def test_lines(self):
+        self.driver.connect(device_name = self.device_name)
+        os.write(self.master_fd, b'one\ntw')
+        await asyncio.sleep(0.01)
+        os.write(self.master_fd, b'o\n')
+        self.driver.write("three")
+        await asyncio.sleep(0.05)
+        assert([ev.text for ev in self.events] == ['one', 'two'])
+        assert(self.events[0].timestamp <= self.events[1].timestamp)
+        assert(os.read(self.master_fd, 100) == b'three\n')
+
+    async def test_raw_from_cooked(self):
+        # ~ a tty left translating CR and NL, dropping CR and marking parity errors
+        attrs = termios.tcgetattr(self.slave_fd)
+        attrs[0] |= termios.IGNCR | termios.INLCR | termios.PARMRK | termios.IXOFF
+        termios.tcsetattr(self.slave_fd, termios.TCSANOW, attrs)
+        self.driver.connect(device_name = self.device_name, protocol = 'gap', frame_gap = 0.01)
+        os.write(self.master_fd, b'\x02\x0d\x0a\xff\x11\x13\x03')
+        await asyncio.sleep(0.05)
+        assert([ev.data for ev in self.events] == [b'\x02\x0d\x0a\xff\x11\x13\x03'])
+
+    async def test_frame_gap(self):
+        self.driver.connect(device_name = self.device_name, protocol = 'gap', frame_gap = 0.01)
+        os.write(self.master_fd, b'\x01\x02')
+        await asyncio.sleep(0.002)
+        os.write(self.master_fd, b'\x03')
+        await asyncio.sleep(0.05)
+        os.write(self.master_fd, b'\x04')
+        await asyncio.sleep(0.05)
+        assert([ev.data for ev in self.events] == [b'\x01\x02\x03', b'\x04'])
+
+    async def test_mab_mgb(self):
+        protocol = MAB_MGB_protocol()
+        self.driver.connect(device_name = self.device_name, protocol = 'mab_mgb', frame_gap = 0.01)
+        packet = protocol.encode_msg(protocol.MAB_ADDR, 0x10, b'\x02\x03\x1b')
+        # ~ a packet cut short by an idle line is dropped, the next one is decoded
+        os.write(self.master_fd, packet[:5])
+        await asyncio.sleep(0.05)
+        os.write(self.master_fd, packet[5:] + packet)
+        await asyncio.sleep(0.05)
+        assert([ev.frame for ev in self.events] == [(protocol.MAB_ADDR, 0x10, b'\x02\x03\x1b')])
+        assert(self.driver.decode_errors == 1)
+    async def test_mab_mgb_split_across_reads(self):
+        protocol = MAB_MGB_protocol()
+        self.driver.connect(device_name = self.device_name, protocol = 'mab_mgb', frame_gap = 0.02)
+        packet = protocol.encode_msg(protocol.MGB_ADDR, 0x11, b'\x01\x02\x03')
+        # ~ completed before the gap: not a decode error
+        os.write(self.master_fd, packet[:6])
+        await asyncio.sleep(0.005)
+        os.write(self.master_fd, packet[6:])
+        await asyncio.sleep(0.06)
+        assert([ev.frame for ev in self.events] == [(protocol.MGB_ADDR, 0x11, b'\x01\x02\x03')])
+        assert(self.driver.decode_errors == 0)
+
+
+class TestSerialDriverSimulator(unittest.IsolatedAsyncioTestCase):
+    async def test_transaction(self):
+        simulator = MAB_MGB_slave_simulator(reply_size = 8, latency = 0.001)
+        driver = SerialDriver()
+        replies = []
+        driver.subscribe(replies.append, event = SerialDriver.Event.PACKET_RECV)
+        try:
+            driver.connect(device_name = simulator.start(), protocol = 'mab_mgb')
+            assert(driver.write(simulator.protocol.encode_msg(MAB_MGB_protocol.MGB_ADDR, 0x20, b'')))
+            await asyncio.sleep(0.05)
+        finally:
+            driver.disconnect()
+            simulator.stop()
+        assert(len(replies) == 1)
+        addr, cmd_code, payload = replies[0].frame
+        assert((addr, cmd_code, len(payload)) == (MAB_MGB_protocol.MGB_ADDR, 0x21, 8))
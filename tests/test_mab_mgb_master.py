@@ -0,0 +1,102 @@
+from context import MAB_MGB_protocol, MAB_MGB_master
+import asyncio
+import unittest
+
+class FakeBus:
+    """ loops the packets written by the master back to it (as the echo of
+    a rs485 transceiver) and answers as the slaves in replies. """
+    def __init__(self, replies):
+        self.protocol = MAB_MGB_protocol()
+        self.replies = replies
+        self.master = MAB_MGB_master(self.write)
+
+    def write(self, packet_bytes, priority):
+        loop = asyncio.get_running_loop()
+        loop.call_soon(self.master.feed, packet_bytes)
+        addr, cmd_code, payload_bytes = self.protocol.decode_msg(packet_bytes)
+        reply = self.replies.get(addr)
+        if reply is not None:
+            loop.call_later(0.001, self.master.feed, self.protocol.encode_msg(addr, cmd_code + 1, reply))
+
+class TestMaster(unittest.IsolatedAsyncioTestCase):
+    async def test_transact(self):
+        bus = FakeBus({MAB_MGB_protocol.MAB_ADDR: b'\x01\x02'})
+        reply = await bus.master.transact(MAB_MGB_protocol.MAB_ADDR, 0x10, b'\x03')
+        assert(reply == (MAB_MGB_protocol.MAB_ADDR, 0x11, b'\x01\x02'))
+
+    async def test_timeout_and_retries(self):
+        bus = FakeBus({})
+        with self.assertRaises(asyncio.TimeoutError):
+            await bus.master.transact(MAB_MGB_protocol.MGB_ADDR, 0x10, timeout=0.01, retries=2)
+        stats = bus.master.get_stats()["addresses"][MAB_MGB_protocol.MGB_ADDR]
+        assert(stats["requests"] == 3)
+        assert(stats["timeouts"] == 3)
+        assert(stats["retries"] == 2)
+
+    async def test_poll_cycle(self):
+        bus = FakeBus({MAB_MGB_protocol.MAB_ADDR: b'\x00', 5: b'\x05'})
+        replies = []
+        for addr in (MAB_MGB_protocol.MAB_ADDR, MAB_MGB_protocol.MGB_ADDR, 5):
+            bus.master.add_poll(addr, 0x20, timeout=0.01, callback=replies.append)
+        for _ in range(4):
+            await bus.master.poll_cycle()
+        assert(len(replies) == 8)
+        # ~ the silent slave is polled on cycles 1, 2 and then skipped for 1 cycle
+        assert(bus.master.get_stats()["addresses"][MAB_MGB_protocol.MGB_ADDR]["requests"] == 3)
+
+        bus.master.start_polling()
+        await asyncio.sleep(0.1)
+        bus.master.stop_polling()
+        assert(bus.master.get_stats()["cycles"] > 0)
+
+    async def test_reply_from_other_addr(self):
+        bus = FakeBus({})
+        protocol = bus.protocol
+        loop = asyncio.get_running_loop()
+        others = []
+        bus.master.on_frame = lambda frame, timestamp: others.append(frame)
+        # ~ a late reply of another slave, then the reply with the wrong cmd_code, then the right one
+        loop.call_later(0.002, bus.master.feed, protocol.encode_msg(5, 0x21, b'\x05'))
+        loop.call_later(0.004, bus.master.feed, protocol.encode_msg(protocol.MAB_ADDR, 0x30, b'\x06'))
+        loop.call_later(0.006, bus.master.feed, protocol.encode_msg(protocol.MAB_ADDR, 0x11, b'\x01'))
+        reply = await bus.master.transact(protocol.MAB_ADDR, 0x10, timeout=0.1, reply_cmd_code=0x11)
+        assert(reply == (protocol.MAB_ADDR, 0x11, b'\x01'))
+        assert(others[:2] == [(5, 0x21, b'\x05'), (protocol.MAB_ADDR, 0x30, b'\x06')])
+
+    async def test_reply_addr(self):
+        bus = FakeBus({})
+        protocol = bus.protocol
+        loop = asyncio.get_running_loop()
+        # ~ as in the example of MAB_MGB_protocol: a request to 200 answered from 201
+        loop.call_later(0.002, bus.master.feed, protocol.encode_msg(protocol.MGB_ADDR, 0x65, b'\x01'))
+        reply = await bus.master.transact(protocol.MAB_ADDR, 0x64, timeout=0.1, reply_addr=protocol.MGB_ADDR)
+        assert(reply == (protocol.MGB_ADDR, 0x65, b'\x01'))
+
+        replies = []
+        bus.master.add_poll(protocol.MAB_ADDR, 0x64, timeout=0.1, reply_addr=protocol.MGB_ADDR, callback=replies.append)
+        loop.call_later(0.002, bus.master.feed, protocol.encode_msg(protocol.MGB_ADDR, 0x65, b'\x02'))
+        await bus.master.poll_cycle()
+        assert(replies == [(protocol.MGB_ADDR, 0x65, b'\x02')])
+
+    async def test_reply_equal_to_request(self):
+        bus = FakeBus({})
+        protocol = bus.protocol
+        loop = asyncio.get_running_loop()
+        # ~ FakeBus loops the request back: only that first equal frame is the echo
+        loop.call_later(0.002, bus.master.feed, protocol.encode_msg(protocol.MAB_ADDR, 0x10, b'\x03'))
+        reply = await bus.master.transact(protocol.MAB_ADDR, 0x10, b'\x03', timeout=0.1)
+        assert(reply == (protocol.MAB_ADDR, 0x10, b'\x03'))
+
+    async def test_failures_capped(self):
+        bus = FakeBus({})
+        bus.master.add_poll(MAB_MGB_protocol.MGB_ADDR, 0x20, timeout=0.001)
+        entry = bus.master._polls[0]
+        for _ in range(200):
+            entry.skip_cycles = 0
+            await bus.master.poll_cycle()
+        assert(entry.failures <= 8)
+        assert(entry.skip_cycles == bus.master.MAX_SKIP_CYCLES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+from context import MAB_MGB_protocol, MAB_MGB_stream_decoder, MAB_MGB_crc16, MAB_MGB_frame, MAB_MGB_length_error
+from context import MAB_MGB_decode_error, DECODE_ERROR_LENGTH
+import importlib.util
+import pickle
+import random
+import unittest
+
+class TestStreamDecoder(unittest.TestCase):
+    # ~ examples from the MAB_MGB_protocol docstring
+    packet_a = bytes([0x02,0xE8,0x29,0x64,0x2F,0x27,0x29,0x2F,0x03])
+    packet_b = bytes([0x02,0xE9,0x57,0xC8,0x07,0x01,0xFA,0xFB,0x01,0x1B,0x32,0x1B,0x33,0x04,0x05,0x06,0xFA,
+                0xFB,0xFC,0xFD,0x01,0x01,0x01,0x01,0x00,0xFA,0xFB,0xFC,0xFD,0x05,0x04,0x1B,0x33,
+                0x1B,0x32,0x00,0x00,0x21,0x53,0x05,0x06,0x01,0xFA,0xFB,0xFC,0xFD,0xFA,0xFB,0xFC,
+                0xFD,0x26,0x25,0x2D,0x29,0x03])
+
+    def setUp(self):
+        self.protocol = MAB_MGB_protocol()
+        self.decoder = MAB_MGB_stream_decoder(self.protocol)
+
+    def test_many_frames_in_one_chunk(self):
+        frames = self.decoder.feed(self.packet_a + self.packet_b + self.packet_a)
+        assert(frames == [
+            self.protocol.decode_msg(self.packet_a),
+            self.protocol.decode_msg(self.packet_b),
+            self.protocol.decode_msg(self.packet_a)])
+        assert(self.decoder.errors == 0)
+
+    def test_byte_by_byte(self):
+        frames = []
+        for b in self.packet_b + self.packet_a:
+            frames += self.decoder.feed(bytes([b]))
+        assert(frames == [self.protocol.decode_msg(self.packet_b), self.protocol.decode_msg(self.packet_a)])
+
+    def test_resync_after_garbage_and_bad_crc(self):
+        bad_crc = bytearray(self.packet_a)
+        bad_crc[-2] ^= 0x01
+        truncated = self.packet_b[:20]
+        stream = b'\xff\x00garbage' + bytes(bad_crc) + truncated + self.packet_a + b'\x41\x42'
+        frames = self.decoder.feed(stream[:30]) + self.decoder.feed(stream[30:])
+        assert(frames == [self.protocol.decode_msg(self.packet_a)])
+        assert(self.decoder.errors == 2)
+        assert(list(self.decoder.error_counts) == [1, 0, 1, 0])
+
+    def test_encode_decode_roundtrip(self):
+        packet = self.protocol.encode_msg(self.protocol.MGB_ADDR, 0x12, bytes(range(200)))
+        assert(self.decoder.feed(packet) == [(self.protocol.MGB_ADDR, 0x12, bytes(range(200)))])
+
+
+class TestStuffing(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = MAB_MGB_protocol()
+
+    def test_stuff_unstuff(self):
+        payload = bytes([0x01, 0x02, 0x1B, 0x03, 0x30, 0x1B, 0x32, 0xFF])
+        stuffed = self.protocol._stuff_buffer(payload)
+        assert(stuffed == bytes([0x01, 0x1B, 0x32, 0x1B, 0x30, 0x1B, 0x33, 0x30, 0x1B, 0x30, 0x32, 0xFF]))
+        assert(self.protocol._unstuff_buffer(stuffed) == payload)
+
+    def test_illegal_sequence(self):
+        for stuffed in (b'\x1b', b'\x01\x1b\x41', b'\x1b\x1b\x30'):
+            with self.assertRaises(ValueError):
+                self.protocol._unstuff_buffer(stuffed)
+
+    def test_decode_msg_into(self):
+        payload = bytes([0x02, 0x03, 0x1B]) + bytes(range(0x20, 0x80))
+        packet = self.protocol.encode_msg(self.protocol.MAB_ADDR, 0x1B, payload)
+        out = bytearray(256)
+        addr, cmd_code, n = self.protocol.decode_msg_into(packet, out)
+        assert((addr, cmd_code, bytes(out[:n])) == (self.protocol.MAB_ADDR, 0x1B, payload))
+
+    def test_unstuff_into_illegal_sequence(self):
+        packet = bytearray(self.protocol.encode_msg(self.protocol.MAB_ADDR, 0x01, b'\x1b\x1b'))
+        # ~ ESC ZERO ESC ZERO -> ESC ESC ZERO ZERO
+        packet[4:8] = b'\x1b\x1b\x30\x30'
+        with self.assertRaises(ValueError):
+            self.protocol._unstuff_into(packet, 4, 8, bytearray(8))
+
+
+class TestFrame(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = MAB_MGB_protocol()
+        MAB_MGB_frame.register_schema(0x65, [('status', 'B'), ('temperature', 'h'), ('serial', '4s')], 'status')
+
+    def tearDown(self):
+        MAB_MGB_frame.unregister_schema(0x65)
+
+    def test_fields(self):
+        payload = bytes([0x02, 0x38, 0xFF]) + b'\x02\x03AB' + b'trailing'
+        frame = self.protocol.decode_msg(self.protocol.encode_msg(self.protocol.MGB_ADDR, 0x65, payload))
+        addr, cmd_code, payload_bytes = frame
+        assert((addr, cmd_code, payload_bytes) == (self.protocol.MGB_ADDR, 0x65, payload))
+        assert(frame == (self.protocol.MGB_ADDR, 0x65, payload) and frame[2] == payload)
+        assert(frame.fields == {'status': 2, 'temperature': -200, 'serial': b'\x02\x03AB'})
+        assert(frame.temperature == -200)
+        with self.assertRaises(AttributeError):
+            frame.humidity
+        assert(pickle.loads(pickle.dumps(frame)) == frame)
+
+    def test_no_schema_and_short_payload(self):
+        frame = MAB_MGB_frame(self.protocol.MAB_ADDR, 0x10, b'\x01')
+        assert(frame.schema is None and frame.fields == {})
+        frame = MAB_MGB_frame(self.protocol.MAB_ADDR, 0x65, b'\x01')
+        with self.assertRaises(MAB_MGB_length_error):
+            frame.fields
+        with self.assertRaises(ValueError):
+            MAB_MGB_frame.register_schema(0x66, [('pair', 'BB'), ('status', 'B')])
+
+
+@unittest.skipIf(importlib.util.find_spec('numpy') is None, 'needs numpy')
+class TestDecodeBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = MAB_MGB_protocol()
+        MAB_MGB_frame.register_schema(0x65, [('status', 'B'), ('temperature', 'h')])
+
+    def tearDown(self):
+        MAB_MGB_frame.unregister_schema(0x65)
+
+    def test_same_as_decode_msg(self):
+        rnd = random.Random(1)
+        packets = []
+        for i in range(300):
+            payload = bytes(rnd.randrange(256) for _ in range(rnd.choice([2, 3, 8])))
+            packet = bytearray(self.protocol.encode_msg(200 + i % 2, rnd.choice([0x65, 0x10]), payload))
+            if i % 17 == 0:
+                packet[-2] ^= 1
+            packets.append(bytes(packet))
+        stream = b'garbage' + b''.join(packets)
+        packets = self.protocol.split_packets(stream)
+        assert(len(packets) == 300)
+
+        # ~ many chunks per group of packets of the same length
+        self.protocol.BATCH_CHUNK = 16
+        frames, bad = self.protocol.decode_batch(packets, 0x65)
+        expected = []
+        expected_bad = []
+        for i, packet in enumerate(packets):
+            try:
+                frame = self.protocol.decode_msg(packet)
+            except MAB_MGB_decode_error as e:
+                expected_bad.append((i, e.kind))
+                continue
+            if frame.cmd_code == 0x65:
+                if len(frame.payload) < 3:
+                    expected_bad.append((i, DECODE_ERROR_LENGTH))
+                else:
+                    expected.append((i, frame.addr, frame.status, frame.temperature))
+        assert(bad == expected_bad)
+        assert([tuple(row.tolist()) for row in frames] == expected)
+        assert(frames['temperature'].dtype.itemsize == 2)
+
+
+class TestEncode(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = MAB_MGB_protocol()
+        self.messages = [
+            (self.protocol.MAB_ADDR, 0x64, b''),
+            (self.protocol.MGB_ADDR, 0x02, b'\x03\x1b\x00'),
+            (5, 0x10, bytes(range(100))),
+        ]
+
+    def test_encode_many(self):
+        out = bytearray(b'stale content')
+        ret = self.protocol.encode_many(self.messages, out)
+        assert(ret is out)
+        assert(bytes(out) == b''.join(self.protocol.encode_msg(*m) for m in self.messages))
+        assert(MAB_MGB_stream_decoder(self.protocol).feed(out) == self.messages)
+
+    def test_encode_cached(self):
+        packet = self.protocol.encode_cached(self.protocol.MAB_ADDR, 0x64)
+        assert(packet == TestStreamDecoder.packet_a)
+        assert(self.protocol.encode_cached(self.protocol.MAB_ADDR, 0x64) is packet)
+        out = self.protocol.encode_many(self.messages, cached=True)
+        assert(bytes(out) == b''.join(self.protocol.encode_msg(*m) for m in self.messages))
+
+
+class TestCrc16(unittest.TestCase):
+
+    def test_backends_are_bit_exact(self):
+        rnd = random.Random(0)
+        for size in (0, 1, 2, 3, 57, 228):
+            data = bytes(rnd.getrandbits(8) for _ in range(size))
+            values = {name: MAB_MGB_crc16(data, backend=name).value for name in MAB_MGB_crc16.backends}
+            assert(len(set(values.values())) == 1)
+
+    def test_incremental(self):
+        data = bytes(range(256))
+        crc = MAB_MGB_crc16()
+        for i in range(0, len(data), 7):
+            crc.update(data[i:i + 7])
+        assert(crc.value == MAB_MGB_crc16(data, backend='table').value)
+
+    def test_check_crc_many(self):
+        protocol = MAB_MGB_protocol()
+        good = protocol.encode_msg(protocol.MAB_ADDR, 0x10, b'\x01\x02')
+        bad = bytearray(good)
+        bad[5] ^= 0xFF
+        assert(protocol.check_crc_many([good, bytes(bad), b'\x02\x03', good]) == [True, False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+from context import Observable, AbstractDriver
+import asyncio
+import unittest
+
+PACKET_RECV = AbstractDriver.Event.PACKET_RECV
+STATE_CHANGED = AbstractDriver.Event.STATE_CHANGED
+
+class TestObservable(unittest.IsolatedAsyncioTestCase):
+    async def test_typed_subscription(self):
+        observable = Observable()
+        received = []
+        everything = []
+        observable.subscribe(received.append, event = PACKET_RECV)
+        observable.subscribe(everything.append)
+        observable.fire(PACKET_RECV, text = 'a', timestamp = 1)
+        observable.fire(STATE_CHANGED, state = None)
+        assert([ev.text for ev in received] == ['a'])
+        assert(received[0].attachment == {'text': 'a', 'timestamp': 1})
+        assert([ev.event for ev in everything] == [PACKET_RECV, STATE_CHANGED])
+
+        observable.unsubscribe(received.append, event = PACKET_RECV)
+        observable.fire(PACKET_RECV, text = 'b', timestamp = 2)
+        assert(len(received) == 1)
+
+    async def test_asynchronous_subscriber(self):
+        observable = Observable()
+        received = []
+        async def slow(ev):
+            await asyncio.sleep(0.01)
+            received.append(ev.text)
+        subscriber = observable.subscribe(slow, event = PACKET_RECV, asynchronous = True, max_queued = 3)
+        for i in range(5):
+            observable.fire(PACKET_RECV, text = str(i))
+        # ~ nothing delivered yet: firing does not wait for the subscriber
+        assert(received == [])
+        await asyncio.sleep(0.1)
+        assert(received == ['2', '3', '4'])
+        assert(subscriber.dropped == 2)
+        observable.unsubscribe(slow, event = PACKET_RECV)
@@ -0,0 +1,78 @@
+from context import MAB_MGB_slave_simulator
+import asyncio
+import unittest
+
+import rs485_master
+
+class TestPortRegistry(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.simulator = MAB_MGB_slave_simulator()
+        self.device_name = self.simulator.start()
+        self.registry = rs485_master.rs485_PortRegistry()
+
+    async def asyncTearDown(self):
+        for port in self.registry.get_open_ports().values():
+            port.disconnect()
+        await asyncio.sleep(0.01)
+        self.simulator.stop()
+
+    async def test_shared_and_released(self):
+        a = []
+        b = []
+        params = {"device_name": self.device_name, "device_baudrate": 115200}
+        port = self.registry.acquire(lambda *args: a.append(args), **params)
+        await asyncio.sleep(0.02)
+        assert(port.get_status() == 'connected')
+        assert(self.registry.acquire(lambda *args: b.append(args), **params) is port)
+        assert(self.registry.get_reference_count(self.device_name) == 2)
+        # ~ the second client is told the current status at once
+        assert(b[0][:2] == ('status', 'connected'))
+
+        with self.assertRaises(ValueError):
+            self.registry.acquire(lambda *args: None, device_name = self.device_name, device_baudrate = 9600)
+        assert(self.registry.get_reference_count(self.device_name) == 2)
+
+        self.registry.release(self.device_name, port._callbacks[1], port)
+        assert(self.registry.get_reference_count(self.device_name) == 1)
+        assert(port.get_status() == 'connected')
+        self.registry.release(self.device_name, port._callbacks[0], port)
+        await asyncio.sleep(0.02)
+        assert(self.registry.get_open_ports() == {})
+        assert(port.get_status() == 'disconnected')
+
+    async def test_open_failure_is_forgotten(self):
+        client = rs485_master.rs485_Client(self.registry)
+        statuses = []
+        client.set_callback(lambda signal, content, timestamp: statuses.append(content) if signal == 'status' else None)
+        assert(client.connect(device_name = '/dev/rs485-no-such-device', device_baudrate = 115200))
+        await asyncio.sleep(0.02)
+        assert(statuses[-1] == 'disconnected')
+        assert(self.registry.get_open_ports() == {})
+        # ~ a new connect opens the port again, instead of sharing the dead one
+        assert(client.connect(device_name = self.device_name, device_baudrate = 115200))
+        await asyncio.sleep(0.02)
+        assert(statuses[-1] == 'connected')
+        assert(self.registry.get_reference_count(self.device_name) == 1)
+        assert(client.disconnect())
+        await asyncio.sleep(0.02)
+        assert(self.registry.get_open_ports() == {})
+
+    async def test_connect_to_open_bus(self):
+        self.registry.open_buses([{"device_name": self.device_name, "device_baudrate": 115200, "protocol": "mab_mgb"}])
+        await asyncio.sleep(0.02)
+        port = self.registry.get_open_ports()[self.device_name]
+        client = rs485_master.rs485_Client(self.registry)
+        # ~ as the page does: no protocol, the baudrate as a string
+        assert(client.connect(device_name = self.device_name, device_baudrate = "115200"))
+        assert(self.registry.get_reference_count(self.device_name) == 2)
+        assert(client.disconnect())
+
+        for params in ({"device_baudrate": "9600"}, {"device_baudrate": 115200, "protocol": "text"}):
+            with self.assertRaises(ValueError):
+                self.registry.acquire(lambda *args: None, device_name = self.device_name, **params)
+        assert(self.registry.get_reference_count(self.device_name) == 1)
+        assert(port.get_status() == 'connected')
+
+
+if __name__ == '__main__':
+    unittest.main()
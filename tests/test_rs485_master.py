@@ -0,0 +1,229 @@
+from context import PRIORITY_BULK
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import tornado.web
+import tornado.httpserver
+import tornado.testing
+import tornado.websocket
+
+import rs485_master
+
+class TestWriteQueueFlowControl(unittest.IsolatedAsyncioTestCase):
+    async def test_bulk_flood_pauses(self):
+        master = rs485_master.rs485_Master()
+        signals = []
+        master.set_callback(lambda signal, content, timestamp: signals.append(content) if signal == 'write_queue' else None)
+        limit = master._write_queue.limit(PRIORITY_BULK)
+        accepted = sum(1 for _ in range(master._write_queue.max_size) if master._queue_write(b'x', PRIORITY_BULK))
+        assert(accepted == limit)
+        assert([s["paused"] for s in signals] == [True])
+        assert(signals[0]["depth"] < limit)
+
+        while not master._write_queue.empty():
+            master._write_queue.get_nowait()
+            master._on_dequeued()
+        assert([s["paused"] for s in signals] == [True, False])
+
+
+def _signal(name, content):
+    return {"signal": name, "content": content, "timestamp": 0}
+
+class TestSignalQueue(unittest.IsolatedAsyncioTestCase):
+    def _queue(self, **kwargs):
+        self.sent = []
+        self.closed = 0
+        def send(message):
+            self.sent.append(message)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(None)
+            return future
+        def close():
+            self.closed += 1
+        return rs485_master.SignalQueue(send, close, **kwargs)
+
+    async def test_single_signal_sent_as_is(self):
+        queue = self._queue()
+        queue.put(_signal('recv_frame', 1))
+        await asyncio.sleep(0)
+        assert(self.sent == [_signal('recv_frame', 1)])
+
+    async def test_batching_window(self):
+        queue = self._queue(window = 0.05)
+        for i in range(3):
+            queue.put(_signal('recv_frame', i))
+        await asyncio.sleep(0.01)
+        assert(self.sent == [])
+        await asyncio.sleep(0.1)
+        assert(self.sent == [{"signal": "batch", "content": [_signal('recv_frame', i) for i in range(3)], "dropped": 0}])
+        assert(queue.messages_sent == 1)
+
+    async def test_drop_oldest(self):
+        queue = self._queue(max_queued = 3, policy = 'drop_oldest')
+        queue.put(_signal('status', 'connected'))
+        for i in range(5):
+            queue.put(_signal('recv_frame', i))
+        await asyncio.sleep(0)
+        assert(self.sent == [{"signal": "batch", "dropped": 3, "content": [
+            _signal('status', 'connected'), _signal('recv_frame', 3), _signal('recv_frame', 4)]}])
+        assert(queue.dropped_total == 3)
+
+    async def test_control_signals_never_dropped(self):
+        queue = self._queue(max_queued = 2, policy = 'drop_oldest')
+        queue.put(_signal('status', 'connected'))
+        queue.put(_signal('write_queue', {"paused": True}))
+        queue.put(_signal('recv_frame', 0))
+        queue.put(_signal('status', 'disconnected'))
+        await asyncio.sleep(0)
+        assert(self.sent == [{"signal": "batch", "dropped": 1, "content": [
+            _signal('status', 'connected'), _signal('write_queue', {"paused": True}), _signal('status', 'disconnected')]}])
+
+    async def test_sample(self):
+        queue = self._queue(max_queued = 2, policy = 'sample', sample_every = 3)
+        for i in range(8):
+            queue.put(_signal('recv_frame', i))
+        await asyncio.sleep(0)
+        # ~ of the 6 signals over the limit, the 3rd and the 6th are kept
+        assert(self.sent == [{"signal": "batch", "dropped": 6, "content": [_signal('recv_frame', 4), _signal('recv_frame', 7)]}])
+
+    async def test_disconnect(self):
+        queue = self._queue(max_queued = 2, policy = 'disconnect')
+        for i in range(3):
+            queue.put(_signal('recv_frame', i))
+        assert(self.closed == 1)
+        assert(len(queue) == 0)
+        await asyncio.sleep(0)
+        assert(self.sent == [])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            rs485_master.SignalQueue(None, None, policy = 'drop_newest')
+
+
+class TestBinaryRecords(unittest.IsolatedAsyncioTestCase):
+    def _unpack(self, message):
+        records = []
+        offset = 0
+        while offset < len(message):
+            timestamp, addr, cmd_code, length = rs485_master.BINARY_RECORD_HEADER.unpack_from(message, offset)
+            offset += rs485_master.BINARY_RECORD_HEADER.size
+            records.append((timestamp, addr, cmd_code, message[offset:offset + length]))
+            offset += length
+        return records
+
+    def test_pack_record(self):
+        pack_record = rs485_master.WebsockHandler.pack_record
+        frame = rs485_master.FrameContent((0x65, 0x11, b'\x01\x02\xff'))
+        assert(dict(frame) == {"addr": 0x65, "cmd_code": 0x11, "payload": "0102ff"})
+        record = pack_record('recv_frame', frame, 1700000000123456789)
+        # ~ packed once, for all the clients
+        assert(pack_record('recv_frame', frame, 1700000000123456789) is record)
+        message = record + pack_record('recv_from_serial', b'line\n', 1700000000123457789)
+        assert(self._unpack(message) == [
+            (1700000000123456, 0x65, 0x11, b'\x01\x02\xff'),
+            (1700000000123457, rs485_master.BINARY_NO_ADDR, rs485_master.BINARY_NO_ADDR, b'line\n')])
+
+    def test_dropped_count(self):
+        pack_record = rs485_master.WebsockHandler.pack_record
+        join_records = rs485_master.WebsockHandler.join_records
+        queue = [pack_record('recv_from_serial', b'a', 1000), pack_record('recv_from_serial', b'b', 2000)]
+        assert(join_records(queue, 0) == b''.join(queue))
+
+        records = self._unpack(join_records(queue, 7))
+        _, addr, cmd_code, data = records[0]
+        assert((addr, cmd_code) == (rs485_master.BINARY_NO_ADDR, rs485_master.BINARY_DROPPED))
+        assert(rs485_master.BINARY_DROPPED_COUNT.unpack(data) == (7, ))
+        assert([record[3] for record in records[1:]] == [b'a', b'b'])
+
+    async def test_select_subprotocol(self):
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(tornado.web.Application(rs485_master.Application.url_map))
+        server.add_sockets([sock])
+        url = "ws://127.0.0.1:{}/websocket".format(port)
+        try:
+            for subprotocols, selected in (([rs485_master.BINARY_SUBPROTOCOL], rs485_master.BINARY_SUBPROTOCOL), (None, None)):
+                ws = await tornado.websocket.websocket_connect(url, subprotocols = subprotocols)
+                assert(ws.selected_subprotocol == selected)
+                ws.close()
+        finally:
+            server.stop()
+            await asyncio.sleep(0.05)
+
+    async def test_set_delivery_binary(self):
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(tornado.web.Application(rs485_master.Application.url_map))
+        server.add_sockets([sock])
+        url = "ws://127.0.0.1:{}/websocket".format(port)
+        try:
+            ws = await tornado.websocket.websocket_connect(url, subprotocols = [rs485_master.BINARY_SUBPROTOCOL])
+            ws.write_message(json.dumps({"command_name": "set_delivery", "arguments": {"policy": "nope"}}))
+            assert(json.loads(await ws.read_message())["content"] is False)
+            ws.write_message(json.dumps({"command_name": "set_delivery", "arguments": {"max_queued": 2, "window": 0.05}}))
+            assert(json.loads(await ws.read_message())["content"] is True)
+
+            channel = rs485_master.get_application_instance().web_socket_channels[-1]
+            assert((channel.binary_queue.policy, channel.binary_queue.max_queued) == (rs485_master.WS_OVERFLOW_POLICY, 2))
+            # ~ the traffic, as sent back by the port
+            for i in range(5):
+                channel.RS485_instance._send_back('recv_from_serial', str(i).encode(), 1000 * i)
+            records = self._unpack(await ws.read_message())
+            assert([record[1:3] for record in records[:1]] == [(rs485_master.BINARY_NO_ADDR, rs485_master.BINARY_DROPPED)])
+            assert(rs485_master.BINARY_DROPPED_COUNT.unpack(records[0][3]) == (3, ))
+            assert([record[3] for record in records[1:]] == [b'3', b'4'])
+            ws.close()
+        finally:
+            server.stop()
+            await asyncio.sleep(0.05)
+
+
+class TestOptions(unittest.TestCase):
+    def setUp(self):
+        fd, self.config_file = tempfile.mkstemp(suffix = '.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"listen_port": 9000, "profile": "production",
+                       "buses": [{"device_name": "/dev/ttyUSB0", "device_baudrate": 115200}]}, f)
+
+    def tearDown(self):
+        os.remove(self.config_file)
+
+    def test_defaults(self):
+        assert(rs485_master.resolve_options([]) == {
+            "listen_address": rs485_master.LISTEN_ADDRESS, "listen_port": rs485_master.LISTEN_PORT,
+            "profile": rs485_master.DEFAULT_PROFILE, "buses": []})
+
+    def test_config_file(self):
+        options = rs485_master.resolve_options([self.config_file])
+        assert(options["listen_address"] == rs485_master.LISTEN_ADDRESS)
+        assert((options["listen_port"], options["profile"]) == (9000, "production"))
+        assert(options["buses"] == [{"device_name": "/dev/ttyUSB0", "device_baudrate": 115200}])
+
+    def test_command_line_wins(self):
+        options = rs485_master.resolve_options([self.config_file, '--listen-port', '9001', '--profile', 'development'])
+        assert((options["listen_port"], options["profile"]) == (9001, "development"))
+        assert(len(options["buses"]) == 1)
+
+    def test_invalid_profile(self):
+        with open(self.config_file, 'w') as f:
+            json.dump({"profile": "fast"}, f)
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                rs485_master.resolve_options([self.config_file])
+            with self.assertRaises(SystemExit):
+                rs485_master.resolve_options(['--profile', 'fast'])
+
+    def test_production_settings(self):
+        with mock.patch('tornado.web.Application') as application:
+            rs485_master.Application().start_tornado(listen_port = 0, profile = 'production')
+        settings = application.call_args.kwargs
+        assert(settings["debug"] is False and settings["autoreload"] is False)
+        assert(settings["compiled_template_cache"] is True and settings["static_hash_cache"] is True)
+        assert(settings["template_path"] == rs485_master.APPLICATION_OPTIONS["template_path"])
+        application.return_value.listen.assert_called_once_with(0, rs485_master.LISTEN_ADDRESS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+from context import MAB_MGB_protocol, MAB_MGB_stream_decoder, MAB_MGB_slave_simulator
+import os
+import tty
+import asyncio
+import unittest
+
+import rs485_master
+
+class TestSimulator(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.simulator = MAB_MGB_slave_simulator(addresses=(MAB_MGB_protocol.MAB_ADDR,), reply_size=4, latency=0.001, seed=1)
+        self.master = rs485_master.rs485_Master()
+        self.master.connect(device_name=self.simulator.start(), device_baudrate=115200, protocol='mab_mgb')
+        await asyncio.sleep(0.1)
+
+    async def asyncTearDown(self):
+        self.master.disconnect()
+        await asyncio.sleep(0.05)
+        self.simulator.stop()
+
+    async def test_transact(self):
+        reply = await self.master.transact(addr=MAB_MGB_protocol.MAB_ADDR, cmd_code=0x10, payload='0102')
+        assert(reply['addr'] == MAB_MGB_protocol.MAB_ADDR)
+        assert(reply['cmd_code'] == 0x11)
+        assert(len(bytes.fromhex(reply['payload'])) == 4)
+        # ~ nobody answers for the other address
+        assert(await self.master.transact(addr=MAB_MGB_protocol.MGB_ADDR, cmd_code=0x10, timeout=0.02, retries=0) is False)
+        assert(self.simulator.stats["requests"] == 1)
+
+    async def test_crc_errors(self):
+        self.simulator.add_slave(MAB_MGB_protocol.MAB_ADDR, crc_error_rate=1.0)
+        reply = await self.master.transact(addr=MAB_MGB_protocol.MAB_ADDR, cmd_code=0x10, timeout=0.05, retries=1)
+        assert(reply is False)
+        assert(self.simulator.stats["corrupted"] == 2)
+        assert(self.master.mab_mgb.get_stats()["decode_errors"] == 2)
+
+
+class TestSimulatorOutput(unittest.IsolatedAsyncioTestCase):
+    async def test_no_partial_writes(self):
+        simulator = MAB_MGB_slave_simulator(seed=1)
+        fd = os.open(simulator.start(), os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        try:
+            protocol = MAB_MGB_protocol()
+            packets = [protocol.encode_msg(protocol.MAB_ADDR, 0x20, bytes([0x20 + i % 0x60]) * 200) for i in range(1000)]
+            # ~ far more than the pty buffer, all at once, with nobody reading
+            for packet in packets:
+                simulator._write(packet)
+            received = bytearray()
+            for _ in range(500):
+                try:
+                    received += os.read(fd, 65536)
+                except BlockingIOError:
+                    if len(received) >= sum(len(packet) for packet in packets):
+                        break
+                    await asyncio.sleep(0.01)
+            decoder = MAB_MGB_stream_decoder(protocol)
+            assert(len(decoder.feed(bytes(received))) == len(packets))
+            assert(decoder.errors == 0)
+        finally:
+            os.close(fd)
+            simulator.stop()
@@ -0,0 +1,70 @@
+from context import TrafficHistory, NO_ADDR, RX
+import unittest
+
+class TestTrafficHistory(unittest.TestCase):
+    def test_page_and_find(self):
+        history = TrafficHistory(max_records = 8, data_size = 64)
+        for i in range(5):
+            history.record_frame(RX, 200 + i, 10, bytes([i]) * 3, 1000 * i)
+        history.record_frame(RX, NO_ADDR, NO_ADDR, b'text\n', 5000)
+        assert(history.newest() == 6)
+        assert(history.oldest() == 0)
+        assert(history.page(limit = 2) == [
+            (4, 4000, RX, 204, 10, b'\x04\x04\x04'),
+            (5, 5000, RX, NO_ADDR, NO_ADDR, b'text\n')])
+        assert([r[0] for r in history.page(before = 4, limit = 3)] == [1, 2, 3])
+        assert([r[0] for r in history.page(before = 2, limit = 10)] == [0, 1])
+        assert(history.find(1999) == 2)
+        assert(history.find(2000) == 3)
+        assert(history.find(-1) == 0)
+        assert(history.find(9999) == 6)
+
+    def test_out_of_range(self):
+        history = TrafficHistory(max_records = 8, data_size = 64)
+        history.record_frame(RX, 10, 20, b'ok', 0)
+        for addr, cmd_code in ((-1, 20), (10, 256), (None, 1000)):
+            history.record_frame(RX, addr, cmd_code, b'bad', 1)
+        assert([r[3:5] for r in history.page()] == [(10, 20), (NO_ADDR, 20), (10, NO_ADDR), (NO_ADDR, NO_ADDR)])
+        # ~ the index by addr is not broken by a negative addr
+        assert([r[0] for r in history.query(addr = 10)] == [0, 2])
+
+    def test_overwrite_oldest(self):
+        history = TrafficHistory(max_records = 4, data_size = 64)
+        for i in range(10):
+            history.record_frame(RX, i, i, bytes([i]) * 2, i)
+        assert(history.oldest() == 6)
+        assert([r[0] for r in history.page(limit = 100)] == [6, 7, 8, 9])
+        assert(history.page(before = 6) == [])
+        assert(history.get(9) == (9, 9, RX, 9, 9, b'\x09\x09'))
+        # ~ limited by the data size rather than the number of records
+        history = TrafficHistory(max_records = 100, data_size = 16)
+        for i in range(10):
+            history.record_frame(RX, i, i, bytes([i]) * 5, i)
+        assert([r[0] for r in history.page()] == [7, 8, 9])
+        assert(history.find(0) == 7)
+
+    def test_query(self):
+        history = TrafficHistory(max_records = 64, data_size = 1024)
+        for i in range(40):
+            history.record_frame(RX, 200 + i % 2, 10 + i % 4, bytes([i]), i * 1000)
+        assert([r[0] for r in history.query(addr = 201, limit = 3)] == [35, 37, 39])
+        assert([r[0] for r in history.query(addr = 201, before = 35, limit = 3)] == [29, 31, 33])
+        assert([r[0] for r in history.query(cmd_code = 12, limit = 100)] == list(range(2, 40, 4)))
+        assert([r[0] for r in history.query(addr = 200, cmd_code = 12)] == list(range(2, 40, 4)))
+        assert(history.query(addr = 201, cmd_code = 12) == [])
+        assert(history.query(addr = 7) == [])
+        # ~ time range, both bounds included, by scanning and through the index
+        assert([r[0] for r in history.query(addr = 200, start = 30000, end = 34000)] == [30, 32, 34])
+        assert([r[0] for r in history.query(addr = 200, start = 2000, end = 6000)] == [2, 4, 6])
+        assert([r[0] for r in history.query(start = 38000)] == [38, 39])
+
+    def test_query_after_overwrite(self):
+        history = TrafficHistory(max_records = 8, data_size = 1024)
+        for i in range(20):
+            history.record_frame(RX, 200 + i % 2, 10, bytes([i]), i)
+        assert([r[0] for r in history.query(addr = 200, limit = 100)] == [12, 14, 16, 18])
+        assert([r[0] for r in history.query(cmd_code = 10, limit = 100)] == list(range(12, 20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
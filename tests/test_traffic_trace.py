@@ -0,0 +1,44 @@
+from context import TraceRing, RX, TX, install_dump_signal
+import os
+import signal
+import asyncio
+import unittest
+
+class TestTraceRing(unittest.TestCase):
+    def test_record_and_dump(self):
+        ring = TraceRing(max_records = 4, data_size = 16)
+        ring.record(TX, b'hello\n', 1700000000123456789)
+        ring.record(RX, b'\x02\x03', 1700000000123457789)
+        assert(ring.records() == [
+            (1700000000123456789, TX, b'hello\n'),
+            (1700000000123457789, RX, b'\x02\x03')])
+        lines = ring.dump()
+        assert(len(lines) == 2)
+        assert(".123456 TX 68 65 6c 6c 6f 0a" in lines[0])
+
+    def test_overwrite_oldest(self):
+        ring = TraceRing(max_records = 4, data_size = 16)
+        for i in range(10):
+            ring.record(RX, bytes([i]) * 5, i)
+        # ~ 16 bytes of data hold the last 3 records (of 5 bytes), the one wrapping around included
+        assert(ring.records() == [(i, RX, bytes([i]) * 5) for i in (7, 8, 9)])
+
+        ring.record(TX, bytes(range(40)), 10)
+        assert(ring.records() == [(10, TX, bytes(range(16)))])
+
+
+class TestDumpSignal(unittest.IsolatedAsyncioTestCase):
+    async def test_dump_on_signal(self):
+        ring = TraceRing(max_records = 4, data_size = 16, name = 'test')
+        ring.record(RX, b'\x02\x03', 1700000000123457789)
+        loop = asyncio.get_running_loop()
+        install_dump_signal(signal.SIGUSR1, loop)
+        self.addCleanup(loop.remove_signal_handler, signal.SIGUSR1)
+        with self.assertLogs(level = 'WARNING') as logs:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            await asyncio.sleep(0.05)
+        assert(any("RX 02 03" in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()